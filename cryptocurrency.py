@@ -6,7 +6,8 @@ Created by: Isaac Harasty
 import datetime
 import json
 import hashlib
-from flask import Flask, jsonify, request
+import threading
+from flask import Flask, Response, jsonify, request
 import requests
 from uuid import uuid4
 from urllib.parse import urlparse
@@ -16,11 +17,30 @@ from urllib.parse import urlparse
 class BlockChain:
 
     def __init__(self):
+        # Held while chain/memlist change, readers copy the list (see snapshot())
+        self.lock = threading.Lock()
         self.memlist = []
         self.chain = []
         self.create_block(nonce = 1, previous_hash = '0')
         self.nodes = set()
 
+    def create_block(self, nonce, previous_hash):
+        '''
+        Adds a block with the given nonce onto the chain without mining it,
+        used for the genesis block
+
+        :return: the block that was added
+        '''
+
+        block = {
+            'index': len(self.chain) + 1,
+            'timestamp': str(datetime.datetime.now()),
+            'nonce': nonce,
+            'previous_hash': previous_hash,
+            'transactions': []
+        }
+        return self.add_block(block)
+
     def add_block(self, block):
         '''
         Adds a block to the chain. Assumed that blocks are of the correct form.
@@ -29,21 +49,67 @@ class BlockChain:
         :return: the block that was added/inputted
         '''
 
-        self.chain.append(block)
+        with self.lock:
+            self.chain.append(block)
         return block
 
+    def snapshot(self, start=0, end=None):
+        '''
+        :return: a copy of the chain list (from start to end), so it can be
+        serialized while blocks keep being added
+        '''
+        with self.lock:
+            return list(self.chain[start:end])
+
+    def iter_blocks(self, start=0, end=None, batch_size=100):
+        '''
+        Generator over the blocks from start to end, copying batch_size at a
+        time so a long chain can be streamed without copying all of it
+        '''
+        with self.lock:
+            end = len(self.chain) if end is None else min(end, len(self.chain))
+        for i in range(start, end, batch_size):
+            for block in self.snapshot(i, min(i + batch_size, end)):
+                yield block
+
     def get_prev_block(self):
-        return self.chain[-1]
+        with self.lock:
+            return self.chain[-1]
+
+    def mine_block(self):
+        '''
+        Mines a block holding every pending transation onto the last block.
+        Mining doesn't hold the lock, so if the chain changed meanwhile (another
+        request mined a block, or replace_chain() swapped it) the block is
+        mined again on the new last block instead of being added out of place.
+
+        :return: the block that was added
+        '''
+
+        while True:
+            with self.lock:
+                previous_block = self.chain[-1]
+                transactions = list(self.memlist)
+
+            block = self.mine_new_block(previous_block, transactions)
 
-    def mine_new_block(self, previous_hash):
+            with self.lock:
+                if self.chain[-1] is previous_block:
+                    self.chain.append(block)
+                    # Transations only ever get appended, so these are the ones mined
+                    del self.memlist[:len(transactions)]
+                    return block
+
+    def mine_new_block(self, previous_block, transactions):
 
         new_nonce = 1
         check_nonce = False
         new_block = {
-            'index': len(self.chain) + 1,
+            'index': previous_block['index'] + 1,
             'timestamp': str(datetime.datetime.now()),
             'nonce': new_nonce,
-            'previous_hash': previous_hash
+            'previous_hash': self.hash(previous_block),
+            'transactions': transactions
         }
 
         while not check_nonce:
@@ -67,10 +133,8 @@ class BlockChain:
             block = chain[block_index]
             if block['previous_hash'] != self.hash(previous_block):
                 return False
-            previous_nonce = previous_block['nonce']
-            nonce = block['nonce']
-            hash_operation = hashlib.sha256(str(nonce ** 2 - previous_nonce ** 2).encode()).hexdigest()
-            if hash_operation[:4] != '0000':
+            # The same proof of work mine_new_block() looks for
+            if self.hash(block)[:4] != '0000':
                 return False
             previous_block = block
             block_index += 1
@@ -78,11 +142,12 @@ class BlockChain:
         return True
 
     def add_transation(self, sender, receiver, amount):
-        self.memlist.append({
-            'sender':sender,
-            'receiver': receiver,
-            'amount': amount
-        })
+        with self.lock:
+            self.memlist.append({
+                'sender':sender,
+                'receiver': receiver,
+                'amount': amount
+            })
 
         return self.get_prev_block()['index'] + 1
 
@@ -91,11 +156,14 @@ class BlockChain:
         self.nodes.add(parsed_url.netloc)
 
     def replace_chain(self):
-        network = self.nodes
+        network = list(self.nodes)
         longest_chain = None
         max_length = len(self.chain)
         for node in network:
-            response = requests.get(f'http://{node}/get_chain')
+            try:
+                response = requests.get(f'http://{node}/get_chain', timeout=10)
+            except requests.RequestException:
+                continue
             if response.status_code == 200:
                 length = response.json()['length']
                 chain =  response.json()['chain']
@@ -104,7 +172,11 @@ class BlockChain:
                     longest_chain = chain
 
         if longest_chain:
-            self.chain = longest_chain
+            with self.lock:
+                # Blocks may have been added while we were downloading
+                if len(longest_chain) <= len(self.chain):
+                    return False
+                self.chain = longest_chain
             return True
         return False
 
@@ -119,11 +191,7 @@ block_chain = BlockChain()
 @app.route('/mine_block', methods = ['GET'])
 def mine_block():
 
-    previous_block = block_chain.get_prev_block()
-    previous_hash = block_chain.hash(previous_block)
-    block = block_chain.find_new_block(previous_hash)
-    block_chain.add_block(block)
-
+    block = block_chain.mine_block()
     return jsonify(block), 200
 
 # Adding a new Transation to the block Chain
@@ -143,7 +211,7 @@ def add_transation():
 
 @app.route('/is_valid', methods = ['GET'])
 def is_valid():
-    is_valid = block_chain.is_chain_valid(block_chain.chain)
+    is_valid = block_chain.is_chain_valid(block_chain.snapshot())
     if is_valid:
         response = {'message': 'Our Blockchain is valid.'}
     else:
@@ -152,8 +220,20 @@ def is_valid():
 
 @app.route('/get_chain', methods = ['GET'])
 def get_chain():
-    response = {'chain': block_chain.chain,
-                'length': len(block_chain.chain)}
+
+    # ?from_height= and ?limit= for part of the chain, ?format=ndjson streams one block per line
+    start = max(request.args.get('from_height', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    end = None if limit is None else start + max(limit, 0)
+
+    if request.args.get('format') == 'ndjson':
+        lines = (json.dumps(block) + '\n' for block in block_chain.iter_blocks(start, end))
+        return Response(lines, mimetype='application/x-ndjson'), 200
+
+    chain = block_chain.snapshot(start, end)
+    response = {'chain': chain,
+                'length': len(block_chain.chain),
+                'from_height': start}
     return jsonify(response), 200
 
 # Part 3 - Decentralizing the Block Chain
@@ -173,18 +253,18 @@ def connect_node():
 # Replacing our chain with other chains if they're longer
 @app.route('/replace_chain', methods = ['GET'])
 def replace_chain():
-    is_chain_replace = block_chain.replace_chain(block_chain.chain)
+    is_chain_replace = block_chain.replace_chain()
     if is_chain_replace:
         response = {'message': 'Our Blockchain is not the longest. Has been updated.',
-                    'new_chain': block_chain.chain}
+                    'new_chain': block_chain.snapshot()}
     else:
         response = {'message': 'Our Blockchain is the longest. It has not been replaced.',
-                    'curr_chain': block_chain.chain}
+                    'curr_chain': block_chain.snapshot()}
     return jsonify(response)
 
 # Running the app
 if __name__ == '__main__':
-    app.run( host = '0.0.0.0', port=5000 )
+    app.run( host = '0.0.0.0', port=5000, threaded=True )
 
 
 
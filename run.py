@@ -23,14 +23,12 @@ isaac = User()
 lily = User()
 
 utxos = [Output(isaac.wal, 10), Output(isaac.wal, 20), Output(isaac.wal, 5)]
-unlocks = []
+to = [(lily.wal, 30), (isaac.wal, 2)]
+tx = Tx([], utxos, to)
 
 for utx in utxos:
-    sig = isaac.sign(utx.coin_hash)
+    sig = isaac.sign(tx.signature_message(utx.coin_hash))
     unlock = Input(utx.coin_hash, isaac.puk.export_key('PEM').decode('UTF-8'), sig)
-    unlocks.append(unlock)
-
-to = [(lily.wal, 30), (isaac.wal, 2)]
-tx = Tx(unlocks, utxos, to)
+    tx.unlock.append(unlock)
 
 print(tx.json())'''
\ No newline at end of file
@@ -0,0 +1,49 @@
+'''
+Fixtures shared by the tests. RSA keys are slow to generate, so the Users
+are made once per session.
+'''
+
+import pytest
+
+from wrking_crypto.blockchain import Block, BlockChain, MemList
+from wrking_crypto.relay import mined_copy
+from wrking_crypto.transaction import Tx
+from wrking_crypto.user import User
+
+
+@pytest.fixture(scope='session')
+def user():
+    return User()
+
+
+@pytest.fixture(scope='session')
+def other():
+    return User()
+
+
+@pytest.fixture
+def chain(user):
+    '''
+    BlockChain of three blocks mined by user, so it has three coins to spend
+    '''
+    chain = BlockChain(user.wal)
+    for _ in range(3):
+        chain.create_block()
+    return chain
+
+
+def mine_on(chain, previous_hash, height, txs=(), wallet='ee' * 20):
+    '''
+    Mines a block on top of any block chain has (not only its tip), paying
+    the reward and fees to wallet
+
+    :param txs: List of pending Tx objects to put in the block
+    :return: Block object, not added to chain
+    '''
+    fees = sum(tx.fee for tx in txs)
+    reward = Tx(None, None, [(wallet, MemList.MINING_REWARD + fees)], True, height)
+    reward.create_new_coins()
+    target = chain.config.next_target(height, chain.branch_lookup(previous_hash))
+    block = Block(height, previous_hash, [reward] + [mined_copy(tx) for tx in txs], target)
+    block.find_nonce()
+    return block
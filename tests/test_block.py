@@ -0,0 +1,64 @@
+import hashlib
+
+from wrking_crypto.blockchain import Block
+from wrking_crypto.miner import MiningStats
+
+TARGET = 2 ** 246
+
+
+def test_hash_is_prefix_plus_nonce():
+    block = Block(3, 'ab' * 32, [], TARGET)
+    block.nonce = 42
+    expected = hashlib.sha256(block.header_prefix() + (42).to_bytes(8, byteorder='big')).hexdigest()
+    assert block.hash() == expected
+    assert Block.hash_header(block.header()) == expected
+
+
+def test_find_nonce_finds_the_first_nonce():
+    block = Block(0, '0', [], TARGET)
+    block.find_nonce()
+    assert block.meets_target()
+
+    prefix = block.header_prefix()
+    for nonce in range(1, block.nonce):
+        digest = hashlib.sha256(prefix + nonce.to_bytes(8, byteorder='big')).digest()
+        assert int.from_bytes(digest, 'big') > TARGET
+
+
+def test_find_nonce_reports_progress():
+    samples = []
+    stats = MiningStats(interval=0, callback=samples.append, batch_size=50)
+    block = Block(7, '0', [], TARGET)
+    block.find_nonce(mining_stats=stats)
+
+    assert stats.blocks_mined == 1 and stats.total_attempts == block.nonce
+    assert samples[-1]['done'] and samples[-1]['index'] == 7
+    assert [sample['attempts'] for sample in samples[:-1]] == list(range(50, block.nonce, 50))
+
+
+def test_hash_cache_is_cleared_on_changes(chain):
+    block = Block(0, '0', list(chain.chain[1].transactions), TARGET)
+    block.nonce = 1
+    seen = {block.hash()}
+    assert block.cached_hash == block.hash()
+
+    for field, value in [('index', 1), ('nonce', 2), ('previous_hash', 'cd' * 32),
+                         ('time_stamp', '2026-01-01 00:00:00'), ('target', TARGET // 2)]:
+        setattr(block, field, value)
+        assert block.cached_hash is None
+        seen.add(block.hash())
+
+    block.transactions = list(chain.chain[2].transactions)
+    assert block.cached_hash is None
+    seen.add(block.hash())
+    assert len(seen) == 7
+
+
+def test_invalidate_hash_after_changing_transactions_in_place(chain):
+    block = Block(0, '0', list(chain.chain[1].transactions), TARGET)
+    root, block_hash = block.merkle_root, block.hash()
+
+    block.transactions.append(chain.chain[2].transactions[0])
+    assert block.hash() == block_hash
+    block.invalidate_hash()
+    assert block.merkle_root != root and block.hash() != block_hash
@@ -0,0 +1,151 @@
+import datetime
+
+import pytest
+
+from conftest import mine_on
+from test_utxo import pay
+from wrking_crypto import verify
+from wrking_crypto.blockchain import Block, BlockChain, ChainConfig
+from wrking_crypto.peers import PeerClient
+from wrking_crypto.user import User
+
+
+class ChainPeers(PeerClient):
+    '''
+    One peer, serving chain if it's longer than ours and is_valid passes
+    '''
+
+    def __init__(self, chain):
+        super().__init__()
+        self.chain = chain
+
+    def find_longest_chain(self, nodes, min_length, is_valid):
+        if len(self.chain) > min_length and is_valid(self.chain):
+            return 'peer:5000', self.chain
+        return None, None
+
+
+def copy_block(block):
+    return Block.deserialize(block.serialize())
+
+
+def bad_genesis(chain, field, value):
+    block = copy_block(chain.chain[0])
+    setattr(block, field, value)
+    # A target of 0 can't be met, the others are mined so only the field is wrong
+    if block.target:
+        block.find_nonce()
+    return block
+
+
+@pytest.mark.parametrize('field, value', [
+    ('target', 0), ('target', 2 ** 250), ('previous_hash', 'ab' * 32), ('index', 1), ('time_stamp', 'yesterday')
+], ids=['unmined', 'wrong_target', 'previous_hash', 'index', 'time_stamp'])
+def test_bad_genesis_is_rejected(chain, field, value):
+    genesis = bad_genesis(chain, field, value)
+
+    node = BlockChain(User().wal, peers=ChainPeers([genesis]))
+    node.add_node('http://peer:5000')
+    assert not node.is_chain_valid([genesis])
+    assert not node.replace_chain()
+    assert len(node.chain) == 0
+
+    chain.chain[0] = genesis
+    chain.set_validated(-1, None)
+    assert not chain.is_chain_valid()
+
+
+def test_peer_chain_is_checked_from_genesis(chain):
+    node = BlockChain(User().wal, peers=ChainPeers(list(chain.chain)))
+    node.add_node('http://peer:5000')
+    assert node.is_chain_valid(list(chain.chain))
+    assert node.replace_chain()
+    assert [block.hash() for block in node.chain] == [block.hash() for block in chain.chain]
+
+
+def test_only_blocks_after_validated_height_are_checked(chain):
+    assert chain.is_chain_valid()
+    assert chain.validated_height == 2
+
+    block = chain.create_block()
+    block.previous_hash = 'ab' * 32
+    assert not chain.is_chain_valid()
+    assert chain.validated_height == 2
+
+
+def test_header_is_checked_before_signatures(chain, monkeypatch):
+    checked = []
+    monkeypatch.setattr(verify, 'verify_block', lambda block: checked.append(block) or {})
+
+    # Meets its own target easily, but isn't the target the chain expects
+    block = mine_on(chain, chain.get_hash(2), 3)
+    block.target = 2 ** 256 - 1
+    assert not chain.add_block(block)
+    assert not chain.add_block(mine_on(chain, 'ab' * 32, 3))
+    assert checked == []
+
+    assert chain.add_block(mine_on(chain, chain.get_hash(2), 3))
+    assert len(checked) == 1
+
+
+def block_at(chain, time_stamp):
+    block = mine_on(chain, chain.get_hash(2), 3)
+    block.time_stamp = time_stamp
+    block.find_nonce()
+    return block
+
+
+@pytest.mark.parametrize('time_stamp', [
+    'yesterday', 5, '2026-01-01T00:00:00+00:00',
+    str(datetime.datetime.now() + datetime.timedelta(hours=3))
+])
+def test_bad_time_stamps_are_rejected(chain, time_stamp):
+    block = block_at(chain, time_stamp)
+    assert not chain.add_block(block)
+    assert not chain.headers_valid([block.header()], 3, chain.get_hash(2))
+
+    chain.chain.append(block)
+    assert not chain.is_chain_valid()
+
+
+def test_time_stamp_must_be_after_median(chain):
+    assert not chain.add_block(block_at(chain, chain.chain[0].time_stamp))
+    assert chain.add_block(block_at(chain, str(datetime.datetime.now())))
+
+
+def test_create_block_after_clock_falls_behind(chain):
+    # Blocks from a peer whose clock is ahead of ours, within max_future_time
+    ahead = datetime.datetime.now() + datetime.timedelta(minutes=30)
+    for i in range(3):
+        block = mine_on(chain, chain.get_hash(len(chain.chain) - 1), len(chain.chain))
+        block.time_stamp = str(ahead + datetime.timedelta(seconds=i))
+        block.find_nonce()
+        assert chain.add_block(block)
+
+    block = chain.create_block()
+    assert chain.get_hash(len(chain.chain) - 1) == block.hash()
+    assert chain.is_chain_valid()
+
+
+def test_target_retargets_with_block_times():
+    config = ChainConfig(initial_target=2 ** 240, retarget_window=4, block_interval=10)
+    start = datetime.datetime(2026, 1, 1)
+
+    def times(interval):
+        return lambda height: (str(start + datetime.timedelta(seconds=interval * height)), 2 ** 240)
+
+    assert config.next_target(3, times(1)) == 2 ** 240
+    # Blocks came 10 times too fast/slow, the change is capped at 4 times
+    assert config.next_target(4, times(1)) == 2 ** 238
+    assert config.next_target(4, times(100)) == 2 ** 242
+    assert config.next_target(4, times(5)) == 2 ** 239
+
+
+def test_memlist_rejects_conflicting_tx(user, chain):
+    first = pay(user, chain, 0, 'aa' * 20, 10)
+    second = pay(user, chain, 0, 'bb' * 20, 10, fee=5)
+    assert chain.add_transation(first)
+    assert not chain.add_transation(second)
+
+    block = chain.create_block()
+    assert [tx.tx_hash for tx in block.transactions[1:]] == [first.tx_hash]
@@ -0,0 +1,81 @@
+import pytest
+
+from wrking_crypto import builder
+from wrking_crypto.builder import TxBuilder
+from wrking_crypto.coin import Output
+
+
+def make_coins(wallet, amounts):
+    return [Output(wallet, amount, ('ab' * 20, i)) for i, amount in enumerate(amounts)]
+
+
+def amounts(coins):
+    return sorted(coin.amount for coin in coins)
+
+
+def test_largest_first():
+    coins = make_coins('aa' * 20, [5, 50, 20, 1])
+    assert amounts(builder.select_largest_first(coins, 60)) == [20, 50]
+    assert amounts(builder.select_largest_first(coins, 50)) == [50]
+    assert builder.select_largest_first(coins, 77) is None
+
+
+def test_branch_and_bound_finds_exact_match():
+    coins = make_coins('aa' * 20, [50, 30, 20, 7, 3])
+    # Largest first would take 50 + 30 and need a change coin
+    assert amounts(builder.select_branch_and_bound(coins, 60)) == [3, 7, 50]
+    assert amounts(builder.select_branch_and_bound(coins, 27)) == [7, 20]
+
+
+def test_branch_and_bound_within_excess():
+    coins = make_coins('aa' * 20, [40, 25, 9])
+    assert amounts(builder.select_branch_and_bound(coins, 33, max_excess=1)) == [9, 25]
+    assert amounts(builder.select_branch_and_bound(coins, 33, max_excess=0)) == [40]
+
+
+def test_branch_and_bound_falls_back():
+    coins = make_coins('aa' * 20, [10, 10, 10])
+    assert amounts(builder.select_branch_and_bound(coins, 15)) == [10, 10]
+    assert builder.select_branch_and_bound(coins, 31) is None
+
+
+def test_consolidation_takes_smallest():
+    coins = make_coins('aa' * 20, [1, 2, 3, 100])
+    assert amounts(builder.select_consolidation(coins, 5, max_inputs=3)) == [1, 2, 3]
+    assert amounts(builder.select_consolidation(coins, 50, max_inputs=3)) == [100]
+
+
+def test_build_adds_change(user, other, chain):
+    coins = chain.get_wallet_coins(user.wal)[1]
+    tx = TxBuilder(user, 'largest_first', fee=2).add_recipient(other.wal, 10).build(coins[:1])
+    total = coins[0].amount
+    assert tx.json()['sent_coins'][0]['amount'] == 10
+    assert tx.json()['sent_coins'][1]['lock'] == user.wal
+    assert tx.json()['sent_coins'][1]['amount'] == total - 12
+    assert chain.add_transation(tx)
+
+
+def test_build_batches_spend_different_coins(user, chain):
+    coins = chain.get_wallet_coins(user.wal)[1]
+    payer = TxBuilder(user, max_outputs=2)
+    for i in range(5):
+        payer.add_recipient('%02x' % i * 20, 1)
+
+    txs = payer.build_batches(coins)
+    assert [len(tx.sent_coins) for tx in txs] == [3, 3, 2]
+    spent = [coin.coin_hash for tx in txs for coin in tx.owned_coins]
+    assert len(spent) == len(set(spent))
+    assert all(chain.add_transation(tx) for tx in txs)
+
+
+def test_builder_rejects_bad_input(user):
+    with pytest.raises(ValueError):
+        TxBuilder(user, 'no_such_strategy')
+    with pytest.raises(ValueError):
+        TxBuilder(user, fee=-1)
+    with pytest.raises(ValueError):
+        TxBuilder(user).add_recipient('aa' * 20, 0)
+    with pytest.raises(ValueError):
+        TxBuilder(user).build([])
+    with pytest.raises(ValueError):
+        TxBuilder(user).add_recipient('aa' * 20, 10).build(make_coins(user.wal, [5]))
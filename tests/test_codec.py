@@ -0,0 +1,79 @@
+import pytest
+
+from wrking_crypto import codec
+from wrking_crypto.blockchain import Block
+from wrking_crypto.builder import TxBuilder
+
+
+@pytest.fixture
+def spent_chain(chain, user, other):
+    '''
+    chain with a fourth block holding a Tx paying other, so blocks have
+    Inputs, Outputs with outpoints and change coins to encode
+    '''
+    tx = TxBuilder(user).add_recipient(other.wal, 10).build(chain.get_wallet_coins(user.wal)[1][:1])
+    assert chain.add_transation(tx)
+    chain.create_block()
+    return chain
+
+
+def test_tx_round_trip(spent_chain):
+    tx = spent_chain.chain[3].transactions[1]
+    decoded = codec.decode_tx(codec.encode_tx(tx), mined=True)
+    assert decoded.tx_hash == tx.tx_hash
+    assert decoded.json() == tx.json()
+
+
+def test_pending_tx_decodes_as_pending(user, chain):
+    tx = TxBuilder(user).add_recipient('aa' * 20, 5).build(chain.get_wallet_coins(user.wal)[1][:1])
+    decoded = codec.decode_tx(codec.encode_tx(tx))
+    assert decoded.sent_coins == [('aa' * 20, 5), (user.wal, tx.json()['sent_coins'][1]['amount'])]
+    assert chain.add_transation(decoded)
+
+
+def test_block_round_trip(spent_chain):
+    for block in spent_chain.chain:
+        decoded = codec.decode_block(codec.encode_block(block))
+        assert decoded.hash() == block.hash()
+        assert decoded.json() == block.json()
+
+
+def test_chain_round_trip(spent_chain):
+    blocks = list(spent_chain.chain)
+    decoded = codec.decode_chain(codec.encode_chain(blocks))
+    assert [block.hash() for block in decoded] == [block.hash() for block in blocks]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 20])
+def test_chain_stream_round_trip(spent_chain, chunk_size):
+    blocks = list(spent_chain.chain)
+    payload = b''.join(codec.encode_chain_stream(blocks))
+    chunks = [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)]
+    decoded = list(codec.decode_chain_stream(chunks))
+    assert [block.hash() for block in decoded] == [block.hash() for block in blocks]
+
+
+def test_stream_ending_early_raises(spent_chain):
+    payload = b''.join(codec.encode_chain_stream(spent_chain.chain))
+    with pytest.raises(ValueError):
+        list(codec.decode_chain_stream([payload[:-1]]))
+
+
+def test_truncated_block_raises(spent_chain):
+    data = codec.encode_block(spent_chain.chain[3])
+    with pytest.raises(ValueError):
+        codec.decode_block(data[:len(data) // 2])
+
+
+def test_unknown_version_raises(spent_chain):
+    data = bytearray(codec.encode_block(spent_chain.chain[0]))
+    data[0] = codec.VERSION + 1
+    with pytest.raises(ValueError):
+        codec.decode_block(bytes(data))
+
+
+def test_serialize_recomputes_hashes(spent_chain):
+    block = spent_chain.chain[3]
+    decoded = Block.deserialize(block.serialize())
+    assert decoded.merkle_root == block.merkle_root
+    assert decoded.hash() == block.hash()
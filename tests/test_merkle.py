@@ -0,0 +1,76 @@
+import hashlib
+
+import pytest
+
+from wrking_crypto import merkle
+from wrking_crypto.blockchain import Block
+
+
+def tx_hashes(count):
+    return [hashlib.sha1(str(i).encode()).hexdigest() for i in range(count)]
+
+
+@pytest.mark.parametrize('count', range(1, 10))
+def test_every_proof_verifies(count):
+    hashes = tx_hashes(count)
+    root = merkle.merkle_root(hashes)
+    for index, tx_hash in enumerate(hashes):
+        assert merkle.verify_proof(tx_hash, merkle.merkle_proof(hashes, index), root)
+
+
+def test_proof_is_logarithmic():
+    hashes = tx_hashes(1000)
+    assert len(merkle.merkle_proof(hashes, 500)) == 10
+
+
+def test_proof_for_another_tx_fails():
+    hashes = tx_hashes(5)
+    root = merkle.merkle_root(hashes)
+    assert not merkle.verify_proof(hashes[1], merkle.merkle_proof(hashes, 2), root)
+
+
+def test_tampered_proof_fails():
+    hashes = tx_hashes(6)
+    root = merkle.merkle_root(hashes)
+    proof = merkle.merkle_proof(hashes, 3)
+
+    flipped = [('R' if side == 'L' else 'L', sibling) for side, sibling in proof]
+    assert not merkle.verify_proof(hashes[3], flipped, root)
+    assert not merkle.verify_proof(hashes[3], [('X', proof[0][1])] + proof[1:], root)
+    assert not merkle.verify_proof(hashes[3], [(proof[0][0], 'not hex')] + proof[1:], root)
+    assert not merkle.verify_proof(hashes[3], proof, merkle.merkle_root(hashes[:5]))
+
+
+def test_leaf_can_not_pose_as_parent():
+    # Without the leaf/node prefixes, the two children of a root would
+    # prove a "tx" whose hash is their concatenation
+    hashes = tx_hashes(2)
+    left, right = merkle.hash_leaf(hashes[0]), merkle.hash_leaf(hashes[1])
+    assert merkle.merkle_root(hashes) != merkle.merkle_root([(left + right).hex()])
+
+
+def test_odd_level_is_not_duplicated():
+    hashes = tx_hashes(3)
+    assert merkle.merkle_root(hashes) != merkle.merkle_root(hashes + hashes[2:])
+
+
+def test_out_of_range_index_raises():
+    with pytest.raises(IndexError):
+        merkle.merkle_proof(tx_hashes(3), 3)
+
+
+def test_block_proofs(chain):
+    block = chain.chain[1]
+    tx_hash = block.transactions[0].tx_hash
+    proof = block.merkle_proof(tx_hash)
+    assert Block.verify_tx_proof(tx_hash, proof, block.merkle_root)
+    assert block.merkle_proof('ff' * 20) is None
+
+
+def test_from_json_checks_merkle_root(chain):
+    data = chain.chain[1].json()
+    assert Block.from_json(data).hash() == chain.chain[1].hash()
+
+    data['merkle_root'] = merkle.merkle_root(['ff' * 20])
+    with pytest.raises(ValueError):
+        Block.from_json(data)
@@ -0,0 +1,82 @@
+from wrking_crypto.blockchain import Block, BlockChain
+from wrking_crypto import interface
+from wrking_crypto.miner import Miner, MiningStats
+
+# About one hash in 4096 meets it, so a block takes a few thousand attempts
+TARGET = 2 ** 244
+
+
+def test_miner_splits_the_search():
+    block = Block(0, '0', [], TARGET)
+    miner = Miner(processes=2, batch_size=500)
+    nonce = miner.mine(block, block.target)
+
+    assert block.nonce == nonce and block.meets_target()
+    assert [stat['worker'] for stat in miner.stats] == [0, 1]
+    # Worker i tries nonces 1 + i, 3 + i, ... The other worker may not have
+    # started before this one finds the nonce
+    finder = miner.stats[(nonce - 1) % 2]
+    assert finder['attempts'] >= (nonce - 1) // 2 + 1
+
+
+def test_single_process_miner_finds_the_first_nonce():
+    block = Block(0, '0', [], TARGET)
+    expected = Block(0, '0', [], TARGET)
+    expected.time_stamp = block.time_stamp
+    expected.find_nonce()
+
+    assert Miner(processes=1).mine(block, block.target) == expected.nonce
+
+
+def test_chain_mines_with_a_miner(user):
+    chain = BlockChain(user.wal, miner=Miner(processes=2))
+    for _ in range(3):
+        chain.create_block()
+    assert len(chain.chain) == 3
+    assert chain.is_chain_valid()
+
+
+def test_stats_only_sample_every_interval():
+    samples = []
+    stats = MiningStats(interval=3600, callback=samples.append)
+    stats.start(5)
+    stats.progress(100)
+    stats.progress(200)
+    assert samples == [] and stats.block_attempts == 200
+
+    stats.finish(250)
+    assert [(sample['index'], sample['attempts'], sample['done']) for sample in samples] == [(5, 250, True)]
+    assert stats.mining is None and stats.last_sample is samples[-1]
+
+
+def test_stats_total_over_blocks():
+    stats = MiningStats()
+    for index, attempts in enumerate([100, 300]):
+        stats.start(index)
+        stats.finish(attempts)
+
+    data = stats.json()
+    assert data['blocks_mined'] == 2 and data['total_attempts'] == 400
+    assert data['hash_rate'] == stats.hash_rate() > 0
+    assert data['last_sample']['attempts'] == 300
+
+
+def test_miner_reports_to_stats():
+    samples = []
+    stats = MiningStats(interval=0.001, callback=samples.append)
+    miner = Miner(processes=2, batch_size=100)
+    miner.mine(Block(4, '0', [], TARGET // 16), TARGET // 16, stats)
+
+    assert samples[-1]['done'] and samples[-1]['index'] == 4
+    assert stats.blocks_mined == 1
+    assert stats.total_attempts == sum(stat['attempts'] for stat in miner.stats)
+
+
+def test_mining_stats_endpoint(monkeypatch, user):
+    chain = BlockChain(user.wal)
+    chain.create_block()
+    monkeypatch.setattr(interface, 'block_chain', chain)
+
+    data = interface.app.test_client().get('/mining_stats').get_json()
+    assert data['blocks_mined'] == 1 and data['mining'] is None
+    assert data['total_attempts'] == chain.chain[0].nonce
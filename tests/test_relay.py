@@ -0,0 +1,110 @@
+import pytest
+
+from conftest import mine_on
+from test_utxo import pay
+from wrking_crypto import interface
+from wrking_crypto.blockchain import BlockChain
+from wrking_crypto.relay import BlockRelay, TxRelay, make_compact
+
+
+def test_relay_skips_badly_signed_copy(user, chain):
+    tx = pay(user, chain, 0, 'aa' * 20, 10)
+    forged = tx.json()
+    forged['unlock'][0]['sig'] = [0] * len(forged['unlock'][0]['sig'])
+
+    relay = TxRelay(chain)
+    assert relay.receive([forged]) == ([], [tx.tx_hash])
+    assert relay.receive([forged]) == ([], [])
+    assert relay.receive([tx.json()]) == ([tx.tx_hash], [])
+    assert tx.tx_hash in chain.memlist
+
+
+def test_relay_retries_tx_rejected_for_our_state(user, chain):
+    # A node that hasn't got the block making the coin yet
+    node = BlockChain(user.wal)
+    for block in chain.chain[:2]:
+        assert node.add_block(block)
+    tx = pay(user, chain, 2, 'aa' * 20, 10)
+
+    relay = TxRelay(node)
+    assert relay.receive([tx.json()]) == ([], [tx.tx_hash])
+    assert node.add_block(chain.chain[2])
+    assert relay.receive([tx.json()]) == ([tx.tx_hash], [])
+
+
+def test_relay_retries_tx_rejected_for_a_conflict(user, chain):
+    first = pay(user, chain, 0, 'aa' * 20, 10)
+    second = pay(user, chain, 0, 'bb' * 20, 10, fee=5)
+
+    relay = TxRelay(chain)
+    assert relay.receive([first.json()]) == ([first.tx_hash], [])
+    assert relay.receive([second.json()]) == ([], [second.tx_hash])
+    chain.memlist.remove_tx(first.tx_hash)
+    assert relay.receive([second.json()]) == ([second.tx_hash], [])
+
+
+@pytest.fixture
+def node(monkeypatch, other, chain):
+    '''
+    BlockChain with the same blocks as chain, behind interface.app
+    '''
+    node = BlockChain(other.wal)
+    for block in chain.chain:
+        assert node.add_block(block)
+    monkeypatch.setattr(interface, 'block_chain', node)
+    monkeypatch.setattr(interface, 'block_relay', BlockRelay(node))
+    return node
+
+
+def test_compact_block_is_rebuilt_from_the_memlist(user, chain, node):
+    tx = pay(user, chain, 0, 'aa' * 20, 10)
+    assert chain.add_transation(tx) and node.add_transation(tx)
+    block = chain.create_block()
+
+    client = interface.app.test_client()
+    assert client.post('/cmpct_block', json=make_compact(block)).get_json() == {'status': 'added'}
+    assert node.get_hash(3) == block.hash()
+    assert tx.tx_hash not in node.memlist
+    assert client.post('/cmpct_block', json=make_compact(block)).get_json() == {'status': 'known'}
+
+
+def test_missing_tx_are_sent_with_block_txn(user, chain, node):
+    tx = pay(user, chain, 0, 'aa' * 20, 10)
+    assert chain.add_transation(tx)
+    block = chain.create_block()
+
+    client = interface.app.test_client()
+    reply = client.post('/cmpct_block', json=make_compact(block)).get_json()
+    assert reply == {'status': 'missing', 'missing': [1]}
+    reply = client.post('/block_txn', json={'hash': block.hash(), 'txs': [tx.json()]}).get_json()
+    assert reply == {'status': 'added'}
+    assert node.get_hash(3) == block.hash()
+
+    # Only once, the partial block is gone now
+    reply = client.post('/block_txn', json={'hash': block.hash(), 'txs': [tx.json()]}).get_json()
+    assert reply == {'status': 'need_block'}
+
+
+@pytest.mark.parametrize('index', [-1, 1, True, '0', None])
+def test_bad_prefilled_index_is_rejected(chain, node, index):
+    compact = make_compact(mine_on(chain, chain.get_hash(2), 3))
+    compact['prefilled'][0]['index'] = index
+
+    response = interface.app.test_client().post('/cmpct_block', json=compact)
+    assert response.status_code == 400
+    assert len(node.chain) == 3
+
+
+def test_mine_block_only_announces_blocks_on_the_chain(chain, node, monkeypatch):
+    announced = []
+    monkeypatch.setattr(interface.block_relay, 'announce', announced.append)
+    client = interface.app.test_client()
+
+    assert client.get('/mine_block').status_code == 200
+    assert [block.hash() for block in announced] == [node.get_hash(3)]
+
+    # Another node's block got in first, ours isn't on the chain
+    side = mine_on(node, node.get_hash(2), 3)
+    monkeypatch.setattr(node, 'create_block', lambda: side)
+    assert client.get('/mine_block').status_code == 200
+    assert len(announced) == 1
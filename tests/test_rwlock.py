@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from wrking_crypto.rwlock import RWLock
+
+WAIT = 5
+
+
+def run(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_readers_share_the_lock():
+    lock = RWLock()
+    inside = threading.Barrier(3, timeout=WAIT)
+
+    def reader():
+        with lock.read():
+            # Only passes once all three readers hold the lock at once
+            inside.wait()
+
+    threads = [run(reader) for _ in range(3)]
+    for thread in threads:
+        thread.join(WAIT)
+    assert not inside.broken
+    assert lock.readers == 0
+
+
+def test_writer_waits_for_readers():
+    lock = RWLock()
+    written = threading.Event()
+
+    def writer():
+        with lock.write():
+            written.set()
+
+    with lock.read():
+        thread = run(writer)
+        assert not written.wait(0.2)
+    thread.join(WAIT)
+    assert written.is_set()
+
+
+def test_readers_wait_for_writer():
+    lock = RWLock()
+    read = threading.Event()
+
+    def reader():
+        with lock.read():
+            read.set()
+
+    with lock.write():
+        thread = run(reader)
+        assert not read.wait(0.2)
+    thread.join(WAIT)
+    assert read.is_set()
+
+
+def test_waiting_writer_goes_before_new_readers():
+    lock = RWLock()
+    order = []
+
+    def writer():
+        with lock.write():
+            order.append('write')
+
+    def reader():
+        with lock.read():
+            order.append('read')
+
+    with lock.read():
+        writer_thread = run(writer)
+        while not lock.waiting_writers:
+            time.sleep(0.01)
+        reader_thread = run(reader)
+        time.sleep(0.2)
+        assert order == []
+
+    writer_thread.join(WAIT)
+    reader_thread.join(WAIT)
+    assert order == ['write', 'read']
+
+
+def test_reentrant():
+    lock = RWLock()
+    with lock.write():
+        with lock.write():
+            with lock.read():
+                assert lock.writer == threading.get_ident()
+    assert lock.writer is None
+
+    with lock.read():
+        with lock.read():
+            assert lock.readers == 1
+    assert lock.readers == 0
+
+
+def test_upgrade_raises():
+    lock = RWLock()
+    with lock.read():
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+    # The failed upgrade left the lock usable
+    with lock.write():
+        pass
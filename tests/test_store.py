@@ -0,0 +1,83 @@
+import os
+
+from test_utxo import pay, state
+from wrking_crypto.blockchain import Block, BlockChain
+from wrking_crypto.store import INDEX_RECORD, BlockStore, StoredChain
+
+
+def fill(store, chain):
+    for block in chain.chain:
+        store.append(block.hash(), block.serialize())
+
+
+def test_reopened_store_has_the_same_blocks(chain, tmp_path):
+    store = BlockStore(str(tmp_path), segment_size=1)
+    fill(store, chain)
+
+    reopened = BlockStore(str(tmp_path))
+    assert len(reopened) == 3
+    assert [reopened.get_hash(height) for height in range(3)] == [block.hash() for block in chain.chain]
+    assert reopened.height_of(chain.get_hash(2)) == 2
+    # A segment_size of one byte puts every block in its own segment file
+    assert [position[0] for position in reopened.positions] == [0, 1, 2]
+    assert Block.deserialize(reopened.read(1)).hash() == chain.get_hash(1)
+
+
+def test_partly_written_blocks_are_dropped(chain, tmp_path):
+    store = BlockStore(str(tmp_path))
+    fill(store, chain)
+    segment, offset, length = store.positions[-1]
+
+    # A crash half way through an index record, and one whose block never reached the segment
+    with open(store.index_path(), 'ab') as f:
+        f.write(INDEX_RECORD.pack(b'\xaa' * 32, segment, offset + 4 + length, 100))
+        f.write(b'\x00' * 10)
+
+    reopened = BlockStore(str(tmp_path))
+    assert len(reopened) == 3
+    assert os.path.getsize(reopened.index_path()) == 3 * INDEX_RECORD.size
+    assert reopened.height_of('aa' * 32) is None
+
+
+def test_truncate_survives_a_restart(chain, tmp_path):
+    store = BlockStore(str(tmp_path))
+    fill(store, chain)
+    store.truncate(1)
+    assert store.height_of(chain.get_hash(1)) is None
+
+    # The next block overwrites what was truncated
+    store.append(chain.get_hash(2), chain.chain[2].serialize())
+    reopened = BlockStore(str(tmp_path))
+    assert [reopened.get_hash(height) for height in range(len(reopened))] == [chain.get_hash(0), chain.get_hash(2)]
+    assert Block.deserialize(reopened.read(1)).hash() == chain.get_hash(2)
+
+
+def test_stored_chain_restarts(user, other, tmp_path):
+    chain = BlockChain(user.wal, store=BlockStore(str(tmp_path)))
+    for _ in range(3):
+        chain.create_block()
+    assert chain.add_transation(pay(user, chain, 0, other.wal, 10))
+    chain.create_block()
+    hashes = [chain.get_hash(height) for height in range(4)]
+    chain.save_state()
+
+    restarted = BlockChain(user.wal, store=BlockStore(str(tmp_path)))
+    assert [block.hash() for block in restarted.chain] == hashes
+    assert state(restarted.utxos) == state(chain.utxos)
+    assert restarted.get_balance(other.wal) == 10
+    assert restarted.is_chain_valid()
+
+    # Without a snapshot the index is rebuilt from the blocks
+    os.remove(chain.store.state_path('utxos'))
+    rebuilt = BlockChain(user.wal, store=BlockStore(str(tmp_path)))
+    assert state(rebuilt.utxos) == state(chain.utxos)
+
+
+def test_stored_chain_replaces_its_end(chain, tmp_path):
+    stored = StoredChain(BlockStore(str(tmp_path)), Block.serialize, Block.deserialize, cache_size=1)
+    stored[:] = chain.chain[:2]
+    stored[1:] = chain.chain[1:]
+
+    assert [block.hash() for block in stored] == [block.hash() for block in chain.chain]
+    assert stored[-1].hash() == chain.get_hash(2) and stored.height_of(chain.get_hash(0)) == 0
+    assert len(BlockStore(str(tmp_path))) == 3
@@ -0,0 +1,234 @@
+'''
+Syncing against a stand-in peer: PeerClient's requests go to interface.app
+in this process, serving whichever chain the test puts behind it, instead
+of over HTTP.
+'''
+
+import json
+
+import pytest
+
+from conftest import mine_on
+from wrking_crypto import codec, interface
+from wrking_crypto.blockchain import BlockChain
+from wrking_crypto.builder import TxBuilder
+from wrking_crypto.peers import PeerClient
+from wrking_crypto.user import User
+
+PEER = 'peer:5000'
+
+
+class AppResponse():
+    '''
+    The parts of a requests Response that PeerClient uses, over a Flask
+    test response
+    '''
+
+    def __init__(self, response):
+        self.response = response
+        self.content = response.data
+
+    def json(self):
+        data = self.response.get_json(silent=True)
+        if data is None:
+            raise ValueError('Not JSON')
+        return data
+
+    def iter_content(self, chunk_size):
+        return (self.content[i:i + chunk_size] for i in range(0, len(self.content), chunk_size))
+
+    def close(self):
+        pass
+
+
+class AppPeers(PeerClient):
+    '''
+    Every node is served by interface.app, except the ones in down which
+    don't answer
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.paths = []
+        self.down = set()
+
+    def get(self, node, path, params=None, stream=False):
+        if node in self.down:
+            return None
+        self.paths.append((path, params))
+        response = interface.app.test_client().get(path, query_string=params)
+        if response.status_code != 200:
+            return None
+        return AppResponse(response)
+
+
+class ReplyPeers(PeerClient):
+    '''
+    Peer answering every JSON request with the same reply
+    '''
+
+    def __init__(self, reply):
+        super().__init__()
+        self.reply = reply
+
+    def get_json(self, node, path, params=None):
+        return self.reply
+
+
+@pytest.fixture
+def peer_chain(monkeypatch, user, other):
+    '''
+    Five block chain with a spend in it, served by interface.app
+    '''
+    chain = BlockChain(user.wal)
+    for _ in range(3):
+        chain.create_block()
+    tx = TxBuilder(user).add_recipient(other.wal, 10).build(chain.get_wallet_coins(user.wal)[1][:1])
+    assert chain.add_transation(tx)
+    chain.create_block()
+    chain.create_block()
+
+    monkeypatch.setattr(interface, 'block_chain', chain)
+    return chain
+
+
+@pytest.fixture
+def node():
+    chain = BlockChain(User().wal, peers=AppPeers())
+    chain.create_block()
+    chain.add_node('http://' + PEER)
+    return chain
+
+
+def hashes(chain):
+    return [block.hash() for block in chain.chain]
+
+
+def test_sync_takes_longer_chain(peer_chain, node, other):
+    assert node.sync()
+    assert hashes(node) == hashes(peer_chain)
+    assert node.get_balance(other.wal) == 10
+    assert node.is_chain_valid()
+
+
+def test_sync_only_downloads_new_blocks(peer_chain, node):
+    assert node.sync()
+    peer_chain.create_block()
+    peer_chain.create_block()
+
+    node.peers.paths = []
+    assert node.sync()
+    assert hashes(node) == hashes(peer_chain)
+
+    headers = [params for path, params in node.peers.paths if path == '/get_headers']
+    assert headers[0]['locator'].split(',')[0] == peer_chain.get_hash(4)
+    blocks = [path for path, params in node.peers.paths if path.startswith('/get_block/')]
+    assert blocks == ['/get_block/%s' % block_hash for block_hash in hashes(peer_chain)[5:]]
+
+
+def test_sync_keeps_longer_own_chain(peer_chain, node):
+    for _ in range(5):
+        node.create_block()
+    own = hashes(node)
+    assert not node.sync()
+    assert hashes(node) == own
+
+
+def test_replace_chain_streams_peer_chain(peer_chain, node, other):
+    assert node.replace_chain()
+    assert hashes(node) == hashes(peer_chain)
+    assert node.get_balance(other.wal) == 10
+
+
+def test_replace_chain_keeps_longer_own_chain(peer_chain, node):
+    for _ in range(5):
+        node.create_block()
+    own = hashes(node)
+    assert not node.replace_chain()
+    assert hashes(node) == own
+
+
+def test_replace_chain_skips_unreachable_peer(peer_chain, node, other):
+    node.add_node('http://unreachable:5000')
+    node.peers.down.add('unreachable:5000')
+    assert node.replace_chain()
+    assert hashes(node) == hashes(peer_chain)
+
+
+def test_tampered_block_is_rejected(peer_chain, node, monkeypatch):
+    tampered = codec.decode_block(codec.encode_block(peer_chain.chain[4]))
+    tampered.nonce += 1
+    served = peer_chain.get_block_by_hash
+    monkeypatch.setattr(peer_chain, 'get_block_by_hash', lambda block_hash:
+                        tampered if block_hash == peer_chain.get_hash(4) else served(block_hash))
+
+    own = hashes(node)
+    assert not node.sync()
+    assert hashes(node) == own
+
+
+@pytest.mark.parametrize('reply', [
+    None, [], {'headers': []}, {'start': 'x', 'headers': [], 'length': 9},
+    {'start': 0, 'headers': 'abc', 'length': 9}, {'start': 0, 'headers': [1], 'length': 9},
+    {'start': -1, 'headers': [], 'length': 9}, {'start': 0, 'headers': [], 'length': True},
+    {'start': 0, 'headers': [{'index': 0}], 'length': 9}, {'length': 'many'}
+])
+def test_malformed_replies_do_not_crash_sync(reply):
+    chain = BlockChain(User().wal, peers=ReplyPeers(reply))
+    chain.add_node('http://' + PEER)
+    assert not chain.sync()
+    assert not chain.sync_with(PEER)
+    assert len(chain.chain) == 0
+
+
+def test_get_headers_clamps_heights(peer_chain):
+    client = interface.app.test_client()
+    data = client.get('/get_headers', query_string={'from_height': -5}).get_json()
+    assert data['start'] == 0 and len(data['headers']) == 5
+
+    data = client.get('/get_headers', query_string={'from_height': 2, 'limit': -1}).get_json()
+    assert data['start'] == 2 and data['headers'] == []
+
+
+def decode_chain(chain_format, data):
+    '''
+    :return: hashes of the blocks in a /get_chain reply
+    '''
+    if chain_format == 'json':
+        return [block['hash'] for block in json.loads(data)['chain']]
+    if chain_format == 'ndjson':
+        return [json.loads(line)['hash'] for line in data.decode().splitlines()]
+    if chain_format == 'bin':
+        return [block.hash() for block in codec.decode_chain(data)]
+    return [block.hash() for block in codec.decode_chain_stream([data])]
+
+
+@pytest.mark.parametrize('chain_format', ['json', 'ndjson', 'bin', 'bin_stream'])
+def test_get_chain_pages(peer_chain, chain_format):
+    client = interface.app.test_client()
+    expected = hashes(peer_chain)
+    for params, start, end in [({}, 0, 5), ({'from_height': 1, 'limit': 2}, 1, 3),
+                               ({'from_height': 3, 'limit': 10}, 3, 5), ({'from_height': 7}, 5, 5),
+                               ({'from_height': -4, 'limit': 1}, 0, 1), ({'limit': -1}, 0, 0)]:
+        params['format'] = chain_format
+        data = client.get('/get_chain', query_string=params).data
+        assert decode_chain(chain_format, data) == expected[start:end]
+
+
+def test_iter_blocks_raises_on_reorg(peer_chain):
+    fork = [mine_on(peer_chain, peer_chain.get_hash(0), 1)]
+    fork.append(mine_on(peer_chain, fork[0].hash(), 2))
+
+    chunks = []
+    with pytest.raises(RuntimeError):
+        for chunk in codec.encode_chain_stream(peer_chain.iter_blocks(batch_size=2)):
+            chunks.append(chunk)
+            # The version byte and the first batch
+            if len(chunks) == 3:
+                with peer_chain.lock.write():
+                    peer_chain.set_chain_suffix(1, fork)
+
+    # Without its zero length end, the stream can't pass for a shorter chain
+    assert len(chunks) == 3
+    with pytest.raises(ValueError):
+        list(codec.decode_chain_stream(chunks))
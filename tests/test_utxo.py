@@ -0,0 +1,135 @@
+import json
+
+from conftest import mine_on
+from wrking_crypto.builder import TxBuilder
+from wrking_crypto.coin import Output
+from wrking_crypto.utxo import UTXOSet, UTXOView
+
+
+def state(utxos):
+    '''
+    :return: everything a UTXOSet indexes, in a form that compares equal
+    regardless of the order coins were added in
+    '''
+    return (set(utxos.unspent), set(utxos.spent), dict(utxos.balances),
+            {wallet: set(coins) for wallet, coins in utxos.wallet_coins.items()},
+            {wallet: list(entries) for wallet, entries in utxos.history.items()})
+
+
+def pay(user, chain, coin_index, wallet, amount, fee=1):
+    coins = chain.get_wallet_coins(user.wal)[1]
+    return TxBuilder(user, fee=fee).add_recipient(wallet, amount).build([coins[coin_index]])
+
+
+def test_undo_restores_the_index(user, other, chain):
+    before = state(chain.utxos)
+    assert chain.add_transation(pay(user, chain, 0, other.wal, 10))
+    block = chain.create_block()
+    assert state(chain.utxos) != before
+
+    chain.utxos.undo_block(chain.undo[block.hash()])
+    assert state(chain.utxos) == before
+
+
+def test_apply_matches_rebuild(user, other, chain):
+    assert chain.add_transation(pay(user, chain, 0, other.wal, 10))
+    chain.create_block()
+
+    rebuilt = UTXOSet()
+    rebuilt.rebuild(chain.chain)
+    assert state(rebuilt) == state(chain.utxos)
+    assert chain.get_balance(other.wal) == 10
+
+
+def test_snapshot_round_trip(user, other, chain):
+    assert chain.add_transation(pay(user, chain, 0, other.wal, 10))
+    chain.create_block()
+
+    loaded = UTXOSet()
+    loaded.load_json(json.loads(json.dumps(chain.utxos.json())))
+    assert state(loaded) == state(chain.utxos)
+
+
+def test_spent_coin_is_rejected(user, other, chain):
+    spend = pay(user, chain, 0, other.wal, 10)
+    again = pay(user, chain, 0, 'aa' * 20, 10, fee=2)
+    assert chain.add_transation(spend)
+    chain.create_block()
+
+    assert chain.utxos.is_spent(spend.owned_coins[0].coin_hash)
+    assert not chain.add_transation(again)
+
+
+def test_coin_must_match_the_index(user, chain):
+    coin = chain.get_wallet_coins(user.wal)[1][0]
+    payer = TxBuilder(user).add_recipient('aa' * 20, 10)
+
+    # The same outpoint claiming a bigger amount, and a coin that was never made
+    assert not chain.add_transation(payer.build([Output(coin.lock, coin.amount * 2, coin.outpoint)]))
+    assert not chain.add_transation(payer.build([Output(coin.lock, coin.amount, ('ff' * 20, 0))]))
+    assert chain.add_transation(payer.build([coin]))
+
+
+def test_reorg_switches_the_index(user, other, chain):
+    spend = pay(user, chain, 0, other.wal, 10)
+    conflict = pay(user, chain, 0, 'cc' * 20, 10, fee=5)
+    pending = pay(user, chain, 1, 'dd' * 20, 7)
+
+    fork = chain.get_hash(2)
+    assert chain.add_transation(spend)
+    assert chain.add_transation(pending)
+    chain.create_block()
+    assert spend.tx_hash not in chain.memlist and pending.tx_hash not in chain.memlist
+
+    # A longer branch off block 2 that spends the same coin differently
+    side = [mine_on(chain, fork, 3, [conflict])]
+    side.append(mine_on(chain, side[0].hash(), 4))
+    assert chain.add_block(side[0]) and chain.add_block(side[1])
+    assert [block.hash() for block in chain.chain[3:]] == [block.hash() for block in side]
+
+    rebuilt = UTXOSet()
+    rebuilt.rebuild(chain.chain)
+    assert state(rebuilt) == state(chain.utxos)
+    assert chain.get_balance(other.wal) == 0
+    assert chain.get_balance('cc' * 20) == 10
+
+    # The disconnected block's Tx are pending again, unless the branch spent their coins
+    assert spend.tx_hash not in chain.memlist
+    assert pending.tx_hash in chain.memlist
+    assert chain.is_chain_valid()
+
+
+def test_invalid_branch_is_not_switched_to(user, chain):
+    spend = pay(user, chain, 0, 'aa' * 20, 10)
+    double = pay(user, chain, 0, 'bb' * 20, 10, fee=5)
+    tip = chain.get_hash(2)
+    before = state(chain.utxos)
+
+    assert not chain.add_block(mine_on(chain, tip, 3, [spend, double]))
+    assert state(chain.utxos) == before
+    assert len(chain.chain) == 3
+
+
+def test_view_checks_blocks_without_touching_the_index(user, chain):
+    spend = pay(user, chain, 0, 'aa' * 20, 10)
+    block = mine_on(chain, chain.get_hash(2), 3, [spend])
+    before = state(chain.utxos)
+
+    view = UTXOView(chain.utxos)
+    assert view.check_block(block, chain.memlist.MINING_REWARD)
+    assert view.get_coin(spend.owned_coins[0].coin_hash) is None
+    assert state(chain.utxos) == before
+
+    # Its coin is spent on the view now, so the same block again double spends it
+    assert not view.check_block(block, chain.memlist.MINING_REWARD)
+
+
+def test_view_over_undone_blocks(user, other, chain):
+    spend = pay(user, chain, 0, other.wal, 10)
+    assert chain.add_transation(spend)
+    block = chain.create_block()
+
+    # Seen from block 2, the coin block 3 spent is unspent and its new coins don't exist
+    view = UTXOView(chain.utxos, [chain.undo[block.hash()]])
+    assert view.get_coin(spend.owned_coins[0].coin_hash) is not None
+    assert view.get_coin(block.transactions[1].sent_coins[0].coin_hash) is None
@@ -0,0 +1,43 @@
+from conftest import mine_on
+from wrking_crypto import verify
+from wrking_crypto.builder import TxBuilder
+from wrking_crypto.transaction import Tx
+from wrking_crypto.user import User
+
+
+def test_pool_checks_every_signature(user):
+    puk = user.puk.export_key('PEM')
+    messages = ['%064x' % i for i in range(verify.MIN_PARALLEL + 8)]
+    triples = [(puk, message, sig) for message, sig in zip(messages, user.sign_batch(messages))]
+    triples += [(puk, 'ff' * 32, triples[0][2]), (b'not a key', messages[0], triples[0][2])]
+
+    results = verify.verify_signatures(triples, processes=2)
+    assert results == [True] * len(messages) + [False, False]
+    assert User.verify_signature(puk, messages[0], triples[0][2])
+
+
+def test_verify_blocks(user, chain):
+    tx = TxBuilder(user).add_recipient('aa' * 20, 10).build(chain.get_wallet_coins(user.wal)[1][:1])
+    assert chain.add_transation(tx)
+    block = chain.create_block()
+    assert verify.verify_block(block) == {tx.tx_hash: True}
+
+
+def test_signatures_cover_the_outputs(user, chain):
+    tx = TxBuilder(user).add_recipient('aa' * 20, 10).build(chain.get_wallet_coins(user.wal)[1][:1])
+
+    # The same signed Input, paying someone else
+    data = tx.json()
+    data['sent_coins'][0]['lock'] = 'bb' * 20
+    del data['tx_hash']
+    for coin in data['sent_coins']:
+        del coin['coin_hash']
+    stolen = Tx.from_json(data, mined=False)
+    assert stolen.unlock[0].sig == tx.unlock[0].sig
+    assert not stolen.check_is_valid()
+    assert not chain.add_transation(stolen)
+
+    block = mine_on(chain, chain.get_hash(2), 3, [stolen])
+    assert verify.verify_block(block) == {stolen.tx_hash: False}
+    assert not chain.add_block(block)
+    assert chain.add_transation(tx)
@@ -0,0 +1,48 @@
+import pytest
+
+from test_utxo import pay
+from wrking_crypto import interface
+
+
+@pytest.fixture
+def client(monkeypatch, user, other, chain):
+    '''
+    Test client of interface.app serving chain, after a fourth block in
+    which user pays other 10
+    '''
+    assert chain.add_transation(pay(user, chain, 0, other.wal, 10))
+    chain.create_block()
+    monkeypatch.setattr(interface, 'block_chain', chain)
+    return interface.app.test_client()
+
+
+def test_balance(client, user, other, chain):
+    assert client.get('/wallet/%s/balance' % other.wal).get_json()['balance'] == 10
+    assert client.get('/wallet/%s/balance' % ('aa' * 20)).get_json()['balance'] == 0
+    assert chain.get_balance(user.wal) == sum(coin.amount for coin in chain.get_wallet_coins(user.wal)[1])
+
+
+def test_history_is_newest_first(client, user, other, chain):
+    spend = chain.chain[3].transactions[1]
+    data = client.get('/wallet/%s/history' % user.wal).get_json()
+    # user mined every block, the fourth also holds their payment
+    assert data['total'] == 5
+    assert [entry['height'] for entry in data['history']] == [3, 3, 2, 1, 0]
+    payment = [entry for entry in data['history'] if entry['tx_hash'] == spend.tx_hash]
+    assert len(payment) == 1 and payment[0]['sent'] > payment[0]['received']
+
+    entry = client.get('/wallet/%s/history' % other.wal).get_json()['history']
+    assert [(item['tx_hash'], item['received'], item['sent']) for item in entry] == [(spend.tx_hash, 10, 0)]
+
+
+def test_utxos_are_paged(client, user, chain):
+    total, coins = chain.get_wallet_coins(user.wal)
+    pages = [client.get('/wallet/%s/utxos' % user.wal, query_string={'offset': offset, 'limit': 2}).get_json()
+             for offset in range(0, total, 2)]
+
+    assert all(page['total'] == total for page in pages)
+    assert [coin for page in pages for coin in page['utxos']] == [coin.json() for coin in coins]
+
+    # Out of range paging is clamped rather than an error
+    data = client.get('/wallet/%s/utxos' % user.wal, query_string={'offset': -3, 'limit': 0}).get_json()
+    assert data['offset'] == 0 and data['limit'] == 1 and len(data['utxos']) == 1
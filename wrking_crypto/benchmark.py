@@ -0,0 +1,484 @@
+'''
+Primary Purpose: Benchmarks for the hot paths of a node: mining, adding
+transactions to the memlist, picking transactions for a block, checking
+signatures and serializing the chain.
+
+Results are written as JSON so runs from different releases can be
+compared, i.e.
+
+    python -m wrking_crypto.benchmark --output before.json
+    ... change things ...
+    python -m wrking_crypto.benchmark --output after.json --compare before.json
+
+--compare exits with status 1 if any benchmark got worse by more than
+--tolerance, so it can gate a release. To keep that gate from tripping on
+noise, mining is timed over a fixed set of block headers, so it always
+takes the same number of hashes, every timing is the fastest of at
+least `repeat` runs over at least `min_time` seconds, and the whole suite
+runs `rounds` times, keeping each benchmark's median round.
+
+Every call timed is followed by a call to reference_work(), a fixed piece
+of plain Python that doesn't touch the node's code, and each result keeps
+the time that took as its calibration. --compare scales the baseline by
+how much slower or faster the calibration got, so a run on a machine (or
+a VM) that was slower as a whole doesn't count as a regression.
+'''
+
+import argparse
+import contextlib
+import datetime
+import gc
+import json
+import platform
+import sys
+import time
+
+from wrking_crypto import blockchain
+from wrking_crypto.blockchain import Block, BlockChain, MemList
+from wrking_crypto.coin import Input
+from wrking_crypto.miner import MiningStats
+from wrking_crypto.transaction import Tx
+from wrking_crypto.user import User
+
+FORMAT_VERSION = 3
+
+FULL_SIZES = {
+    'difficulties': [1, 2, 3, 4],
+    'hashes': 200000,
+    'chain_lengths': [10, 100, 1000],
+    'mempool_sizes': [10, 100, 1000, 10000],
+    'signatures': 200,
+    'add_tx_calls': 50,
+    'repeat': 7,
+    'min_time': 0.5,
+    'rounds': 5
+}
+
+QUICK_SIZES = {
+    'difficulties': [1, 2],
+    'hashes': 50000,
+    'chain_lengths': [10, 100],
+    'mempool_sizes': [10, 100],
+    'signatures': 20,
+    'add_tx_calls': 20,
+    'repeat': 5,
+    'min_time': 0.2,
+    'rounds': 5
+}
+
+COIN_AMOUNT = 100
+# Every block mining_blocks() makes has this time stamp
+MINING_TIME_STAMP = '2026-01-01 00:00:00'
+CALIBRATION_SIZE = 20000
+# Passes over the signatures per timed call with the caches warm, a single
+# pass is too quick to time reliably
+WARM_PASSES = 100
+
+
+def make_result(name, params, value, unit, higher_is_better, calibration):
+    return {
+        'name': name,
+        'params': params,
+        'value': value,
+        'unit': unit,
+        'higher_is_better': higher_is_better,
+        'calibration': calibration
+    }
+
+
+@contextlib.contextmanager
+def gc_paused():
+    '''
+    Turns the garbage collector off while timing, like timeit does, so a
+    collection of what the setup left behind isn't charged to one call
+    '''
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def reference_work():
+    '''
+    Fixed loop of plain Python arithmetic and dict updates, timed to tell
+    how fast the machine is at the moment
+    '''
+    counts = {}
+    total = 0
+    for i in range(CALIBRATION_SIZE):
+        counts[i % 97] = counts.get(i % 97, 0) + i
+        total += i * i % 7
+    return total
+
+
+def time_it(function, repeat, min_time=0, setup=None):
+    '''
+    Calls function() at least repeat times and for at least min_time
+    seconds all told, with a call to reference_work() after each
+
+    :param setup: optional function called untimed before each call, whose
+    result is passed to function
+    :return: (fastest seconds of the calls to function, fastest seconds of
+    the calls to reference_work()). The fastest rather than the mean,
+    anything else running on the machine only ever makes a call slower
+    '''
+
+    times = []
+    reference_times = []
+    stop = time.perf_counter() + min_time
+    with gc_paused():
+        while len(times) < repeat or time.perf_counter() < stop:
+            args = (setup(),) if setup is not None else ()
+            started = time.perf_counter()
+            function(*args)
+            times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            reference_work()
+            reference_times.append(time.perf_counter() - started)
+    return min(times), min(reference_times)
+
+
+def grow_chain(chain, length, wallet):
+    '''
+    Appends reward-only blocks to chain until it has length blocks. They
+    aren't mined, the benchmarks that need a long chain only care about
+    its size, and mining would get slower with every retarget.
+    '''
+
+    blocks = []
+    previous_hash = chain.get_hash(len(chain.chain) - 1) if len(chain.chain) else '0'
+    for height in range(len(chain.chain), length):
+        reward = Tx(None, None, [(wallet, MemList.MINING_REWARD)], True, height)
+        reward.create_new_coins()
+        block = Block(height, previous_hash, [reward])
+        blocks.append(block)
+        previous_hash = block.hash()
+    chain.set_chain_suffix(len(chain.chain), blocks)
+
+
+def fund(chain, wallet, count):
+    '''
+    Appends a block whose reward Tx pays count coins of COIN_AMOUNT to
+    wallet, unmined like grow_chain()'s, so every Tx a benchmark makes can
+    spend a coin of its own. Funding a new chain the same way makes the
+    same coins.
+
+    :return: List of the Output objects
+    '''
+
+    height = len(chain.chain)
+    reward = Tx(None, None, [(wallet, COIN_AMOUNT)] * count, True, height)
+    coins = reward.create_new_coins()
+    previous_hash = chain.get_hash(height - 1) if height else '0'
+    chain.set_chain_suffix(height, [Block(height, previous_hash, [reward])])
+    return coins
+
+
+def sign_coins(user, coins):
+    '''
+    Signatures cover the Tx a coin is spent in, so each coin is signed
+    for the Tx make_txs() spends it in. make_txs() makes the same Tx every
+    time, so the signatures can be reused for every round.
+
+    :return: List of Input objects unlocking coins
+    '''
+    puk = user.puk.export_key('PEM')
+    txs = make_txs(coins, [None] * len(coins), len(coins))
+    signatures = user.sign_batch([tx.signature_message(coin.coin_hash) for tx, coin in zip(txs, coins)])
+    return [Input(coin.coin_hash, puk, sig) for coin, sig in zip(coins, signatures)]
+
+
+def make_txs(coins, unlocks, count):
+    '''
+    :return: count valid Tx objects, each spending its own coin to a
+    different wallet and paying a different fee so the memlist has
+    something to sort
+    '''
+    return [Tx([unlock], [coin], [('%040x' % i, coin.amount - 1 - i % (coin.amount - 1))])
+            for i, coin, unlock in zip(range(count), coins, unlocks)]
+
+
+def mining_blocks(target, hashes):
+    '''
+    Blocks whose headers are the same on every run, so finding their
+    nonces always takes the same number of attempts. Enough of them that
+    mining them all takes at least `hashes` attempts.
+
+    :return: (List of Block objects, total attempts to mine them)
+    '''
+
+    stats = MiningStats()
+    blocks = []
+    while stats.total_attempts < hashes:
+        block = Block(len(blocks), '0', [], target)
+        block.time_stamp = MINING_TIME_STAMP
+        block.find_nonce(mining_stats=stats)
+        blocks.append(block)
+    return blocks, stats.total_attempts
+
+
+def bench_find_nonce(sizes):
+    '''
+    Hashes per second of Block.find_nonce(), reporting to a MiningStats
+    the way BlockChain.create_block() does, for targets with 1, 2, ...
+    leading hex 0's
+    '''
+
+    results = []
+    for zeros in sizes['difficulties']:
+        blocks, attempts = mining_blocks(2 ** (256 - 4 * zeros) - 1, sizes['hashes'])
+
+        def mine_all():
+            stats = MiningStats()
+            for block in blocks:
+                block.find_nonce(mining_stats=stats)
+
+        seconds, calibration = time_it(mine_all, sizes['repeat'], sizes['min_time'])
+        results.append(make_result('find_nonce', {'leading_zeros': zeros}, attempts / seconds,
+                                   'hashes/s', True, calibration))
+    return results
+
+
+def bench_add_tx(sizes, chain, user, coins, unlocks):
+    '''
+    Seconds per MemList.add_tx() as the chain gets longer. The signature
+    cache is cleared before each call so every call pays for the RSA check.
+    '''
+
+    results = []
+    for length in sizes['chain_lengths']:
+        grow_chain(chain, length, user.wal)
+        txs = make_txs(coins, unlocks, sizes['add_tx_calls'])
+
+        def add_all():
+            memlist = MemList(None, chain.utxos, user.wal)
+            for tx in txs:
+                User.verified_cache.clear()
+                memlist.add_tx(tx)
+
+        seconds, calibration = time_it(add_all, sizes['repeat'], sizes['min_time'])
+        results.append(make_result('add_tx', {'chain_length': length}, seconds / len(txs),
+                                   's', False, calibration))
+    return results
+
+
+def bench_get_tx_to_mine(sizes, chain, user, coins, unlocks):
+    '''
+    Seconds per MemList.get_tx_to_mine() for a given number of pending Tx
+    '''
+
+    def fill(size):
+        # get_tx_to_mine() turns the Tx it picks into mined ones, so each call needs its own
+        memlist = MemList(None, chain.utxos, user.wal)
+        for tx in make_txs(coins, unlocks, size):
+            memlist.add_tx(tx)
+        return memlist
+
+    results = []
+    for size in sizes['mempool_sizes']:
+        seconds, calibration = time_it(lambda memlist: memlist.get_tx_to_mine(len(chain.chain)),
+                                       sizes['repeat'], sizes['min_time'], lambda: fill(size))
+        results.append(make_result('get_tx_to_mine', {'mempool_size': size}, seconds,
+                                   's', False, calibration))
+    return results
+
+
+def bench_verify_signature(sizes, user):
+    '''
+    User.verify_signature() calls per second, with the caches cold and warm
+    '''
+
+    puk = user.puk.export_key('PEM')
+    messages = ['%064x' % i for i in range(sizes['signatures'])]
+    signed = [(message, user.sign(message)) for message in messages]
+
+    def verify_all():
+        for message, sig in signed:
+            User.verify_signature(puk, message, sig)
+
+    def verify_all_cold():
+        User.verified_cache.clear()
+        User.key_cache.clear()
+        verify_all()
+
+    def verify_all_warm():
+        for _ in range(WARM_PASSES):
+            verify_all()
+
+    cold, cold_calibration = time_it(verify_all_cold, sizes['repeat'], sizes['min_time'])
+    warm, warm_calibration = time_it(verify_all_warm, sizes['repeat'], sizes['min_time'])
+
+    return [
+        make_result('verify_signature', {'cache': 'cold'}, len(signed) / cold, 'verifies/s', True,
+                    cold_calibration),
+        make_result('verify_signature', {'cache': 'warm'}, WARM_PASSES * len(signed) / warm, 'verifies/s',
+                    True, warm_calibration)
+    ]
+
+
+def bench_chain_json(sizes, chain):
+    '''
+    Blocks and bytes per second of json.dumps(BlockChain.json()), what
+    /get_chain does
+    '''
+
+    size = len(json.dumps(chain.json()))
+    seconds, calibration = time_it(lambda: json.dumps(chain.json()), sizes['repeat'], sizes['min_time'])
+    params = {'chain_length': len(chain.chain)}
+    return [
+        make_result('chain_json', params, len(chain.chain) / seconds, 'blocks/s', True, calibration),
+        make_result('chain_json_bytes', params, size / seconds, 'bytes/s', True, calibration)
+    ]
+
+
+def run_round(sizes, user, unlocks):
+    '''
+    Runs every benchmark once, on a new chain
+
+    :return: List of results
+    '''
+
+    chain = BlockChain(user.wal)
+    coins = fund(chain, user.wal, len(unlocks))
+
+    results = []
+    results += bench_find_nonce(sizes)
+    results += bench_add_tx(sizes, chain, user, coins, unlocks)
+    results += bench_get_tx_to_mine(sizes, chain, user, coins, unlocks)
+    results += bench_verify_signature(sizes, user)
+    results += bench_chain_json(sizes, chain)
+    return results
+
+
+def calibrated_value(result):
+    '''
+    :return: result's value as if reference_work() had taken 1 second, so
+    values timed while the machine was slower or faster compare fairly
+    '''
+    if result['higher_is_better']:
+        return result['value'] * result['calibration']
+    return result['value'] / result['calibration']
+
+
+def median_results(rounds):
+    '''
+    :param rounds: List of the Lists of results run_round() made
+    :return: List of results, for each benchmark the round with the median
+    calibrated value. Not the best, a round where the machine happened to
+    slow down during reference_work() looks better than it was
+    '''
+
+    by_key = {}
+    for results in rounds:
+        for result in results:
+            by_key.setdefault(result_key(result), []).append(result)
+
+    medians = []
+    for results in by_key.values():
+        results.sort(key=calibrated_value)
+        medians.append(results[len(results) // 2])
+    return medians
+
+
+def run(sizes):
+    '''
+    Runs every benchmark sizes['rounds'] times
+
+    :param sizes: FULL_SIZES, QUICK_SIZES or a dict like them
+    :return: dict of the run's details and a list of results
+    '''
+
+    user = User()
+    count = max(sizes['add_tx_calls'], max(sizes['mempool_sizes']))
+    unlocks = sign_coins(user, fund(BlockChain(user.wal), user.wal, count))
+
+    rounds = [run_round(sizes, user, unlocks) for _ in range(sizes['rounds'])]
+
+    return {
+        'format_version': FORMAT_VERSION,
+        'time': str(datetime.datetime.now()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'initial_target': '%064x' % blockchain.INITIAL_TARGET,
+        'sizes': sizes,
+        'results': median_results(rounds)
+    }
+
+
+def result_key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(report, baseline, tolerance):
+    '''
+    Compares every result with the same benchmark in baseline, after
+    scaling the baseline by how much slower (or faster) reference_work()
+    ran alongside the result than alongside the baseline's
+
+    :param tolerance: float, how much worse (i.e. 0.2 for 20%) a result can
+    be before it counts as a regression
+    :return: List of (result, scaled baseline value, relative change, regressed)
+    '''
+
+    old = {result_key(result): result for result in baseline['results']}
+    rows = []
+    for result in report['results']:
+        before = old.get(result_key(result))
+        if before is None or before['value'] == 0:
+            continue
+
+        slowdown = 1
+        if result.get('calibration') and before.get('calibration'):
+            slowdown = result['calibration'] / before['calibration']
+        expected = before['value'] / slowdown if result['higher_is_better'] else before['value'] * slowdown
+        change = (result['value'] - expected) / expected
+        worse = -change if result['higher_is_better'] else change
+        rows.append((result, expected, change, worse > tolerance))
+    return rows
+
+
+def describe(result):
+    params = ', '.join('%s=%s' % item for item in sorted(result['params'].items()))
+    return '%s(%s)' % (result['name'], params)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of a node')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes, for a quick check')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction a result can get worse before it is a regression (default 0.2)')
+    args = parser.parse_args(argv)
+
+    report = run(QUICK_SIZES if args.quick else FULL_SIZES)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        for result in report['results']:
+            print('%-45s %14.6g %s' % (describe(result), result['value'], result['unit']))
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+
+    regressed = False
+    for result, before, change, worse in compare(report, baseline, args.tolerance):
+        regressed = regressed or worse
+        print('%-45s %+7.1f%%%s' % (describe(result), change * 100, '  REGRESSION' if worse else ''),
+              file=sys.stderr)
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
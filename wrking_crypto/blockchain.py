@@ -10,28 +10,161 @@ valid and point to a UTXO currently in the block chain.
 '''
 
 import datetime
+import json
+import heapq
+import itertools
+import threading
 from Crypto.Hash import SHA256
-import requests
 from urllib.parse import urlparse
 from wrking_crypto.transaction import Tx
+from wrking_crypto import codec, merkle, verify
+from wrking_crypto.utxo import UTXOSet, UTXOView
+from wrking_crypto.blocktree import BlockTree
+from wrking_crypto.store import StoredChain
+from wrking_crypto.peers import PeerClient
+from wrking_crypto.miner import MiningStats, search_nonces
+from wrking_crypto.rwlock import RWLock
 
 '''
-GLOBAL VARIABLES NEEDED IN THE CLASS:
+DEFAULTS FOR A ChainConfig:
 
-glob_chain: List of Blocks
-    This is actually the block chain
-    
 DIFFICULTY: int
-    represents the current difficulty, aka amount of leading zeros
-    in a sucsesfully hashed block
-    
-our_wallet: String (Wallet)
-    Represents the string value of the wallet of this node. Needed
-    for knowing who to award the new coins/fees to.
+    represents the starting difficulty, aka amount of leading zeros
+    in a sucsesfully hashed block. After that each block's target
+    is retargeted by ChainConfig.next_target()
+
+INITIAL_TARGET / MAX_TARGET: int
+    256 bit target of the first RETARGET_WINDOW blocks, and the easiest
+    target a block can ever have. A block's hash read as an int must
+    be <= its target
+
+BLOCK_INTERVAL: int
+    Seconds we want between blocks
+
+RETARGET_WINDOW: int
+    The target is adjusted every RETARGET_WINDOW blocks, from how long
+    the last RETARGET_WINDOW blocks took
+
+MEDIAN_TIME_SPAN: int
+    A block's time_stamp has to be later than the median time_stamp of
+    the MEDIAN_TIME_SPAN blocks before it
+
+MAX_FUTURE_TIME: int
+    Most seconds a block's time_stamp can be ahead of our clock
+
+Everything else a chain needs lives on its BlockChain object, so several
+chains/nodes can run in one process without sharing anything.
 '''
-glob_chain = []
-our_wallet = None
 DIFFICULTY = 1
+INITIAL_TARGET = 2 ** (256 - 4 * DIFFICULTY) - 1
+MAX_TARGET = 2 ** 252 - 1
+BLOCK_INTERVAL = 60
+RETARGET_WINDOW = 10
+MEDIAN_TIME_SPAN = 11
+MAX_FUTURE_TIME = 2 * 60 * 60
+
+
+class ChainConfig():
+    '''
+    The consensus rules of a chain. Every node on a network has to use
+    the same ones, but chains in the same process (i.e. a test network
+    with a short BLOCK_INTERVAL) can each have their own.
+
+    Attributes
+    ----------
+    initial_target: int
+        Target of the genesis block and every block before the first retarget
+
+    max_target: int
+        The easiest target a retarget can give
+
+    block_interval: int
+        Seconds we want between blocks
+
+    retarget_window: int
+        Number of blocks between retargets
+
+    median_time_span: int
+        Number of blocks whose median time_stamp a new block has to be after
+
+    max_future_time: int
+        Most seconds a block's time_stamp can be ahead of our clock
+    '''
+
+    def __init__(self, initial_target=INITIAL_TARGET, max_target=MAX_TARGET,
+                 block_interval=BLOCK_INTERVAL, retarget_window=RETARGET_WINDOW,
+                 median_time_span=MEDIAN_TIME_SPAN, max_future_time=MAX_FUTURE_TIME):
+        self.initial_target = initial_target
+        self.max_target = max_target
+        self.block_interval = block_interval
+        self.retarget_window = retarget_window
+        self.median_time_span = median_time_span
+        self.max_future_time = max_future_time
+
+    def next_target(self, height, block_at):
+        '''
+        Works out the target the block at height has to have. Every
+        retarget_window blocks the previous target is scaled by how long the
+        last retarget_window blocks actually took over how long they should
+        have taken, at most 4 times easier or harder at once, otherwise the
+        target stays the same as the previous block's.
+
+        :param height: int, height of the block being mined/checked
+        :param block_at: function height -> (time_stamp, target) of an earlier
+        block on the same branch
+        :return: int, the 256 bit target
+        '''
+
+        if height == 0:
+            return self.initial_target
+
+        last_time, last_target = block_at(height - 1)
+        if height % self.retarget_window != 0:
+            return last_target
+
+        first_time = block_at(height - self.retarget_window)[0]
+        span = (datetime.datetime.fromisoformat(last_time) - datetime.datetime.fromisoformat(first_time)) \
+            // datetime.timedelta(microseconds=1)
+        expected = (self.retarget_window - 1) * self.block_interval * 1000000
+        span = min(max(span, expected // 4), expected * 4)
+
+        return max(1, min(last_target * span // expected, self.max_target))
+
+    def median_time(self, height, block_at):
+        '''
+        :param block_at: function height -> (time_stamp, target), like next_target()'s
+        :return: datetime, the median time_stamp of the median_time_span
+        blocks before height, None for the genesis block
+        :raise ValueError: if one of their time_stamps doesn't parse
+        '''
+
+        if height == 0:
+            return None
+        times = sorted(datetime.datetime.fromisoformat(block_at(i)[0])
+                       for i in range(max(0, height - self.median_time_span), height))
+        return times[len(times) // 2]
+
+    def time_valid(self, height, time_stamp, block_at, now=None):
+        '''
+        Checks the time_stamp of the block at height: it has to parse, be
+        later than median_time(), and be at most max_future_time seconds
+        ahead of now. The median rather than the previous block's time, so
+        one node's clock being a little off doesn't get its blocks rejected.
+
+        :param now: datetime to check against, our clock by default
+        :return: True if the time_stamp is valid
+        '''
+
+        try:
+            block_time = datetime.datetime.fromisoformat(time_stamp)
+            now = now or datetime.datetime.now()
+            if block_time > now + datetime.timedelta(seconds=self.max_future_time):
+                return False
+            median = self.median_time(height, block_at)
+            return median is None or block_time > median
+        except (ValueError, TypeError):
+            return False
+
 
 class BlockChain:
     '''
@@ -42,23 +175,466 @@ class BlockChain:
     memlist: Memlist Object
         A list representing the unmined/pending transactions. Become
         a part of the block chain once create_block() is called.
+        Fills each block with at most max_num_tx transactions
+        (MemList.MAX_NUM_TX if max_num_tx is None)
+
+    wallet: String (Wallet)
+        Represents the string value of the wallet of this node. Needed
+        for knowing who to award the new coins/fees to.
+
+    config: ChainConfig Object
+        The consensus rules (targets, retargeting) of this chain
 
     chain: List
-        A local representation of the global varible, the block chain
+        This is actually the block chain, a StoredChain if there's a store
+
+    utxos: UTXOSet Object
+        Index of the spent/unspent coins in chain, kept up to date
+        as blocks are added so the MemList never has to scan the chain
 
     nodes: Set
         A set containing all other node's IP's / Ports to communicate with
+
+    peers: PeerClient Object
+        Sends requests to the nodes concurrently over pooled connections
+
+    validated_height: int
+        Height of the newest block is_chain_valid() has already checked
+        (-1 if none), everything up to it is trusted from then on
+
+    validated_hash: String
+        Hash of the block at validated_height, if the block there changes
+        the checkpoint no longer counts
+
+    tree: BlockTree Object
+        Cumulative work of the active chain, and the blocks on competing
+        branches. Whichever branch has the most work is the active chain
+
+    undo: Dict
+        block hash -> UndoRecord for the last MAX_REORG_DEPTH blocks of the
+        active chain, so a reorg only has to reverse the blocks it removes
+
+    miner: Miner Object
+        Optional, mines new blocks across several processes. If None, blocks
+        are mined on the calling thread
+
+    mining_stats: MiningStats Object
+        Progress/hash rate of our mining, see miner.py
+
+    store: BlockStore Object
+        Optional, keeps the chain on disk. If given, chain becomes a
+        StoredChain that reads blocks from the store when they're needed
+        and writes every new block to it
+
+    lock: RWLock Object
+        Held for writing while chain, hash_index, utxos, tree or undo
+        change, and for reading while they're read, so any number of
+        request threads can read at once. Mining and downloading from
+        peers happen outside of it, only adding the result takes the
+        write lock. The memlist has its own lock.
     '''
 
-    def __init__(self, wallet):
+    MAX_REORG_DEPTH = 1000
+    # Blocks copied per read lock by iter_blocks()
+    ITER_BATCH_SIZE = 100
 
-        global glob_chain
-        global our_wallet
+    def __init__(self, wallet, max_num_tx=None, miner=None, store=None, peers=None, mining_stats=None,
+                 config=None):
 
-        our_wallet = wallet
-        self.memlist = MemList()
-        self.chain = glob_chain
+        self.wallet = wallet
+        self.config = config or ChainConfig()
+        self.utxos = UTXOSet()
+        self.memlist = MemList(max_num_tx, self.utxos, wallet)
         self.nodes = set()
+        self.peers = peers or PeerClient()
+        self.miner = miner
+        self.mining_stats = mining_stats or MiningStats()
+        self.store = store
+        self.lock = RWLock()
+
+        if store is not None:
+            self.chain = StoredChain(store, Block.serialize,
+                                     lambda data: Block.deserialize(data, trust_hash=True))
+        else:
+            self.chain = []
+        self.hash_index = {}
+        self.index_from(0)
+        self.validated_height = -1
+        self.validated_hash = None
+        self.tree = BlockTree()
+        self.undo = {}
+
+        if store is not None:
+            self.load_state()
+        else:
+            for block in self.chain:
+                self.tree.extend_active(block.work())
+
+    def get_hash(self, height):
+        '''
+        :return: STRING hash of the block at that height, read from the
+        store's index when there is one so the block isn't decoded
+        '''
+        if isinstance(self.chain, StoredChain):
+            return self.chain.store.get_hash(height)
+        return self.chain[height].hash()
+
+    def height_of(self, block_hash):
+        '''
+        :return: height of the block with that hash in our chain, or None
+        '''
+        return self.hash_index.get(block_hash)
+
+    def has_block(self, block_hash):
+        '''
+        :return: True if the block is on our chain or a side branch
+        '''
+        with self.lock.read():
+            return block_hash in self.hash_index or self.tree.get_side(block_hash) is not None
+
+    def get_block_by_hash(self, block_hash):
+        with self.lock.read():
+            height = self.height_of(block_hash)
+            if height is None:
+                return None
+            return self.chain[height]
+
+    def get_block(self, height):
+        '''
+        :return: Block object at that height, or None if there isn't one
+        '''
+        with self.lock.read():
+            if not 0 <= height < len(self.chain):
+                return None
+            return self.chain[height]
+
+    def snapshot(self, start=0, end=None):
+        '''
+        Copies the blocks from start to end (the tip by default) under the
+        read lock, so they can be serialized/sent without holding it. Blocks
+        don't change once they're in the chain, so the copy stays consistent
+        even if the chain moves on or reorgs meanwhile.
+
+        :return: List of Block objects
+        '''
+        with self.lock.read():
+            return list(self.chain[start:end])
+
+    def iter_blocks(self, start=0, end=None, batch_size=None):
+        '''
+        Generator over the blocks from start to end (the tip when it starts
+        by default), copying batch_size of them at a time with snapshot() so
+        a long chain can be streamed out without ever holding all of it, or
+        holding the read lock for the whole time.
+
+        If the chain reorgs part way through, the next batch won't link to
+        the last block yielded. Rather than mix two branches, or end early
+        as if that was the whole chain, the generator raises.
+
+        :return: generator of Block objects
+        :raise RuntimeError: if the chain reorged while iterating over it
+        '''
+
+        batch_size = batch_size or self.ITER_BATCH_SIZE
+        with self.lock.read():
+            end = len(self.chain) if end is None else min(end, len(self.chain))
+
+        last_hash = None
+        for i in range(max(start, 0), end, batch_size):
+            blocks = self.snapshot(i, min(i + batch_size, end))
+            if not blocks or (last_hash is not None and blocks[0].previous_hash != last_hash):
+                raise RuntimeError('Chain reorganized at height %s while iterating over it' % i)
+            for block in blocks:
+                yield block
+            last_hash = blocks[-1].hash()
+
+    def index_from(self, height):
+        '''
+        Adds every block from height up to hash_index
+        '''
+        for i in range(height, len(self.chain)):
+            self.hash_index[self.get_hash(i)] = i
+
+    def set_chain_suffix(self, height, blocks):
+        '''
+        Replaces every block from height up with blocks, which must already
+        have been validated, keeping hash_index, the UTXO index, the block
+        tree and the memlist in step with the chain.
+
+        The UTXO changes of the removed blocks are undone newest first and
+        the new blocks applied, so switching branches costs the depth of
+        the reorg. The removed blocks are kept in the tree as a side branch
+        in case it overtakes us again, and their Tx that the new blocks
+        don't have (or conflict with) go back into the memlist.
+
+        :param height: int, first height to replace (len(self.chain) to just extend)
+        :param blocks: List of Block objects
+        '''
+
+        with self.lock.write():
+            old_blocks = [self.chain[i] for i in range(height, len(self.chain))]
+            incremental = all(block.hash() in self.undo for block in old_blocks)
+
+            # Without every undo record (i.e. blocks from before a restart) the
+            # index is rebuilt from scratch once the new blocks are in place
+            if incremental:
+                for block in reversed(old_blocks):
+                    self.utxos.undo_block(self.undo.pop(block.hash()))
+
+            for i, block in enumerate(old_blocks, height):
+                self.hash_index.pop(block.hash(), None)
+                self.tree.add_side(block, i, self.tree.work_at(i))
+
+            self.chain[height:] = blocks
+            self.index_from(height)
+            self.tree.truncate_active(height)
+            for block in blocks:
+                self.tree.extend_active(block.work())
+                self.tree.remove_side(block.hash())
+
+            if incremental:
+                for block in blocks:
+                    self.undo[block.hash()] = self.utxos.apply_block(block)
+            else:
+                self.rebuild_utxos()
+
+            for block in blocks:
+                for tx in block.transactions or []:
+                    self.memlist.remove_tx(tx.tx_hash)
+                    self.memlist.remove_conflicts(tx)
+            for block in old_blocks:
+                self.memlist.return_txs(block.transactions)
+
+            self.prune_reorg_data()
+
+            # Anything passed in here was already validated against the blocks before it
+            self.set_validated(len(self.chain) - 1, self.get_hash(len(self.chain) - 1) if len(self.chain) else None)
+
+    def rebuild_utxos(self):
+        '''
+        Recreates the UTXO index from the whole chain, keeping undo records
+        for the last MAX_REORG_DEPTH blocks
+        '''
+
+        self.utxos.rebuild([])
+        self.undo = {}
+        keep_from = len(self.chain) - self.MAX_REORG_DEPTH
+        for height, block in enumerate(self.chain):
+            undo = self.utxos.apply_block(block)
+            if height >= keep_from:
+                self.undo[block.hash()] = undo
+
+    def prune_reorg_data(self):
+        '''
+        Drops undo records and side branches more than MAX_REORG_DEPTH
+        blocks behind the tip
+        '''
+
+        min_height = len(self.chain) - self.MAX_REORG_DEPTH
+        if len(self.undo) > self.MAX_REORG_DEPTH:
+            for block_hash in [h for h in self.undo if self.height_of(h) is None or self.height_of(h) < min_height]:
+                del self.undo[block_hash]
+        self.tree.prune(min_height)
+
+    def add_block(self, block):
+        '''
+        Adds a block mined by another node. A block on our tip extends the
+        chain, a block on any other known block is kept in the tree, and if
+        its branch now has more cumulative work than ours we reorg onto it.
+
+        :param block: Block object
+        :return: True if the block was accepted (on the active chain or a
+        side branch), False if it's invalid, already known or its parent is unknown
+        '''
+
+        # Cheap checks first, so a block with a made up target can't make us
+        # check all of its signatures. The header is checked again under the
+        # write lock, as our chain may change in between.
+        if not block.meets_target():
+            return False
+        with self.lock.read():
+            if self.check_header(block) is None:
+                return False
+        if not all(verify.verify_block(block).values()):
+            return False
+
+        with self.lock.write():
+            return self.connect_block(block)
+
+    def check_header(self, block):
+        '''
+        Checks a block's header against the branch it would extend: its
+        parent is known, and its index, time_stamp and target are right for
+        that branch. Must hold the lock.
+
+        :param block: Block object
+        :return: (height, parent's cumulative work) the block would be at,
+        or None if it's already known, its parent is unknown or its header is invalid
+        '''
+
+        block_hash = block.hash()
+        if block_hash in self.hash_index or self.tree.get_side(block_hash) is not None:
+            return None
+
+        parent_height = self.height_of(block.previous_hash)
+        parent_node = self.tree.get_side(block.previous_hash)
+        if len(self.chain) == 0 and block.previous_hash == '0':
+            height, parent_work = 0, 0
+        elif parent_height is not None:
+            height, parent_work = parent_height + 1, self.tree.work_at(parent_height)
+        elif parent_node is not None:
+            height, parent_work = parent_node.height + 1, parent_node.work
+        else:
+            return None
+
+        block_at = self.branch_lookup(block.previous_hash)
+        if block.index != height or not self.config.time_valid(height, block.time_stamp, block_at) or \
+                block.target != self.config.next_target(height, block_at):
+            return None
+        return height, parent_work
+
+    def connect_block(self, block):
+        '''
+        The part of add_block() that needs the write lock
+        '''
+
+        position = self.check_header(block)
+        if position is None:
+            return False
+        height, parent_work = position
+
+        if self.tree.get_side(block.previous_hash) is None and height == len(self.chain):
+            if self.count_valid(height, [block]) != 1:
+                return False
+            self.set_chain_suffix(height, [block])
+            return True
+
+        work = parent_work + block.work()
+        self.tree.add_side(block, height, work)
+        if work > self.tree.tip_work():
+            return self.reorganize(block.hash())
+        return True
+
+    def count_valid(self, height, blocks):
+        '''
+        Checks the Tx of blocks, which would replace our chain from height,
+        against the coins unspent on their branch (see UTXOView.check_block()).
+        Must hold the lock.
+
+        :param height: int, height of the first block
+        :param blocks: List of Block objects, each the parent of the next
+        :return: int, how many of blocks, from the first, are valid
+        '''
+
+        undos = [self.undo.get(self.get_hash(i)) for i in range(height, len(self.chain))]
+        if all(undo is not None for undo in undos):
+            view = UTXOView(self.utxos, undos)
+        else:
+            # Undo records only go back MAX_REORG_DEPTH blocks (or to the last restart)
+            utxos = UTXOSet()
+            for i in range(height):
+                utxos.apply_block(self.chain[i])
+            view = UTXOView(utxos)
+
+        for valid, block in enumerate(blocks):
+            if not view.check_block(block, self.memlist.MINING_REWARD):
+                return valid
+        return len(blocks)
+
+    def time_and_target(self, height):
+        '''
+        :return: (time_stamp, target) of the block at height, for ChainConfig.next_target()
+        '''
+        block = self.chain[height]
+        return block.time_stamp, block.target
+
+    def branch_lookup(self, tip_hash):
+        '''
+        :param tip_hash: STRING hash of a block on our chain or a side branch
+        :return: function height -> (time_stamp, target) for the blocks of
+        the branch ending in tip_hash, for ChainConfig.next_target()
+        '''
+
+        side_blocks = {node.height: node.block for node in self.tree.branch(tip_hash)}
+
+        def block_at(height):
+            block = side_blocks.get(height) or self.chain[height]
+            return block.time_stamp, block.target
+        return block_at
+
+    def reorganize(self, tip_hash):
+        '''
+        Makes the side branch ending in tip_hash the active chain
+
+        :param tip_hash: STRING hash of a block in self.tree.side
+        '''
+
+        with self.lock.write():
+            branch = self.tree.branch(tip_hash)
+            if not branch or self.height_of(branch[0].block.previous_hash) != branch[0].height - 1:
+                return False
+
+            blocks = [node.block for node in branch]
+            valid = self.count_valid(branch[0].height, blocks)
+            if valid < len(blocks):
+                # An invalid block, and every block built on it, can never be on the chain
+                for node in branch[valid:]:
+                    self.tree.remove_side(node.block.hash())
+                return False
+
+            self.set_chain_suffix(branch[0].height, blocks)
+            return True
+
+    def load_state(self):
+        '''
+        Restores the UTXO index from the snapshot saved by save_state(),
+        only applying the blocks stored after it was taken. Rebuilds it from
+        the whole store if there's no usable snapshot.
+        '''
+
+        state = self.store.load_state('utxos')
+        # Snapshots from before the wallet history index have to be rebuilt
+        if state is None or 'history' not in state['utxos'] or state['height'] > len(self.chain) or \
+                (state['height'] > 0 and state['tip'] != self.store.get_hash(state['height'] - 1)):
+            self.rebuild_utxos()
+            for block in self.chain:
+                self.tree.extend_active(block.work())
+            return
+
+        self.utxos.load_json(state['utxos'])
+        self.tree.active_work = state.get('chain_work') or []
+        if len(self.tree.active_work) != state['height']:
+            self.tree.active_work = []
+            for height in range(state['height']):
+                self.tree.extend_active(self.chain[height].work())
+
+        for height in range(state['height'], len(self.chain)):
+            block = self.chain[height]
+            self.undo[block.hash()] = self.utxos.apply_block(block)
+            self.tree.extend_active(block.work())
+
+        if state.get('validated_height', -1) >= 0:
+            self.set_validated(state['validated_height'], state['validated_hash'])
+
+    def save_state(self):
+        '''
+        Snapshots the UTXO index into the store, so the next startup doesn't
+        have to replay the whole chain. Call before shutting down.
+        '''
+
+        if self.store is None:
+            return
+
+        with self.lock.read():
+            tip = self.chain[-1].hash() if len(self.chain) else None
+            self.store.save_state('utxos', {
+                'height': len(self.chain),
+                'tip': tip,
+                'validated_height': self.validated_height,
+                'validated_hash': self.validated_hash,
+                'chain_work': self.tree.active_work,
+                'utxos': self.utxos.json()
+            })
 
     def create_block(self):
         '''
@@ -69,54 +645,169 @@ class BlockChain:
 
         If the block chain is empty, create the genesis block
 
+        Mining doesn't hold the lock, so the chain can still be read (and
+        extended by peers) meanwhile. If our tip changed while mining, the
+        block goes through add_block() like any other node's block.
+
         :return: the block that will be added onto the chain after calling.
         '''
 
-        if len(self.chain) == 0:
-
-            init_trans = self.memlist.get_tx_to_mine()
-            block = Block(0, '0', init_trans)
-            block.find_nonce()
-
-        else:
+        with self.lock.read():
+            height = len(self.chain)
+            if height == 0:
+                previous_hash = '0'
+                target = self.config.initial_target
+            else:
+                previous_hash = self.get_hash(height - 1)
+                target = self.config.next_target(height, self.time_and_target)
+            median = self.config.median_time(height, self.time_and_target)
+
+        init_trans = self.memlist.get_tx_to_mine(height)
+        block = Block(height, previous_hash, init_trans, target)
+        if median is not None and datetime.datetime.fromisoformat(block.time_stamp) <= median:
+            # Our clock is behind the chain's, the block still has to be after the median
+            block.time_stamp = str(median + datetime.timedelta(microseconds=1))
+        block.find_nonce(self.miner, self.mining_stats)
+
+        with self.lock.write():
+            if len(self.chain) != height or (height and self.get_hash(height - 1) != previous_hash):
+                # Unless it still made it onto the chain, its Tx are pending again
+                if not self.connect_block(block) or self.height_of(block.hash()) is None:
+                    self.memlist.return_txs(block.transactions)
+                return block
+
+            self.chain.append(block)
+            self.hash_index[block.hash()] = len(self.chain) - 1
+            self.undo[block.hash()] = self.utxos.apply_block(block)
+            self.tree.extend_active(block.work())
+            self.prune_reorg_data()
+        return block
 
-            init_trans = self.memlist.get_tx_to_mine()
-            block = Block(len(self.chain) + 1,
-                          self.get_prev_block().hash(),
-                          init_trans)
-            block.find_nonce()
+    def get_wallet_coins(self, wallet, offset=0, limit=None):
+        '''
+        :return: (number of unspent coins the wallet has, List of up to limit
+        of those Output objects from offset)
+        '''
+        with self.lock.read():
+            return self.utxos.count_wallet_coins(wallet), self.utxos.get_wallet_coins(wallet, offset, limit)
 
+    def get_wallet_history(self, wallet, offset=0, limit=None):
+        '''
+        :return: (number of Tx in the wallet's history, List of up to limit
+        (height, tx_hash, received, sent) tuples from offset, newest first)
+        '''
+        with self.lock.read():
+            return self.utxos.count_history(wallet), self.utxos.get_history(wallet, offset, limit)
 
-        self.chain.append(block)
-        return block
+    def get_balance(self, wallet):
+        with self.lock.read():
+            return self.utxos.get_balance(wallet)
 
     def get_prev_block(self):
-        return self.chain[-1]
+        with self.lock.read():
+            return self.chain[-1]
 
-    def is_chain_valid(self):
+    def is_chain_valid(self, chain=None):
         '''
         Checks to make sure this Block Chain is cryptographically valid,
 
             1) Each blocks previous hash correlates to that previous blocks hash
-            2) Each block is hashed correctly, and has the correct amount of leading 0's
-
+               ('0' for the genesis block), and its index is its height
+            2) Each block is hashed correctly, and has the target ChainConfig.next_target() expects and meets it
+            3) Each block's time_stamp passes ChainConfig.time_valid()
+            4) For a peer's chain, each block's Tx only spend coins unspent
+               before it and pay the right reward (see count_valid())
+
+        Blocks up to validated_height have already been checked, so only the
+        ones after it are. For a peer's chain, only the blocks after the
+        point it forks off of our validated blocks are checked, the ones
+        before it must be replaced by ours (see replace_chain()).
+
+        :param chain: List of Block objects to check, defaults to this chain
         :return True if passes
         :return False if doesn't
         '''
-        previous_block = self.chain[0]
-        block_index = 1
-        while block_index < len(self.chain):
-            block = self.chain[block_index]
-            if block.previous_hash != previous_block.hash():
+        with self.lock.read():
+            return self.check_chain(chain)
+
+    def check_chain(self, chain):
+        '''
+        is_chain_valid() without taking the lock
+        '''
+        own_chain = chain is None or chain is self.chain
+        if own_chain:
+            chain = self.chain
+            start = self.get_validated_height()
+        else:
+            start = self.find_fork(chain)
+            if self.count_valid(start + 1, chain[start + 1:]) != len(chain) - start - 1:
                 return False
 
-            if block.hash()[:DIFFICULTY] !=  ( '0' * DIFFICULTY ):
+        if len(chain) == 0:
+            return True
+
+        def block_at(height):
+            return chain[height].time_stamp, chain[height].target
+
+        # With nothing validated or shared, the genesis block is checked too
+        # (next_target() gives the initial target for it)
+        previous_hash = chain[start].hash() if start >= 0 else '0'
+        block_index = start + 1
+        while block_index < len(chain):
+            block = chain[block_index]
+            if block.previous_hash != previous_hash or block.index != block_index:
                 return False
 
-            previous_block = block
+            try:
+                if not self.config.time_valid(block_index, block.time_stamp, block_at) or \
+                        block.target != self.config.next_target(block_index, block_at) or not block.meets_target():
+                    return False
+            except (ValueError, TypeError):
+                return False
+
+            previous_hash = block.hash()
             block_index += 1
+
+        if own_chain:
+            self.set_validated(len(chain) - 1, chain[-1].hash())
         return True
 
+    def set_validated(self, height, block_hash):
+        self.validated_height = height
+        self.validated_hash = block_hash
+
+    def get_validated_height(self):
+        '''
+        :return: validated_height, or -1 if the block at that height has
+        changed since it was validated
+        '''
+        height = self.validated_height
+        if height < 0 or height >= len(self.chain) or self.get_hash(height) != self.validated_hash:
+            self.set_validated(-1, None)
+            return -1
+        return height
+
+    def find_fork(self, chain):
+        '''
+        Binary searches for the newest block a peer's chain shares with our
+        validated blocks. Every block before a shared one is shared too, as
+        each block's hash covers the previous hash.
+
+        :param chain: List of Block objects from a peer
+        :return: height of the last shared block, or -1 if there isn't one
+        '''
+        with self.lock.read():
+            low, high = 0, min(self.get_validated_height(), len(chain) - 1)
+            fork = -1
+            while low <= high:
+                mid = (low + high) // 2
+                if chain[mid].hash() == self.get_hash(mid):
+                    fork = mid
+                    low = mid + 1
+                else:
+                    high = mid - 1
+            return fork
+
     def add_transation(self, tx):
         '''
         Passes the new transaction object to the memlist class.
@@ -137,41 +828,203 @@ class BlockChain:
         self.nodes.add(parsed_url.netloc)
 
     def replace_chain(self):
+        '''
+        Asks every node in self.nodes for their chain, and replaces ours
+        with the longest valid one. All of the peers are queried at once
+        through self.peers (see peers.py), each with its own timeout.
+        Every signature in a candidate chain is checked in one batch across
+        a process pool (see verify.py). The UTXO index is rebuilt from the
+        new chain since none of our old state can be trusted.
 
-        #TODO CHECK IF THIS STILL WORKS
-        network = self.nodes
-        longest_chain = None
-        max_length = len(self.chain)
-        for node in network:
-            response = requests.get(f'http://{node}/get_chain')
-            if response.status_code == 200:
-                length = response.json()['length']
-                chain = response.json()['chain']
-                if length > max_length and self.is_chain_valid(chain):
-                    max_length = length
-                    longest_chain = chain
-
-        if longest_chain:
-            self.chain = longest_chain
-            return True
+        A longer chain is only taken if it also has more cumulative work
+        than ours.
+
+        :return: True if our chain was replaced
+        '''
+
+        def is_valid(chain):
+            start = self.find_fork(chain) + 1
+            return self.is_chain_valid(chain) and self.has_more_work(start, chain[start:]) and \
+                all(verify.verify_chain(chain[start:]).values())
+
+        node, longest_chain = self.peers.find_longest_chain(self.nodes, len(self.chain), is_valid)
+
+        if not longest_chain:
+            return False
+
+        with self.lock.write():
+            # Blocks up to the fork point are ours already, only take the ones after it.
+            # Our chain may have moved on while downloading, so check the work again
+            start = self.find_fork(longest_chain) + 1
+            if not self.check_chain(longest_chain) or not self.has_more_work(start, longest_chain[start:]):
+                return False
+            self.set_chain_suffix(start, longest_chain[start:])
+        return True
+
+    def has_more_work(self, start, blocks):
+        '''
+        :param start: int, height blocks would replace our chain from
+        :param blocks: List of Block objects
+        :return: True if our chain up to start followed by blocks has more
+        cumulative work than our current chain
+        '''
+        work = self.tree.work_at(start - 1) + sum(block.work() for block in blocks)
+        return work > self.tree.tip_work()
+
+    def get_locator(self):
+        '''
+        Hashes of our blocks, newest first: the last 10 one by one, then
+        doubling the step back to the genesis block. Lets a peer find the
+        last block we have in common in one request, however long the chains.
+
+        :return: List of STRING block hashes
+        '''
+
+        with self.lock.read():
+            locator = []
+            height = len(self.chain) - 1
+            step = 1
+            while height > 0:
+                locator.append(self.get_hash(height))
+                if len(locator) >= 10:
+                    step *= 2
+                height -= step
+            if len(self.chain):
+                locator.append(self.get_hash(0))
+            return locator
+
+    def get_headers(self, start, limit):
+        '''
+        :return: List of header dicts (see Block.header()) from height start,
+        a negative start counts as 0
+        '''
+        start = max(start, 0)
+        with self.lock.read():
+            end = min(len(self.chain), start + max(limit, 0))
+            return [self.chain[height].header() for height in range(start, end)]
+
+    def headers_valid(self, headers, start, previous_hash):
+        '''
+        Checks a run of headers from a peer without their transactions: each
+        one is at the right height, has the target and a time_stamp the
+        config accepts, hashes to the hash it claims, meets that target, and
+        links to the one before it, the first linking to previous_hash.
+
+        :param start: int, height of the first header
+        :return: True if passes
+        '''
+
+        def block_at(height):
+            if height >= start:
+                return headers[height - start]['time_stamp'], int(headers[height - start]['target'], 16)
+            with self.lock.read():
+                return self.time_and_target(height)
+
+        try:
+            for height, header in enumerate(headers, start):
+                if header['index'] != height or header['previous_hash'] != previous_hash:
+                    return False
+
+                target = int(header['target'], 16)
+                if target != self.config.next_target(height, block_at) or \
+                        not self.config.time_valid(height, header['time_stamp'], block_at):
+                    return False
+
+                header_hash = Block.hash_header(header)
+                if header_hash != header.get('hash') or int(header_hash, 16) > target:
+                    return False
+
+                previous_hash = header_hash
+        except (KeyError, ValueError, TypeError):
+            return False
+        return True
+
+    def sync_with(self, node):
+        '''
+        Headers first sync with a single peer. Finds the last block we have
+        in common from our locator, downloads and checks only the headers
+        after it, then downloads just those blocks. Bandwidth and work are
+        proportional to the blocks we're missing, not the length of the chain.
+
+        :param node: STRING netloc of the peer
+        :return: True if our chain was extended/replaced
+        '''
+
+        start, headers, length = self.peers.get_headers(node, self.get_locator())
+        if headers is None or length <= len(self.chain):
+            return False
+
+        with self.lock.read():
+            if start > len(self.chain):
+                return False
+            previous_hash = self.get_hash(start - 1) if start > 0 else '0'
+
+        # Keep asking for headers until we have all of the peer's chain
+        while headers and start + len(headers) < length:
+            more = self.peers.get_headers(node, from_height=start + len(headers))[1]
+            if not more:
+                break
+            headers += more
+
+        if start + len(headers) <= len(self.chain):
+            return False
+
+        if not self.headers_valid(headers, start, previous_hash):
+            return False
+
+        blocks = self.peers.get_blocks(node, [header['hash'] for header in headers])
+        if blocks is None:
+            return False
+
+        # Each block hashing to its header means it has the checked links/target/proof of work
+        for block, header in zip(blocks, headers):
+            if block.hash() != header['hash']:
+                return False
+
+        if not all(verify.verify_blocks(blocks).values()):
+            return False
+
+        with self.lock.write():
+            # Our chain may have changed while downloading
+            if start > len(self.chain) or (start > 0 and self.get_hash(start - 1) != previous_hash) or \
+                    not self.has_more_work(start, blocks) or self.count_valid(start, blocks) != len(blocks):
+                return False
+            self.set_chain_suffix(start, blocks)
+        return True
+
+    def sync(self):
+        '''
+        Headers first sync with whichever peer has the longest chain,
+        falling back to the next longest if it fails.
+
+        :return: True if our chain was extended/replaced
+        '''
+
+        lengths = self.peers.get_lengths(self.nodes)
+        for node in sorted(lengths, key=lengths.get, reverse=True):
+            if lengths[node] <= len(self.chain):
+                break
+            if self.sync_with(node):
+                return True
         return False
 
     def __str__(self):
 
         str_chain = []
-        for b in self.chain:
+        for b in self.snapshot():
             str_chain.append(str(b))
         return 'Nodes %s\nChain: %s\n' % (self.nodes, str_chain)
 
     def json(self):
 
         chain_in_dicts = []
+        blocks = self.snapshot()
 
-        for block in self.chain:
+        for block in blocks:
             chain_in_dicts.append(block.json())
 
         return {
-            'length': len(self.chain),
+            'length': len(blocks),
             'chain': chain_in_dicts
         }
 
@@ -198,41 +1051,182 @@ class Block():
 
     transactions: List of Tx Objects
         Represents the list of Transactions in this block.
+
+    merkle_root: String
+        Root of the Merkle tree over the tx_hash of every transaction,
+        this is what the block header commits to. Recomputed whenever
+        transactions is assigned
+
+    target: int
+        256 bit target this block's hash has to be <= to, part of the
+        header. Set by ChainConfig.next_target() when the block is created
+
+    cached_hash: String
+        The result of hash(), kept until one of the header fields or the
+        transactions are assigned again
     '''
 
-    def __init__(self, index, previous_hash, transactions=None):
+    HEADER_FIELDS = ('index', 'nonce', 'previous_hash', 'time_stamp', 'merkle_root', 'target')
+    # Attempts between progress reports when mining without a MiningStats
+    NONCE_BATCH_SIZE = 5000
+
+    def __init__(self, index, previous_hash, transactions=None, target=None):
         self.index = index
         self.nonce = None
         self.previous_hash = previous_hash
         self.time_stamp = str(datetime.datetime.now())
+        self.target = INITIAL_TARGET if target is None else target
         self.transactions = transactions
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+
+        if name == 'transactions':
+            object.__setattr__(self, 'merkle_root', self.compute_merkle_root())
+            object.__setattr__(self, 'cached_hash', None)
+        elif name in Block.HEADER_FIELDS:
+            object.__setattr__(self, 'cached_hash', None)
 
     def hash(self):
         '''
-        Hashing algorithm for a block, encode the String representation
-        then find the SHA256 Hash.
+        Hashing algorithm for a block, the SHA256 Hash of the block header,
+        aka header_prefix() followed by the nonce. Only computed the first
+        time it's asked for after the block changes.
 
         :return: String representation of the SHA256 Hash
         '''
-        encoded_block = str(self).encode()
-        return SHA256.new(encoded_block).hexdigest()
+        if self.cached_hash is None:
+            self.cached_hash = SHA256.new(self.header_prefix() + Block.encode_nonce(self.nonce)).hexdigest()
+        return self.cached_hash
+
+    def invalidate_hash(self):
+        '''
+        Recomputes the merkle root and drops the cached hash, needed after
+        changing the transactions list in place (i.e. append) rather than
+        assigning a new one
+        '''
+        self.transactions = self.transactions
+
+    def tx_hashes(self):
+        if not self.transactions:
+            return []
+        return [tx.tx_hash for tx in self.transactions]
+
+    def compute_merkle_root(self):
+        '''
+        :return: STRING, Merkle root over the tx_hash of every Tx in this block
+        '''
+        return merkle.merkle_root(self.tx_hashes())
+
+    def meets_target(self):
+        '''
+        :return: True if the hash, read as a 256 bit int, is <= target
+        '''
+        return int(self.hash(), 16) <= self.target
+
+    def work(self):
+        '''
+        :return: int, expected number of hashes it took to mine this block
+        '''
+        return 2 ** 256 // (self.target + 1)
+
+    def merkle_proof(self, tx_hash):
+        '''
+        Builds the proof that the Tx with hash tx_hash is in this block,
+        which can be checked against merkle_root with Block.verify_tx_proof()
+
+        :return: List of (side, sibling hash) tuples, or None if the Tx isn't in this block
+        '''
+        tx_hashes = self.tx_hashes()
+        if tx_hash not in tx_hashes:
+            return None
+        return merkle.merkle_proof(tx_hashes, tx_hashes.index(tx_hash))
+
+    @staticmethod
+    def verify_tx_proof(tx_hash, proof, merkle_root):
+        '''
+        Checks a proof from merkle_proof() without needing any of the block's
+        transactions, i.e. for a light client that only has the header.
+
+        :return: True if the Tx is in the block with that merkle_root
+        '''
+        return merkle.verify_proof(tx_hash, proof, merkle_root)
 
-    def find_nonce(self):
+    def header_prefix(self):
+        '''
+        The part of the block header that doesn't change while mining: index,
+        previous hash, time stamp, Merkle root and target. The full header
+        is this followed by encode_nonce(nonce), so mining only has to build
+        this once and hash the nonce on top of it.
+
+        :return: BYTE ARRAY of the serialized header minus the nonce
+        '''
+        return Block.make_prefix(self.index, self.previous_hash, self.time_stamp,
+                                 self.merkle_root, self.target)
+
+    @staticmethod
+    def make_prefix(index, previous_hash, time_stamp, merkle_root, target):
+        return ('%s\n%s\n%s\n%s\n%064x\n' % (index, previous_hash, time_stamp, merkle_root, target)).encode()
+
+    def header(self):
+        '''
+        :return: dict of everything in the block header plus its hash, what
+        a peer needs to check the proof of work without the transactions
+        '''
+        return {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'time_stamp': self.time_stamp,
+            'merkle_root': self.merkle_root,
+            'target': '%064x' % self.target,
+            'nonce': self.nonce,
+            'hash': self.hash()
+        }
+
+    @staticmethod
+    def hash_header(header):
+        '''
+        :param header: dict made by header()
+        :return: STRING, the hash of the block the header belongs to
+        '''
+        prefix = Block.make_prefix(header['index'], header['previous_hash'], header['time_stamp'],
+                                   header['merkle_root'], int(header['target'], 16))
+        return SHA256.new(prefix + Block.encode_nonce(header['nonce'])).hexdigest()
+
+    @staticmethod
+    def encode_nonce(nonce):
+        '''
+        :return: BYTE ARRAY, the nonce as the 8 byte big endian nonce field
+        '''
+        return (nonce or 0).to_bytes(8, byteorder='big')
+
+    def find_nonce(self, miner=None, mining_stats=None):
         '''
         PROOF OF WORK ALGORITHM. Starting at a nonce of 1, continue to
-        increment until you get a SHA256 Hash with the correct amount of
-        leading 0's
-        '''
-        self.nonce = 1
-        check_nonce = False
-        while not check_nonce:
-            hash_operation = self.hash()
-            if hash_operation[:DIFFICULTY] == ( '0' * DIFFICULTY ) :
-                check_nonce = True
-            else:
-                print(self.nonce)
-                self.nonce += 1
+        increment until you get a SHA256 Hash that, read as an int, is
+        <= the block's target. The search is miner.search_nonces(), the same
+        loop a Miner's workers run.
+
+        :param miner: optional Miner object to split the search across
+        several processes, otherwise search on this one
+        :param mining_stats: optional MiningStats object, told the attempts
+        made every mining_stats.batch_size attempts
+        '''
+        if miner is not None:
+            miner.mine(self, self.target, mining_stats)
+            return
+
+        batch_size = self.NONCE_BATCH_SIZE
+        progress = None
+        if mining_stats is not None:
+            mining_stats.start(self.index)
+            batch_size, progress = mining_stats.batch_size, mining_stats.progress
+
+        nonce, attempts, _ = search_nonces(self.header_prefix(), self.target, 1, 1, threading.Event(),
+                                           batch_size, progress=progress)
+        if mining_stats is not None:
+            mining_stats.finish(attempts)
+        self.nonce = nonce
 
     def __str__(self):
         trans_list = []
@@ -255,28 +1249,120 @@ class Block():
             'previous_hash':self.previous_hash,
             'time_stamp':self.time_stamp,
             'nonce': self.nonce,
+            'merkle_root': self.merkle_root,
+            'target': '%064x' % self.target,
+            'hash': self.hash(),
             'transactions': trans_list
         }
 
+    def serialize(self):
+        '''
+        :return: BYTE ARRAY of this block in the binary format from codec.py,
+        as written to a BlockStore
+        '''
+        return codec.encode_block(self)
+
+    @staticmethod
+    def deserialize(data, trust_hash=False):
+        '''
+        Rebuilds a Block from serialize(), or from the JSON records older
+        stores were written with
+
+        :param trust_hash: only used for JSON records, see from_json()
+        '''
+        if bytes(data[:1]) == b'{':
+            return Block.from_json(json.loads(bytes(data)), trust_hash)
+        return codec.decode_block(data)
+
+    @staticmethod
+    def from_json(data, trust_hash=False):
+        '''
+        Rebuilds a Block object from the dict made by json()
+
+        :param trust_hash: if True, use the 'hash' stored in data as the
+        cached hash instead of recomputing it. Only for blocks we wrote
+        ourselves, anything from another node gets rehashed.
+        :raise ValueError: if data's merkle_root isn't the root of its
+        transactions, the header has to commit to the Tx actually sent
+        '''
+
+        transactions = [Tx.from_json(tx) for tx in data['transactions']]
+        block = Block(data['index'], data['previous_hash'], transactions)
+        block.time_stamp = data['time_stamp']
+        block.nonce = data['nonce']
+        block.target = int(data['target'], 16) if data.get('target') else INITIAL_TARGET
+        if data.get('merkle_root') is not None and data['merkle_root'] != block.merkle_root:
+            raise ValueError('merkle_root %s does not match the transactions' % data['merkle_root'])
+        if trust_hash and data.get('hash'):
+            block.cached_hash = data['hash']
+        return block
+
 
 class MemList():
     '''
     Class to represent the list of Transactions to be mined. A object
     must be 1) A Tx object 2) A valid Tx object with all fields valid/
-    correct unlocking scripts and 3) Pointing to a previously unspent Tx
+    correct unlocking scripts 3) Pointing to coins unspent in utxos and
+    4) Not spending a coin another pending Tx already spends, the first
+    Tx seen spending a coin is the one kept
+
+    The pending transactions are kept in a heap ordered by fee (highest
+    first, oldest first on ties) so adding a Tx and pulling the top paying
+    ones for a block are both O(log n). Removing a Tx by its hash just
+    drops it from tx_dict, its heap entry is skipped when it surfaces.
+
+    tx_dict and tx_heap are only touched while holding lock, and only for
+    as long as the dict/heap operations take. Checking signatures happens
+    outside of it, so Tx can keep being admitted while a block is assembled.
 
     Attributes:
     ------------
-    tx_list: List
-        List of the Tx objects waiting to become in the list.
+    tx_dict: Dict
+        tx_hash -> Tx object for every Tx waiting to be mined
+
+    max_num_tx: int
+        Max amount of transactions in a block, including our reward Tx
+
+    tx_heap: List
+        heapq of (-fee, arrival order, tx_hash) tuples
+
+    spends: Dict
+        coin_hash -> tx_hash of the pending Tx spending that coin
+
+    utxos: UTXOSet Object
+        Index of the chain this memlist feeds, to reject Tx spending spent coins
+
+    wallet: String (Wallet)
+        Who the reward Tx from get_tx_to_mine() pays
+
+    lock: threading Lock
+        Guards tx_dict, tx_heap, spends and counter
     '''
 
     #TODO Make sure that MEMLIST stays consistent across time/blocks changing
     MAX_NUM_TX = 3
     MINING_REWARD = 1000
 
-    def __init__(self):
-        self.tx_list = []
+    def __init__(self, max_num_tx=None, utxos=None, wallet=None):
+        if max_num_tx is None:
+            max_num_tx = self.MAX_NUM_TX
+        if max_num_tx < 1:
+            raise ValueError('A block needs room for at least the reward Tx')
+
+        self.max_num_tx = max_num_tx
+        self.utxos = utxos if utxos is not None else UTXOSet()
+        self.wallet = wallet
+        self.tx_dict = {}
+        self.tx_heap = []
+        self.spends = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tx_dict)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self.tx_dict
 
     def add_tx(self, tx):
         '''
@@ -284,76 +1370,178 @@ class MemList():
 
             1) A Tx object
             2) A valid Tx object with all fields valid/correct unlocking scripts and
-            3) Pointing to a previously unspent Tx
+            3) Pointing to a previously unspent Tx, i.e. every coin it spends is
+               in the UTXO index with the lock and amount the Tx claims
+            4) Spending each of those coins once, and none that a pending Tx
+               already spends
 
-        :return True if added to tx_list
+        :return True if added to the memlist
         '''
 
         if not (isinstance(tx, Tx) and tx.check_is_valid()):
             return False
 
+        # A coin that was never created isn't spent either, so it has to be found unspent
         for inp_curr in tx.owned_coins:
-            for block in glob_chain:
-                for tr in block.transactions:
-                    if tr.owned_coins:
-                        for inp in tr.owned_coins:
-                            if inp_curr.coin_hash == inp.coin_hash:
-                                return False
-
-        self.tx_list.append(tx)
+            if not self.utxos.has_coin(inp_curr):
+                return False
+
+        coin_hashes = [coin.coin_hash for coin in tx.owned_coins]
+        if len(set(coin_hashes)) != len(coin_hashes):
+            return False
+
+        with self.lock:
+            if tx.tx_hash in self.tx_dict or any(coin_hash in self.spends for coin_hash in coin_hashes):
+                return False
+
+            self.tx_dict[tx.tx_hash] = tx
+            for coin_hash in coin_hashes:
+                self.spends[coin_hash] = tx.tx_hash
+            heapq.heappush(self.tx_heap, (-tx.fee, next(self.counter), tx.tx_hash))
         return True
 
-    def get_tx_to_mine(self):
+    def remove_tx(self, tx_hash):
+        '''
+        Drops a pending Tx by its hash, i.e. because it showed up in a block
+        mined by someone else.
+
+        :return: the removed Tx object, or None if it wasn't pending
+        '''
+
+        with self.lock:
+            tx = self.tx_dict.pop(tx_hash, None)
+            if tx is not None:
+                self.drop_spends(tx)
+
+            # Rebuild once over half the heap is stale entries so it can't grow forever
+            if tx is not None and len(self.tx_heap) > 2 * len(self.tx_dict) + 16:
+                self.tx_heap = [entry for entry in self.tx_heap if entry[2] in self.tx_dict]
+                heapq.heapify(self.tx_heap)
+
+        return tx
+
+    def remove_conflicts(self, tx):
+        '''
+        Drops every pending Tx spending a coin that tx spends, i.e. when tx
+        shows up in a block, those can never be mined anymore
+
+        :return: List of the removed Tx objects
+        '''
+
+        if tx.reward_coin:
+            return []
+
+        with self.lock:
+            conflicts = set(self.spends.get(coin.coin_hash) for coin in tx.owned_coins)
+        conflicts.discard(None)
+        conflicts.discard(tx.tx_hash)
+        return [removed for removed in map(self.remove_tx, conflicts) if removed is not None]
+
+    def return_txs(self, txs):
+        '''
+        Puts the Tx of a block that left the chain (or never made it) back
+        as pending Tx. Reward Tx, and Tx the chain has spent a coin of since
+        or that conflict with a pending Tx, are left out.
+
+        :param txs: List of mined Tx objects
+        :return: List of the Tx added back
+        '''
+
+        returned = []
+        for tx in txs or []:
+            if tx.reward_coin:
+                continue
+            pending = Tx(tx.unlock, tx.owned_coins, [Tx.coin_values(coin) for coin in tx.sent_coins])
+            if self.add_tx(pending):
+                returned.append(pending)
+        return returned
+
+    def drop_spends(self, tx):
+        '''
+        Forgets the coins a Tx leaving the memlist spent, must hold lock
+        '''
+        for coin in tx.owned_coins:
+            if self.spends.get(coin.coin_hash) == tx.tx_hash:
+                del self.spends[coin.coin_hash]
+
+    def pop_top_tx(self):
+        '''
+        :return: the highest paying pending Tx (removing it), or None if empty
+        '''
+
+        with self.lock:
+            while self.tx_heap:
+                tx_hash = heapq.heappop(self.tx_heap)[2]
+                tx = self.tx_dict.pop(tx_hash, None)
+                if tx is not None:
+                    self.drop_spends(tx)
+                    return tx
+        return None
+
+    def get_tx(self, tx_hash):
+        '''
+        :return: the pending Tx object with that hash, or None
+        '''
+        with self.lock:
+            return self.tx_dict.get(tx_hash)
+
+    def txs(self):
+        '''
+        :return: List of every Tx object waiting to be mined
+        '''
+        with self.lock:
+            return list(self.tx_dict.values())
+
+    def pending_spends(self):
+        '''
+        :return: Set of the coin hashes spent by Tx waiting to be mined, so
+        a wallet building a new Tx can leave them alone
+        '''
+        with self.lock:
+            return set(self.spends)
+
+    def get_tx_to_mine(self, height=None):
         '''
         A function that returns a list of transactions for us to mine
-        from the tx_list. Will always put the transaction that pays
+        from the memlist. Will always put the transaction that pays
         us on top in case we are the node that mines this block.
 
-        If there are more than MAX_NUM_TX - 1 (the tx that we
-        get paid in) in the tx_list, return the list of transactions
-        with the highest paying fees for us.
+        If there are more than max_num_tx - 1 (the tx that we
+        get paid in) pending, return the transactions with the highest
+        paying fees for us, the rest stay in the memlist.
+
+        Tx spending a coin that's no longer unspent (a block spent it since
+        the Tx was added) or that a Tx already picked spends are dropped, so
+        the block never double spends.
 
+        :param height: index of the block being mined, goes in our reward Tx
         :return: List of Tx objects for us to mine.
         '''
 
-        if len(self.tx_list) <= self.MAX_NUM_TX - 1:
-            to_be_returned = []
-            total_fee = 0
-            for tx in self.tx_list:
-                tx.create_new_coins()
-                to_be_returned.append(tx)
-                total_fee += tx.fee
-
-            our_transaction = Tx(None, None, [(our_wallet, self.MINING_REWARD + total_fee)], True)
-            our_transaction.create_new_coins()
-            to_be_returned.insert(0, our_transaction)
-            self.tx_list = []
-            return to_be_returned
-
-        else:
-            to_be_returned = []
-            total_fee = 0
+        to_be_returned = []
+        total_fee = 0
+        picked_coins = set()
 
-            for i in range(0,self.MAX_NUM_TX - 1):
-                target = None
-                curr_max_fee = 0
-                for trans in self.tx_list:
-                    if trans.fee > curr_max_fee:
-                        target = trans
-                        curr_max_fee = trans.fee
-                total_fee += curr_max_fee
-                target.create_new_coins()
-                to_be_returned.append(target)
-                self.tx_list.remove(target)
+        while len(to_be_returned) < self.max_num_tx - 1:
+            tx = self.pop_top_tx()
+            if tx is None:
+                break
 
-                for tx in to_be_returned:
-                    tx.create_new_coins()
+            coin_hashes = set(coin.coin_hash for coin in tx.owned_coins)
+            if not coin_hashes.isdisjoint(picked_coins) or \
+                    not all(self.utxos.has_coin(coin) for coin in tx.owned_coins):
+                continue
 
-            our_transaction = Tx(None, None, [(our_wallet, self.MINING_REWARD + total_fee)], True)
-            our_transaction.create_new_coins()
-            to_be_returned.insert(0, our_transaction)
+            if tx.create_new_coins() is False:
+                continue
 
-            return to_be_returned
+            picked_coins |= coin_hashes
 
+            to_be_returned.append(tx)
+            total_fee += tx.fee
 
+        our_transaction = Tx(None, None, [(self.wallet, self.MINING_REWARD + total_fee)], True, height)
+        our_transaction.create_new_coins()
+        to_be_returned.insert(0, our_transaction)
 
+        return to_be_returned
@@ -0,0 +1,101 @@
+'''
+Primary Purpose: Contains the BLOCKTREE class, which keeps track of the
+cumulative proof of work of the active chain and of every competing branch
+we know about, so the chain with the most work can be picked rather than
+just the longest.
+
+The active chain itself stays in BlockChain.chain, this only holds the
+running total of its work by height, plus the blocks that are on other
+branches, indexed by hash.
+'''
+
+
+class TreeNode():
+    '''
+    A block that isn't on the active chain.
+
+    Attributes
+    ----------
+    block: Block Object
+
+    height: int
+        Where the block would sit in the chain
+
+    work: int
+        Cumulative work of the branch from the genesis block up to and
+        including this block
+    '''
+
+    def __init__(self, block, height, work):
+        self.block = block
+        self.height = height
+        self.work = work
+
+
+class BlockTree():
+    '''
+    Attributes
+    ----------
+    active_work: List
+        Cumulative work of the active chain, active_work[h] covering
+        blocks 0 through h
+
+    side: Dict
+        block hash -> TreeNode for every known block on another branch
+    '''
+
+    def __init__(self):
+        self.active_work = []
+        self.side = {}
+
+    def tip_work(self):
+        return self.active_work[-1] if self.active_work else 0
+
+    def work_at(self, height):
+        '''
+        :return: cumulative work of the active chain up to height, 0 below the genesis block
+        '''
+        return self.active_work[height] if height >= 0 else 0
+
+    def extend_active(self, work):
+        '''
+        :param work: int, work of the block appended to the active chain
+        '''
+        self.active_work.append(self.tip_work() + work)
+
+    def truncate_active(self, height):
+        del self.active_work[height:]
+
+    def add_side(self, block, height, work):
+        self.side[block.hash()] = TreeNode(block, height, work)
+
+    def get_side(self, block_hash):
+        return self.side.get(block_hash)
+
+    def remove_side(self, block_hash):
+        self.side.pop(block_hash, None)
+
+    def branch(self, tip_hash):
+        '''
+        Walks back from a side block to where its branch joins the active chain
+
+        :return: List of TreeNode objects, oldest first, the first one's
+        parent being on the active chain
+        '''
+
+        nodes = []
+        node = self.side.get(tip_hash)
+        while node is not None:
+            nodes.append(node)
+            node = self.side.get(node.block.previous_hash)
+        nodes.reverse()
+        return nodes
+
+    def prune(self, min_height):
+        '''
+        Forgets every side block below min_height, branches that far back
+        can't catch up with the active chain anymore
+        '''
+
+        for block_hash in [h for h, node in self.side.items() if node.height < min_height]:
+            del self.side[block_hash]
@@ -0,0 +1,214 @@
+'''
+Primary Purpose: Contains the TXBUILDER class, which picks the coins to
+spend for a payment, signs them and builds the Tx, so nobody has to pick
+Output objects and make Input objects by hand.
+
+Coins are picked by one of the strategies in STRATEGIES:
+
+    branch_and_bound: searches for coins adding up to exactly what's needed
+        (within max_excess), so no change coin has to be made. Falls back
+        to largest_first if there's no such set.
+    largest_first: the biggest coins first, the fewest inputs possible.
+    consolidation: as many of the smallest coins as max_inputs allows,
+        to merge lots of small coins into one change coin.
+'''
+
+from wrking_crypto.coin import Input
+from wrking_crypto.transaction import Tx
+
+
+def select_largest_first(coins, amount):
+    '''
+    :param coins: List of Output objects to pick from
+    :param amount: int, the least the picked coins have to add up to
+    :return: List of Output objects, or None if all of them aren't enough
+    '''
+
+    picked = []
+    total = 0
+    for coin in sorted(coins, key=lambda coin: coin.amount, reverse=True):
+        if total >= amount:
+            break
+        picked.append(coin)
+        total += coin.amount
+    return picked if total >= amount else None
+
+
+def select_branch_and_bound(coins, amount, max_excess=0, max_tries=100000):
+    '''
+    Depth first search over including/excluding each coin (largest first),
+    for the set adding up to between amount and amount + max_excess with
+    the least excess. Branches that already overshoot, or can't reach
+    amount with the coins left, are cut off.
+
+    :param max_excess: int, how much over amount still counts as a match,
+    the excess goes to the miner instead of a change coin
+    :param max_tries: int, steps to search before settling for the best
+    match so far
+    :return: List of Output objects, falling back to select_largest_first()
+    if no set is found
+    '''
+
+    coins = sorted(coins, key=lambda coin: coin.amount, reverse=True)
+    values = [coin.amount for coin in coins]
+    remaining = [0] * (len(values) + 1)
+    for i in range(len(values) - 1, -1, -1):
+        remaining[i] = remaining[i + 1] + values[i]
+
+    best = None
+    best_total = None
+    chosen = []
+    total = 0
+    i = 0
+    for _ in range(max_tries):
+        if total > amount + max_excess or total + remaining[i] < amount:
+            backtrack = True
+        elif total >= amount:
+            if best is None or total < best_total:
+                best, best_total = list(chosen), total
+            if total == amount:
+                break
+            backtrack = True
+        else:
+            chosen.append(i)
+            total += values[i]
+            i += 1
+            continue
+
+        if backtrack:
+            if not chosen:
+                break
+            # Try the branch without the last coin we included
+            i = chosen.pop()
+            total -= values[i]
+            i += 1
+
+    if best is None:
+        return select_largest_first(coins, amount)
+    return [coins[i] for i in best]
+
+
+def select_consolidation(coins, amount, max_inputs=100):
+    '''
+    :param max_inputs: int, most coins to spend at once
+    :return: List of up to max_inputs of the smallest Output objects, or
+    select_largest_first() if they don't add up to amount
+    '''
+
+    picked = sorted(coins, key=lambda coin: coin.amount)[:max_inputs]
+    if sum(coin.amount for coin in picked) >= amount:
+        return picked
+    return select_largest_first(coins, amount)
+
+
+STRATEGIES = {
+    'branch_and_bound': select_branch_and_bound,
+    'largest_first': select_largest_first,
+    'consolidation': select_consolidation
+}
+
+
+class TxBuilder():
+    '''
+    Builds signed Tx objects paying any number of recipients from a User's
+    coins, any change going back to the User's wallet.
+
+    Attributes
+    ----------
+    user: User Object
+        Owner of the coins being spent, signs every input
+
+    strategy: STRING
+        Key of STRATEGIES, how the coins are picked
+
+    fee: int
+        Fee paid by each Tx built
+
+    max_outputs: int
+        Most recipients in a single Tx, build_batches() splits the rest
+        into more Tx
+
+    recipients: List
+        (wallet, amount) tuples to pay
+    '''
+
+    def __init__(self, user, strategy='branch_and_bound', fee=1, max_outputs=1000):
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown coin selection strategy %s' % strategy)
+        if fee < 0:
+            raise ValueError('The fee can not be negative')
+
+        self.user = user
+        self.strategy = strategy
+        self.fee = fee
+        self.max_outputs = max_outputs
+        self.recipients = []
+
+    def add_recipient(self, wallet, amount):
+        if not isinstance(amount, int) or amount <= 0:
+            raise ValueError('Amounts have to be positive ints, not %s' % amount)
+        self.recipients.append((wallet, amount))
+        return self
+
+    def build(self, coins):
+        '''
+        Builds a single Tx paying every recipient
+
+        :param coins: List of the user's unspent Output objects to pick from
+        :return: signed Tx object
+        '''
+        return self.make_tx(self.recipients, list(coins))
+
+    def build_batches(self, coins):
+        '''
+        Builds as many Tx as needed to pay every recipient with at most
+        max_outputs recipients each. Each Tx picks from the coins the ones
+        before it didn't use, so none of them spend the same coin.
+
+        :param coins: List of the user's unspent Output objects to pick from
+        :return: List of signed Tx objects
+        '''
+
+        coins = list(coins)
+        txs = []
+        for start in range(0, len(self.recipients), self.max_outputs):
+            tx = self.make_tx(self.recipients[start:start + self.max_outputs], coins)
+            spent = set(coin.coin_hash for coin in tx.owned_coins)
+            coins = [coin for coin in coins if coin.coin_hash not in spent]
+            txs.append(tx)
+        return txs
+
+    def make_tx(self, recipients, coins):
+        '''
+        :param recipients: List of (wallet, amount) tuples
+        :param coins: List of Output objects to pick from
+        :return: signed Tx object paying recipients, plus a change coin to
+        the user if the picked coins come to more than needed
+        '''
+
+        if not recipients:
+            raise ValueError('A Tx needs at least one recipient')
+
+        amount = sum(value for _, value in recipients) + self.fee
+        picked = STRATEGIES[self.strategy](coins, amount)
+        if not picked:
+            raise ValueError('Not enough unspent coins to send %s' % amount)
+
+        sent = list(recipients)
+        change = sum(coin.amount for coin in picked) - amount
+        if change > 0:
+            sent.append((self.user.wal, change))
+
+        # The signatures cover the tx_hash, which doesn't depend on them
+        tx = Tx([], picked, sent)
+        tx.unlock = self.sign_inputs(tx)
+        return tx
+
+    def sign_inputs(self, tx):
+        '''
+        :return: List of Input objects unlocking every coin tx spends, signed
+        in one batch (see Tx.signature_message())
+        '''
+        puk = self.user.puk.export_key('PEM')
+        signatures = self.user.sign_batch([tx.signature_message(coin.coin_hash) for coin in tx.owned_coins])
+        return [Input(coin.coin_hash, puk, sig) for coin, sig in zip(tx.owned_coins, signatures)]
@@ -0,0 +1,59 @@
+'''
+Primary Purpose: Contains the LRUCACHE class, a size bounded dict that
+throws away the least recently used entry once it's full.
+'''
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache():
+    '''
+    A dict with at most max_size entries, once full adding a new key drops
+    whichever key was used least recently. Safe to share between threads.
+
+    Attributes
+    ----------
+    max_size: int
+        Max amount of entries kept
+
+    entries: OrderedDict
+        key -> value, ordered from least to most recently used
+    '''
+
+    def __init__(self, max_size):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.entries.pop(key, default)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,374 @@
+'''
+Primary Purpose: Compact, versioned binary encoding of Block, Tx, Input and
+Output objects, for /get_chain payloads and the BlockStore.
+
+Integers are unsigned LEB128 varints, hex hashes are stored as their raw
+bytes, and keys/signatures/the block target are a varint length followed
+by the raw (big endian) bytes.
+Anything that can be recomputed (coin_hash, tx_hash, merkle_root, the block
+hash) is left out and recomputed when decoding, so a peer can't hand us a
+hash that doesn't match its contents.
+
+    Block:  version | index | nonce | previous_hash | time_stamp | target | tx count | Tx...
+    Tx:     flags | [height] | input count | Input... | owned count | Output... | sent count | (lock, amount)...
+    Input:  coin_hash | puk | sig
+    Output: lock | amount | has outpoint | [tx_hash | index]
+
+A chain is version | block count | (length | Block)..., or when streamed
+version | (length | Block)... | 0 since the count isn't known up front.
+
+Decoding reads straight out of a memoryview over the payload, the only
+copies made are the small fields that end up in the objects.
+'''
+
+from wrking_crypto.coin import Input, Output
+from wrking_crypto.transaction import Tx
+
+VERSION = 2
+
+REWARD_FLAG = 0x01
+HEIGHT_FLAG = 0x02
+
+HEX_FIELD = 0
+TEXT_FIELD = 1
+
+
+class Writer():
+    '''
+    Builds up an encoded payload
+    '''
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def varint(self, n):
+        if n < 0:
+            raise ValueError('Can not encode negative int %s' % n)
+        while True:
+            byte = n & 0x7f
+            n >>= 7
+            if n:
+                self.buf.append(byte | 0x80)
+            else:
+                self.buf.append(byte)
+                return
+
+    def raw(self, data):
+        self.varint(len(data))
+        self.buf += data
+
+    def text(self, value):
+        self.raw(value.encode('UTF-8'))
+
+    def hex(self, value):
+        '''
+        Writes a hash as its raw bytes, falling back to text for anything
+        that isn't lower case hex (i.e. the genesis block's previous hash '0')
+        '''
+        if len(value) % 2 == 0 and value == value.lower():
+            try:
+                raw = bytes.fromhex(value)
+                self.buf.append(HEX_FIELD)
+                self.raw(raw)
+                return
+            except ValueError:
+                pass
+        self.buf.append(TEXT_FIELD)
+        self.text(value)
+
+    def getvalue(self):
+        return bytes(self.buf)
+
+
+class Reader():
+    '''
+    Reads fields back out of a payload without copying it
+
+    Attributes
+    ----------
+    view: memoryview
+        The whole payload
+
+    pos: int
+        Offset of the next unread byte
+    '''
+
+    def __init__(self, data, pos=0):
+        self.view = memoryview(data)
+        self.pos = pos
+
+    def byte(self):
+        if self.pos >= len(self.view):
+            raise ValueError('Payload ended early')
+        value = self.view[self.pos]
+        self.pos += 1
+        return value
+
+    def varint(self):
+        n = 0
+        shift = 0
+        while True:
+            byte = self.byte()
+            n |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return n
+            shift += 7
+
+    def raw(self):
+        '''
+        :return: memoryview slice of the next length prefixed field
+        '''
+        length = self.varint()
+        end = self.pos + length
+        if end > len(self.view):
+            raise ValueError('Payload ended early')
+        field = self.view[self.pos:end]
+        self.pos = end
+        return field
+
+    def text(self):
+        return str(self.raw(), 'UTF-8')
+
+    def hex(self):
+        kind = self.byte()
+        if kind == HEX_FIELD:
+            return self.raw().hex()
+        if kind == TEXT_FIELD:
+            return self.text()
+        raise ValueError('Unknown hash field type %s' % kind)
+
+    def done(self):
+        return self.pos >= len(self.view)
+
+
+def write_output(w, coin):
+    w.hex(coin.lock)
+    w.varint(coin.amount)
+    if coin.outpoint is None:
+        w.buf.append(0)
+    else:
+        w.buf.append(1)
+        w.hex(coin.outpoint[0])
+        w.varint(coin.outpoint[1])
+
+
+def read_output(r):
+    lock = r.hex()
+    amount = r.varint()
+    outpoint = None
+    if r.byte():
+        outpoint = (r.hex(), r.varint())
+    return Output(lock, amount, outpoint)
+
+
+def write_input(w, inp):
+    puk = inp.puk.encode('UTF-8') if isinstance(inp.puk, str) else inp.puk
+    w.hex(inp.coin_hash)
+    w.raw(puk)
+    w.raw(inp.sig)
+
+
+def read_input(r):
+    coin_hash = r.hex()
+    puk = bytes(r.raw())
+    sig = bytes(r.raw())
+    return Input(coin_hash, puk, sig)
+
+
+def write_tx(w, tx):
+    flags = 0
+    if tx.reward_coin:
+        flags |= REWARD_FLAG
+    if tx.height is not None:
+        flags |= HEIGHT_FLAG
+    w.buf.append(flags)
+    if tx.height is not None:
+        w.varint(tx.height)
+
+    unlocks = tx.unlock or []
+    w.varint(len(unlocks))
+    for inp in unlocks:
+        write_input(w, inp)
+
+    owned = tx.owned_coins or []
+    w.varint(len(owned))
+    for coin in owned:
+        write_output(w, coin)
+
+    w.varint(len(tx.sent_coins))
+    for coin in tx.sent_coins:
+        lock, amount = Tx.coin_values(coin)
+        w.hex(lock)
+        w.varint(amount)
+
+
+def read_tx(r, mined=True):
+    '''
+    :param mined: if True, turn the sent coins into Output objects like
+    a Tx that's already in a block
+    '''
+    flags = r.byte()
+    height = r.varint() if flags & HEIGHT_FLAG else None
+
+    unlocks = [read_input(r) for _ in range(r.varint())]
+    owned = [read_output(r) for _ in range(r.varint())]
+    sent = []
+    for _ in range(r.varint()):
+        lock = r.hex()
+        sent.append((lock, r.varint()))
+
+    if flags & REWARD_FLAG:
+        tx = Tx(None, None, sent, True, height)
+    else:
+        tx = Tx(unlocks, owned, sent, False, height)
+
+    if mined:
+        tx.sent_coins = tx.make_outputs()
+    return tx
+
+
+def encode_tx(tx):
+    w = Writer()
+    w.buf.append(VERSION)
+    write_tx(w, tx)
+    return w.getvalue()
+
+
+def decode_tx(data, mined=False):
+    r = Reader(data)
+    check_version(r)
+    return read_tx(r, mined)
+
+
+def write_block(w, block):
+    w.buf.append(VERSION)
+    w.varint(block.index)
+    w.varint(block.nonce or 0)
+    w.hex(block.previous_hash)
+    w.text(block.time_stamp)
+    w.raw(block.target.to_bytes(32, byteorder='big'))
+    transactions = block.transactions or []
+    w.varint(len(transactions))
+    for tx in transactions:
+        write_tx(w, tx)
+
+
+def read_block(r):
+    # Imported here, blockchain.py imports this module
+    from wrking_crypto.blockchain import Block
+
+    check_version(r)
+    index = r.varint()
+    nonce = r.varint()
+    previous_hash = r.hex()
+    time_stamp = r.text()
+    target = int.from_bytes(r.raw(), byteorder='big')
+    transactions = [read_tx(r) for _ in range(r.varint())]
+
+    block = Block(index, previous_hash, transactions, target)
+    block.time_stamp = time_stamp
+    block.nonce = nonce
+    return block
+
+
+def encode_block(block):
+    w = Writer()
+    write_block(w, block)
+    return w.getvalue()
+
+
+def decode_block(data):
+    return read_block(Reader(data))
+
+
+def encode_chain(blocks):
+    '''
+    :param blocks: iterable of Block objects
+    :return: BYTE ARRAY of version | block count | (length | Block)...
+    '''
+    blocks = list(blocks)
+    w = Writer()
+    w.buf.append(VERSION)
+    w.varint(len(blocks))
+    for block in blocks:
+        w.raw(encode_block(block))
+    return w.getvalue()
+
+
+def decode_chain(data):
+    '''
+    :return: List of Block objects from a payload made by encode_chain()
+    '''
+    r = Reader(data)
+    check_version(r)
+    blocks = []
+    for _ in range(r.varint()):
+        blocks.append(decode_block(r.raw()))
+    return blocks
+
+
+def encode_chain_stream(blocks):
+    '''
+    Encodes blocks one at a time, for streaming a chain without building
+    the whole payload first. The count isn't known up front, so instead of
+    encode_chain()'s block count it ends with a zero length.
+
+    :param blocks: iterable of Block objects, i.e. BlockChain.iter_blocks()
+    :return: generator of BYTE ARRAYS of version | (length | Block)... | 0
+    '''
+    yield bytes([VERSION])
+    for block in blocks:
+        w = Writer()
+        w.raw(encode_block(block))
+        yield w.getvalue()
+    yield bytes([0])
+
+
+def decode_chain_stream(chunks):
+    '''
+    Decodes a payload made by encode_chain_stream() as it arrives, only
+    ever buffering the block being read
+
+    :param chunks: iterable of BYTE ARRAYS, i.e. Response.iter_content()
+    :return: generator of Block objects
+    :raise ValueError: if the payload is malformed or ends before the zero length
+    '''
+
+    buf = bytearray()
+    pos = 0
+    checked = False
+    for chunk in chunks:
+        buf += chunk
+        if not checked:
+            if not buf:
+                continue
+            check_version(Reader(bytes(buf[:1])))
+            pos = 1
+            checked = True
+
+        while True:
+            # A block's length takes well under 10 varint bytes
+            r = Reader(bytes(buf[pos:pos + 10]))
+            try:
+                length = r.varint()
+            except ValueError:
+                break
+            if length == 0:
+                return
+            start = pos + r.pos
+            if start + length > len(buf):
+                break
+            yield decode_block(bytes(buf[start:start + length]))
+            pos = start + length
+
+        # Drop what's been decoded so the buffer only holds the current block
+        del buf[:pos]
+        pos = 0
+
+    raise ValueError('Payload ended early')
+
+
+def check_version(r):
+    version = r.byte()
+    if version != VERSION:
+        raise ValueError('Unsupported encoding version %s' % version)
@@ -1,4 +1,5 @@
-from Crypto.Hash import RIPEMD160
+import json
+from Crypto.Hash import RIPEMD160, SHA256
 
 class Output():
     '''
@@ -13,15 +14,31 @@ class Output():
     amount: int
         amount of that UTXO holds
 
-    transaction_hash: STRING
-        A RIPEMD160 Hash of the Python Native Hash
+    outpoint: Tuple
+        (tx_hash, index) of the Tx that created this coin and its position
+        in that Tx's sent_coins, what makes two coins with the same lock
+        and amount different. None for a coin not created by a Tx
+
+    coin_hash: STRING
+        A RIPEMD160 Hash of the SHA256 Hash of serialize(), so any node
+        can recompute it from the coin's contents
     '''
 
-    def __init__(self, lock, amount):
+    def __init__(self, lock, amount, outpoint=None):
         self.lock = lock
         self.amount = amount
-        temp_hash =  hash(self)
-        self.coin_hash = RIPEMD160.new(temp_hash.to_bytes( ((temp_hash.bit_length() + 7) // 8 ) , byteorder='big') ).hexdigest()
+        self.outpoint = tuple(outpoint) if outpoint is not None else None
+        self.coin_hash = self.hash()
+
+    def serialize(self):
+        '''
+        :return: BYTE ARRAY, canonical encoding of the lock, amount and outpoint
+        '''
+        outpoint = list(self.outpoint) if self.outpoint is not None else None
+        return json.dumps([self.lock, self.amount, outpoint], separators=(',', ':')).encode()
+
+    def hash(self):
+        return RIPEMD160.new(SHA256.new(self.serialize()).digest()).hexdigest()
 
     def __str__(self):
         return f'Owner: {self.lock.hexdigest()}\nHash: {self.coin_hash.hexdigest()}\nAmount IsCoins: {self.amount}'
@@ -30,6 +47,7 @@ class Output():
         return {
             'lock':self.lock,
             'amount':self.amount,
+            'outpoint': list(self.outpoint) if self.outpoint is not None else None,
             'coin_hash':self.coin_hash
         }
 
@@ -37,9 +55,23 @@ class Output():
         return {
             'lock':str(self.lock),
             'amount':self.amount,
+            'outpoint': list(self.outpoint) if self.outpoint is not None else None,
             'coin_hash': self.coin_hash
         }
 
+    @staticmethod
+    def from_json(data):
+        '''
+        Rebuilds an Output object from the dict made by json()/dict(),
+        recomputing its coin_hash from its contents.
+
+        :raise ValueError: if data carries a coin_hash that doesn't match
+        '''
+        coin = Output(data['lock'], data['amount'], data.get('outpoint'))
+        if data.get('coin_hash') is not None and data['coin_hash'] != coin.coin_hash:
+            raise ValueError('coin_hash %s does not match the coin' % data['coin_hash'])
+        return coin
+
 class Input():
     '''
     Essentially the unlocking script, including target tx's hash, the unlocking
@@ -78,9 +110,24 @@ class Input():
         for byte in self.sig:
             sig_list.append(byte)
 
+        puk = self.puk
+        if isinstance(puk, bytes):
+            puk = puk.decode('UTF-8')
+
         return {
             'coin_hash': self.coin_hash,
-            'puk': self.puk,
+            'puk': puk,
             'sig': sig_list
         }
 
+    @staticmethod
+    def from_json(data):
+        '''
+        Rebuilds an Input object from the dict made by json(), turning the
+        PEM string and the list of signature ints back into bytes.
+        '''
+        puk = data['puk']
+        if isinstance(puk, str):
+            puk = puk.encode('UTF-8')
+        return Input(data['coin_hash'], puk, bytes(data['sig']))
+
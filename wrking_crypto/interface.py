@@ -1,9 +1,57 @@
+import argparse
+import atexit
+import json
+import signal
 import sys
-from flask import Flask, jsonify, request
-from wrking_crypto.blockchain import BlockChain
+from flask import Flask, Response, jsonify, request
+from wrking_crypto.blockchain import Block, BlockChain
+from wrking_crypto.builder import TxBuilder
+from wrking_crypto import codec
+from wrking_crypto.miner import Miner, MiningStats
+from wrking_crypto.relay import BlockRelay, TxRelay
+from wrking_crypto.store import BlockStore
+from wrking_crypto.user import User
+
+MAX_HEADERS = 2000
+
+# Most blocks /get_chain sends when asked for a ?limit=
+MAX_BLOCKS = 500
+
+# Most recipients /send_tx/ puts in a single Tx
+MAX_OUTPUTS = 1000
+
+# Page size of the /wallet endpoints, ?limit= can ask for up to MAX_PAGE
+PAGE_SIZE = 100
+MAX_PAGE = 1000
+
+# Seconds between mining progress samples shown by /mining_stats
+MINING_STATS_INTERVAL = 1.0
 
 app = Flask(__name__)
-block_chain = BlockChain()
+node_user = User()
+
+def open_chain(data_dir=None, miner_processes=1):
+    '''
+    Sets up this node's chain and relays. With a data_dir the chain is kept
+    in a BlockStore there, and the UTXO index is saved next to it when the
+    node shuts down, so a restart picks up where it left off without
+    replaying the whole chain. Without one the chain only lives in memory.
+
+    :param miner_processes: int, processes /mine_block searches for the
+    nonce on, 0 for one per core. 1 mines on the request's own thread
+    '''
+
+    global block_chain, relay, block_relay
+    store = BlockStore(data_dir) if data_dir else None
+    miner = Miner(miner_processes or None) if miner_processes != 1 else None
+    block_chain = BlockChain(node_user.wal, miner=miner, store=store,
+                             mining_stats=MiningStats(MINING_STATS_INTERVAL))
+    relay = TxRelay(block_chain)
+    block_relay = BlockRelay(block_chain)
+    if store is not None:
+        atexit.register(block_chain.save_state)
+
+open_chain()
 
 '''
     Module that a user of the network would run to be able to interact
@@ -16,40 +64,131 @@ block_chain = BlockChain()
 
 @app.route('/send_tx/', methods=['POST'])
 def send_tx():
+    '''
+    Pays every recipient from this node's coins and adds the Tx to our
+    memlist. Expects {"recipients": [{"wallet": ..., "amount": ...}, ...]}
+    with optional "fee" (per Tx) and "strategy" (see builder.STRATEGIES).
+    More than MAX_OUTPUTS recipients are split over several Tx.
+    '''
+
+    json = request.get_json(silent=True) or {}
+    recipients = json.get('recipients')
+    if not recipients:
+        return 'No recipients', 400
+
+    try:
+        builder = TxBuilder(node_user, json.get('strategy', 'branch_and_bound'),
+                            json.get('fee', 1), MAX_OUTPUTS)
+        for recipient in recipients:
+            builder.add_recipient(recipient['wallet'], recipient['amount'])
 
-    #TODO: IMPLEMENT the stuff that will actually get a series of UTXOs
-    #of UTXOs to send and sign
-    trans = tx.json()
-    return jsonify(trans), 201
+        # Coins already spent by a pending Tx of ours would just get the new one rejected
+        pending = block_chain.memlist.pending_spends()
+        coins = [coin for coin in block_chain.get_wallet_coins(node_user.wal)[1]
+                 if coin.coin_hash not in pending]
+        txs = builder.build_batches(coins)
+    except (KeyError, TypeError, ValueError) as e:
+        return str(e), 400
+
+    for tx in txs:
+        if not block_chain.add_transation(tx):
+            return 'Tx %s was rejected by the memlist' % tx.tx_hash, 409
+        relay.announce(tx.tx_hash)
+
+    response = {'txs': [tx.json() for tx in txs]}
+    return jsonify(response), 201
 
 @app.route('/rec_tx', methods = ['POST'])
 def rec_tx():
+    '''
+    Takes a Tx made by Tx.json(), or {"txs": [...]} of them (what peers
+    send after an /inv), adds the valid ones to our memlist and relays them
+    '''
 
-    #TODO: UNPACK the recieved JSON into a TX object
-    json = request.get_json()
-    transation_keys = ['inputs', 'outputs', 'amount']
+    json = request.get_json(silent=True)
+    if isinstance(json, dict) and 'txs' in json:
+        json = json['txs']
+    elif isinstance(json, dict):
+        json = [json]
+    if not isinstance(json, list):
+        return 'Expected a Tx or {"txs": [...]}', 400
 
+    added, rejected = relay.receive(json)
+    response = {'added': added,
+                'rejected': rejected}
+    return jsonify(response), 201 if added else 200
 
-    return jsonify(response), 201
+@app.route('/inv', methods = ['POST'])
+def inv():
+    '''
+    A peer announcing {"txs": [tx hashes]}, answers with the ones we want
+    it to send to /rec_tx
+    '''
+
+    json = request.get_json(silent=True) or {}
+    tx_hashes = json.get('txs')
+    if not isinstance(tx_hashes, list):
+        return 'No txs', 400
+
+    response = {'wanted': relay.wanted([h for h in tx_hashes if isinstance(h, str)])}
+    return jsonify(response), 200
 
 @app.route('/mine_block', methods = ['GET'])
 def mine_block():
 
-    previous_block = block_chain.get_prev_block()
-    previous_nonce = previous_block['nonce']
-    nonce = block_chain.nonce_of_work(previous_nonce)
-    previous_hash = block_chain.hash(previous_block)
-    block_chain.add_transation(sender=node_address, reciever = 'Isaac', amount = 1)
-    block = block_chain.create_block(nonce, previous_hash)
+    block = block_chain.create_block()
+    # A peer's block may have beaten it, then it's on a side branch or nowhere
+    if block_chain.height_of(block.hash()) is not None:
+        block_relay.announce(block)
     response = {'message':'You just mined a block!',
-                'index':block['index'],
-                'timestamp': block['timestamp'],
-                'nonce': block['nonce'],
-                'previous_hash': block['previous_hash'],
-                'transactions':block['transactions']
+                'index': block.index,
+                'time_stamp': block.time_stamp,
+                'nonce': block.nonce,
+                'previous_hash': block.previous_hash,
+                'hash': block.hash(),
+                'transactions': [tx.json() for tx in block.transactions]
                 }
     return jsonify(response),200
 
+@app.route('/cmpct_block', methods = ['POST'])
+def cmpct_block():
+    '''
+    A compact block from a peer (see relay.make_compact()), answers with
+    its status and the indexes of any Tx to send to /block_txn
+    '''
+    try:
+        response = block_relay.receive_compact(request.get_json(silent=True) or {})
+    except (IndexError, KeyError, TypeError, ValueError) as e:
+        return str(e), 400
+    return jsonify(response), 200
+
+@app.route('/block_txn', methods = ['POST'])
+def block_txn():
+    try:
+        response = block_relay.receive_block_txn(request.get_json(silent=True) or {})
+    except (IndexError, KeyError, TypeError, ValueError) as e:
+        return str(e), 400
+    return jsonify(response), 200
+
+@app.route('/add_block', methods = ['POST'])
+def add_block():
+    '''
+    A whole block from a peer, in the binary encoding from codec.py or as
+    the JSON made by Block.json()
+    '''
+    try:
+        if request.mimetype == 'application/octet-stream':
+            block = codec.decode_block(request.get_data())
+        else:
+            block = Block.from_json(request.get_json(silent=True) or {})
+    except (KeyError, TypeError, ValueError) as e:
+        return str(e), 400
+    return jsonify(block_relay.receive_block(block)), 200
+
+@app.route('/mining_stats', methods = ['GET'])
+def mining_stats():
+    return jsonify(block_chain.mining_stats.json()), 200
+
 @app.route('/add_transation', methods = ['POST'])
 def add_transation():
 
@@ -64,7 +203,7 @@ def add_transation():
 
 @app.route('/is_valid', methods = ['GET'])
 def is_valid():
-    is_valid = block_chain.is_chain_valid(block_chain.chain)
+    is_valid = block_chain.is_chain_valid()
     if is_valid:
         response = {'message': 'Our Blockchain is valid.'}
     else:
@@ -73,10 +212,147 @@ def is_valid():
 
 @app.route('/get_chain', methods = ['GET'])
 def get_chain():
-    response = {'chain': block_chain.chain,
+    '''
+    ?from_height= and ?limit= (at most MAX_BLOCKS) ask for part of the chain,
+    by default it's all of it. ?format= picks how it's sent:
+
+        json:       {'length', 'from_height', 'chain'} in one response
+        ndjson:     streamed, one block's JSON per line
+        bin:        codec.encode_chain() in one response
+        bin_stream: streamed codec.encode_chain_stream()
+
+    The streamed formats read the chain ITER_BATCH_SIZE blocks at a time
+    (see BlockChain.iter_blocks()), so neither side holds all of it at once.
+    If the chain reorgs part way through, iter_blocks() raises and the
+    response is cut off: bin_stream never gets its zero length, so the peer
+    sees a broken download rather than a shorter chain.
+    '''
+
+    start = max(request.args.get('from_height', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    end = None if limit is None else start + min(max(limit, 0), MAX_BLOCKS)
+    chain_format = request.args.get('format', 'json')
+
+    if chain_format == 'ndjson':
+        lines = (json.dumps(block.json()) + '\n' for block in block_chain.iter_blocks(start, end))
+        return Response(lines, mimetype='application/x-ndjson'), 200
+
+    if chain_format == 'bin_stream':
+        return Response(codec.encode_chain_stream(block_chain.iter_blocks(start, end)),
+                        mimetype='application/octet-stream'), 200
+
+    blocks = block_chain.snapshot(start, end)
+    if chain_format == 'bin':
+        return Response(codec.encode_chain(blocks), mimetype='application/octet-stream'), 200
+
+    response = {'length': len(block_chain.chain),
+                'from_height': start,
+                'chain': [block.json() for block in blocks]}
+    return jsonify(response), 200
+
+@app.route('/chain_length', methods = ['GET'])
+def chain_length():
+    response = {'length': len(block_chain.chain)}
+    return jsonify(response), 200
+
+@app.route('/get_headers', methods = ['GET'])
+def get_headers():
+
+    # Start after the newest block of the locator we have, otherwise at from_height
+    start = max(request.args.get('from_height', 0, type=int), 0)
+    locator = request.args.get('locator')
+    limit = min(max(request.args.get('limit', MAX_HEADERS, type=int), 0), MAX_HEADERS)
+
+    with block_chain.lock.read():
+        if locator:
+            start = 0
+            for block_hash in locator.split(','):
+                height = block_chain.height_of(block_hash)
+                if height is not None:
+                    start = height + 1
+                    break
+
+        response = {'start': start,
+                    'length': len(block_chain.chain),
+                    'headers': block_chain.get_headers(start, limit)}
+    return jsonify(response), 200
+
+@app.route('/get_block/<block_hash>', methods = ['GET'])
+def get_block(block_hash):
+
+    block = block_chain.get_block_by_hash(block_hash)
+    if block is None:
+        return 'No block with that hash', 404
+
+    if request.args.get('format') == 'bin':
+        return Response(codec.encode_block(block), mimetype='application/octet-stream'), 200
+    return jsonify(block.json()), 200
+
+@app.route('/sync', methods = ['GET'])
+def sync():
+    is_synced = block_chain.sync()
+    response = {'message': 'Downloaded the blocks we were missing.' if is_synced
+                else 'No peer has a longer valid chain.',
                 'length': len(block_chain.chain)}
     return jsonify(response), 200
 
+@app.route('/get_tx_proof/<int:height>/<tx_hash>', methods = ['GET'])
+def get_tx_proof(height, tx_hash):
+
+    block = block_chain.get_block(height)
+    if block is None:
+        return 'No block at that height', 404
+
+    proof = block.merkle_proof(tx_hash)
+    if proof is None:
+        return 'That transaction is not in this block', 404
+
+    response = {'tx_hash': tx_hash,
+                'merkle_root': block.merkle_root,
+                'block_hash': block.hash(),
+                'proof': proof}
+    return jsonify(response), 200
+
+def get_page():
+    '''
+    :return: (offset, limit) from the ?offset= and ?limit= of the request
+    '''
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE)
+    return offset, limit
+
+@app.route('/wallet/<wallet>/balance', methods = ['GET'])
+def wallet_balance(wallet):
+    response = {'wallet': wallet,
+                'balance': block_chain.get_balance(wallet)}
+    return jsonify(response), 200
+
+@app.route('/wallet/<wallet>/utxos', methods = ['GET'])
+def wallet_utxos(wallet):
+
+    offset, limit = get_page()
+    total, coins = block_chain.get_wallet_coins(wallet, offset, limit)
+    response = {'wallet': wallet,
+                'total': total,
+                'offset': offset,
+                'limit': limit,
+                'utxos': [coin.json() for coin in coins]}
+    return jsonify(response), 200
+
+@app.route('/wallet/<wallet>/history', methods = ['GET'])
+def wallet_history(wallet):
+
+    # Newest first
+    offset, limit = get_page()
+    total, entries = block_chain.get_wallet_history(wallet, offset, limit)
+    response = {'wallet': wallet,
+                'total': total,
+                'offset': offset,
+                'limit': limit,
+                'history': [{'height': height, 'tx_hash': tx_hash, 'received': received, 'sent': sent}
+                            for height, tx_hash, received, sent in entries]}
+    return jsonify(response), 200
+
 @app.route('/connect_node', methods = ['POST'])
 def connect_node():
     json = request.get_json()
@@ -92,18 +368,34 @@ def connect_node():
 # Replacing our chain with other chains if they're longer
 @app.route('/replace_chain', methods = ['GET'])
 def replace_chain():
-    is_chain_replace = block_chain.replace_chain(block_chain.chain)
+    is_chain_replace = block_chain.replace_chain()
     if is_chain_replace:
         response = {'message': 'Our Blockchain is not the longest. Has been updated.',
-                    'new_chain': block_chain.chain}
+                    'length': len(block_chain.chain)}
     else:
         response = {'message': 'Our Blockchain is the longest. It has not been replaced.',
-                    'curr_chain': block_chain.chain}
+                    'length': len(block_chain.chain)}
     return jsonify(response)
 
 # Running the app
 if __name__ == '__main__':
-    app.run( host = '0.0.0.0', port= int(sys.argv[1]) )
+    # i.e. python -m wrking_crypto.interface 5001 http://127.0.0.1:5002 http://127.0.0.1:5003 --data-dir node1
+    parser = argparse.ArgumentParser(description='Run a node of the network')
+    parser.add_argument('port', type=int)
+    parser.add_argument('nodes', nargs='*', help='Peers to connect to')
+    parser.add_argument('--data-dir', help='Folder to keep the chain in between restarts, '
+                                           'in memory only if not given')
+    parser.add_argument('--miner-processes', type=int, default=0,
+                        help='Processes to mine on, one per core by default, 1 to mine in this one')
+    args = parser.parse_args()
+
+    open_chain(args.data_dir, args.miner_processes)
+    if args.data_dir:
+        # Stopped by a kill rather than Ctrl-C, still exit normally so the state is saved
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    for node in args.nodes:
+        block_chain.add_node(node)
+    app.run( host = '0.0.0.0', port= args.port, threaded=True )
 
     '''
     Code for generating a sample Tx() object
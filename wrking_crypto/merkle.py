@@ -0,0 +1,99 @@
+'''
+Primary Purpose: Functions for building a Merkle tree over a block's
+transaction hashes, and for creating/checking inclusion proofs against
+its root.
+
+Leaves are SHA256(0x00 + tx_hash) and parents are SHA256(0x01 + left + right),
+so a leaf can never be passed off as a parent. A level with an odd amount
+of nodes moves its last node up unchanged rather than pairing it with a
+copy of itself.
+'''
+
+from Crypto.Hash import SHA256
+
+LEAF = b'\x00'
+NODE = b'\x01'
+
+
+def hash_leaf(tx_hash):
+    return SHA256.new(LEAF + tx_hash.encode()).digest()
+
+
+def hash_node(left, right):
+    return SHA256.new(NODE + left + right).digest()
+
+
+def next_level(level):
+    parents = []
+    for i in range(0, len(level) - 1, 2):
+        parents.append(hash_node(level[i], level[i + 1]))
+    if len(level) % 2 == 1:
+        parents.append(level[-1])
+    return parents
+
+
+def merkle_root(tx_hashes):
+    '''
+    :param tx_hashes: List of STRING tx hashes, in block order
+    :return: STRING, hex of the Merkle root (SHA256 of nothing if empty)
+    '''
+
+    if not tx_hashes:
+        return SHA256.new(b'').hexdigest()
+
+    level = [hash_leaf(h) for h in tx_hashes]
+    while len(level) > 1:
+        level = next_level(level)
+    return level[0].hex()
+
+
+def merkle_proof(tx_hashes, index):
+    '''
+    Builds the inclusion proof for the tx at tx_hashes[index]
+
+    :param tx_hashes: List of STRING tx hashes, in block order
+    :param index: int, position of the target tx in the block
+    :return: List of (side, sibling hex) tuples from the leaf up to the root,
+    side being 'L' if the sibling is hashed on the left and 'R' if on the right
+    '''
+
+    if not 0 <= index < len(tx_hashes):
+        raise IndexError('No tx at index %s of the block' % index)
+
+    proof = []
+    level = [hash_leaf(h) for h in tx_hashes]
+    while len(level) > 1:
+        if index % 2 == 1:
+            proof.append(('L', level[index - 1].hex()))
+        elif index + 1 < len(level):
+            proof.append(('R', level[index + 1].hex()))
+
+        level = next_level(level)
+        index //= 2
+
+    return proof
+
+
+def verify_proof(tx_hash, proof, root):
+    '''
+    Checks that the tx with hash tx_hash is in the block whose Merkle root
+    is root, only using the O(log n) hashes in the proof.
+
+    :param proof: List of (side, sibling hex) tuples from merkle_proof()
+    :param root: STRING hex of the expected Merkle root
+    :return: True if the proof leads to the root
+    '''
+
+    current = hash_leaf(tx_hash)
+    try:
+        for side, sibling in proof:
+            if side == 'L':
+                current = hash_node(bytes.fromhex(sibling), current)
+            elif side == 'R':
+                current = hash_node(current, bytes.fromhex(sibling))
+            else:
+                return False
+    except (ValueError, TypeError):
+        return False
+
+    return current.hex() == root
@@ -0,0 +1,301 @@
+'''
+Primary Purpose: Contains the MINER class, a proof of work engine that
+splits the nonce search for a Block across every core of the machine.
+
+Worker i of n tries the nonces i + 1, i + 1 + n, i + 1 + 2n, ... so no two
+workers ever hash the same nonce. Like verify.py's pool, the workers are
+started fresh rather than forked (see verify.START_METHOD), so a script
+mining with several processes needs its top level code under
+if __name__ == '__main__'. Each worker hashes the block's header
+prefix once and copies that SHA256 state for every attempt, so an attempt
+only costs hashing the 8 byte nonce field.
+
+Also contains MININGSTATS, which collects the attempts and hash rate of
+the block being mined. The mining loops only report to it once per batch
+of attempts, and it only hands a sample to its callback every `interval`
+seconds, so watching a miner costs nothing per hash.
+'''
+
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from wrking_crypto.verify import START_METHOD
+
+
+def search_nonces(prefix, target, start, step, found, batch_size, max_attempts=None, progress=None):
+    '''
+    Tries the nonces start, start + step, start + 2 * step, ... until one
+    hashes to an int <= target, `found` is set by another worker, or
+    max_attempts runs out.
+
+    :param prefix: BYTE ARRAY, the block's Block.header_prefix()
+    :param target: int, the block's 256 bit target
+    :param found: Event shared by all of the workers (a multiprocessing one across processes)
+    :param batch_size: how many attempts between checks of `found`
+    :param progress: optional function, called with the attempts made so
+    far after every batch
+    :return: (nonce or None, attempts made, seconds spent)
+    '''
+
+    prefix_state = hashlib.sha256(prefix)
+    nonce = start
+    attempts = 0
+    started = time.perf_counter()
+
+    while not found.is_set():
+        for _ in range(batch_size):
+            attempt = prefix_state.copy()
+            attempt.update(nonce.to_bytes(8, byteorder='big'))
+            attempts += 1
+            if int.from_bytes(attempt.digest(), 'big') <= target:
+                found.set()
+                return nonce, attempts, time.perf_counter() - started
+            nonce += step
+
+        if progress is not None:
+            progress(attempts)
+        if max_attempts is not None and attempts >= max_attempts:
+            break
+
+    return None, attempts, time.perf_counter() - started
+
+
+def _worker(worker_id, prefix, target, start, step, found, batch_size, counter, results):
+    reported = [0]
+
+    def progress(attempts):
+        # counter is shared by every worker, the parent reads it for MiningStats
+        with counter.get_lock():
+            counter.value += attempts - reported[0]
+        reported[0] = attempts
+
+    nonce, attempts, seconds = search_nonces(prefix, target, start, step, found, batch_size,
+                                             progress=progress)
+    results.put((worker_id, nonce, attempts, seconds))
+
+
+class MiningStats():
+    '''
+    Progress of the block being mined, and totals over every block mined,
+    for monitoring a miner (i.e. the /mining_stats endpoint).
+
+    Attributes
+    ----------
+    interval: float
+        Seconds between samples handed to callback while a block is mined
+
+    callback: function
+        Optional, called with a sample dict (see sample()) every interval
+        seconds and once more when the block is found
+
+    batch_size: int
+        How many attempts Block.find_nonce() makes between reports
+
+    mining: int
+        Index of the block being mined, None when not mining
+
+    block_attempts: int
+        Attempts made on the block being mined so far
+
+    blocks_mined / total_attempts / total_seconds: int / int / float
+        Totals over every block finished since this was made
+
+    last_sample: dict
+        The latest sample, None before the first one
+    '''
+
+    def __init__(self, interval=1.0, callback=None, batch_size=5000):
+        self.interval = interval
+        self.callback = callback
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+
+        self.mining = None
+        self.block_attempts = 0
+        self.block_started = 0.0
+        self.last_report = 0.0
+        self.blocks_mined = 0
+        self.total_attempts = 0
+        self.total_seconds = 0.0
+        self.last_sample = None
+
+    def start(self, index):
+        '''
+        :param index: index of the block that's about to be mined
+        '''
+        with self.lock:
+            self.mining = index
+            self.block_attempts = 0
+            self.block_started = time.perf_counter()
+            self.last_report = self.block_started
+
+    def progress(self, attempts):
+        '''
+        Called by the mining loops once per batch. Only takes a sample if
+        interval seconds have passed since the last one.
+
+        :param attempts: attempts made on the current block so far
+        '''
+        now = time.perf_counter()
+        with self.lock:
+            self.block_attempts = attempts
+            if now - self.last_report < self.interval:
+                return
+            self.last_report = now
+            sample = self.sample(now, False)
+        self.report(sample)
+
+    def finish(self, attempts):
+        '''
+        Called once the nonce is found
+
+        :param attempts: attempts it took in total
+        '''
+        now = time.perf_counter()
+        with self.lock:
+            self.block_attempts = attempts
+            sample = self.sample(now, True)
+            self.blocks_mined += 1
+            self.total_attempts += attempts
+            self.total_seconds += now - self.block_started
+            self.mining = None
+        self.report(sample)
+
+    def sample(self, now, done):
+        seconds = now - self.block_started
+        self.last_sample = {
+            'index': self.mining,
+            'attempts': self.block_attempts,
+            'seconds': seconds,
+            'hash_rate': self.block_attempts / seconds if seconds > 0 else 0.0,
+            'done': done
+        }
+        return self.last_sample
+
+    def report(self, sample):
+        if self.callback is not None:
+            self.callback(sample)
+
+    def hash_rate(self):
+        '''
+        :return: hashes per second over every block mined so far
+        '''
+        return self.total_attempts / self.total_seconds if self.total_seconds > 0 else 0.0
+
+    def json(self):
+        with self.lock:
+            return {
+                'mining': self.mining,
+                'block_attempts': self.block_attempts,
+                'blocks_mined': self.blocks_mined,
+                'total_attempts': self.total_attempts,
+                'total_seconds': self.total_seconds,
+                'hash_rate': self.hash_rate(),
+                'last_sample': self.last_sample
+            }
+
+
+class Miner():
+    '''
+    Mines Blocks using a pool of worker processes, one per core by default.
+
+    Attributes
+    ----------
+    processes: int
+        Number of worker processes to split the nonce space over
+
+    batch_size: int
+        Number of hashes a worker tries between checks of whether another
+        worker already found the nonce
+
+    stats: List
+        One dict per worker from the last call to mine(), holding the
+        worker id, attempts made, seconds spent and hashes per second
+    '''
+
+    def __init__(self, processes=None, batch_size=5000):
+        self.processes = processes or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.stats = []
+
+    def mine(self, block, target, mining_stats=None):
+        '''
+        Finds a nonce for `block` whose hash is <= target and stores it in
+        block.nonce
+
+        :param block: Block object to be mined
+        :param target: int, 256 bit target the hash has to meet
+        :param mining_stats: optional MiningStats to report progress to
+        :return: the nonce that was found
+        '''
+
+        prefix = block.header_prefix()
+        if mining_stats is not None:
+            mining_stats.start(block.index)
+
+        if self.processes == 1:
+            found = threading.Event()
+            progress = mining_stats.progress if mining_stats is not None else None
+            nonce, attempts, seconds = search_nonces(prefix, target, 1, 1,
+                                                     found, self.batch_size, progress=progress)
+            self.stats = [Miner.make_stat(0, attempts, seconds)]
+            if mining_stats is not None:
+                mining_stats.finish(attempts)
+            block.nonce = nonce
+            return nonce
+
+        context = multiprocessing.get_context(START_METHOD)
+        found = context.Event()
+        counter = context.Value('Q', 0)
+        results = context.Queue()
+        workers = []
+        for worker_id in range(self.processes):
+            proc = context.Process(
+                target=_worker,
+                args=(worker_id, prefix, target, worker_id + 1, self.processes,
+                      found, self.batch_size, counter, results),
+                daemon=True)
+            proc.start()
+            workers.append(proc)
+
+        nonce = None
+        self.stats = []
+        while len(self.stats) < len(workers):
+            try:
+                timeout = mining_stats.interval if mining_stats is not None else None
+                worker_id, worker_nonce, attempts, seconds = results.get(timeout=timeout)
+            except queue.Empty:
+                mining_stats.progress(counter.value)
+                continue
+
+            self.stats.append(Miner.make_stat(worker_id, attempts, seconds))
+            if worker_nonce is not None and nonce is None:
+                nonce = worker_nonce
+
+        for proc in workers:
+            proc.join()
+
+        self.stats.sort(key=lambda stat: stat['worker'])
+        if mining_stats is not None:
+            mining_stats.finish(sum(stat['attempts'] for stat in self.stats))
+        block.nonce = nonce
+        return nonce
+
+    @staticmethod
+    def make_stat(worker_id, attempts, seconds):
+        return {
+            'worker': worker_id,
+            'attempts': attempts,
+            'seconds': seconds,
+            'hash_rate': attempts / seconds if seconds > 0 else 0.0
+        }
+
+    def hash_rate(self):
+        '''
+        :return: combined hashes per second of every worker in the last mine()
+        '''
+        return sum(stat['hash_rate'] for stat in self.stats)
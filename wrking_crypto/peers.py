@@ -0,0 +1,284 @@
+'''
+Primary Purpose: Contains the PEERCLIENT class, which talks to the other
+nodes of the network concurrently over pooled keep-alive connections.
+
+Every request has a timeout, so one slow or dead peer can only ever cost
+that timeout rather than stalling the whole node.
+'''
+
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from wrking_crypto import codec
+
+
+def is_count(value):
+    '''
+    :return: True if a value from a peer's JSON is a usable height or length,
+    a non negative int (and not a bool)
+    '''
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+class PeerClient():
+    '''
+    Sends requests to many peers at once from a thread pool, sharing one
+    requests Session so connections to each peer are kept alive and reused.
+
+    Attributes
+    ----------
+    timeout: Tuple
+        (connect, read) timeout in seconds for every request
+
+    fetch_timeout: int
+        Seconds a whole chain download may take before that peer is skipped
+
+    session: requests.Session
+        Keeps a pool of keep-alive connections per peer
+
+    executor: ThreadPoolExecutor
+        Runs the requests to different peers concurrently
+    '''
+
+    TIMEOUT = (2, 10)
+    FETCH_TIMEOUT = 60
+    MAX_WORKERS = 16
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, timeout=None, max_workers=None, fetch_timeout=None):
+        self.timeout = timeout or self.TIMEOUT
+        self.fetch_timeout = fetch_timeout or self.FETCH_TIMEOUT
+        max_workers = max_workers or self.MAX_WORKERS
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers)
+
+    def get(self, node, path, params=None, stream=False):
+        '''
+        :param node: STRING netloc of the peer, i.e. 127.0.0.1:5001
+        :param path: STRING path of the endpoint, i.e. /get_chain
+        :return: the Response if it came back with a 200, otherwise None
+        '''
+
+        try:
+            response = self.session.get(f'http://{node}{path}', params=params,
+                                        timeout=self.timeout, stream=stream)
+        except requests.RequestException:
+            return None
+
+        if response.status_code != 200:
+            response.close()
+            return None
+        return response
+
+    def get_json(self, node, path, params=None):
+        response = self.get(node, path, params)
+        if response is None:
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+    def post_json(self, node, path, data):
+        '''
+        POSTs data as JSON to a peer
+
+        :return: the JSON it answered with if it came back with a 200 or
+        201, otherwise None
+        '''
+        return self.post(node, path, json=data)
+
+    def post_bytes(self, node, path, data):
+        '''
+        POSTs a binary payload (i.e. from codec.py) to a peer
+
+        :return: the JSON it answered with, like post_json()
+        '''
+        return self.post(node, path, data=data, headers={'Content-Type': 'application/octet-stream'})
+
+    def post(self, node, path, **kwargs):
+        try:
+            response = self.session.post(f'http://{node}{path}', timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            return None
+
+        if response.status_code not in (200, 201):
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+    def map(self, function, nodes):
+        '''
+        Calls function(node) for every node at the same time
+
+        :return: Dict of node -> result, None for any node that failed or
+        didn't answer within the timeout
+        '''
+
+        nodes = list(nodes)
+        futures = {node: self.executor.submit(function, node) for node in nodes}
+        wait(futures.values(), timeout=sum(self.timeout) + 1)
+
+        results = {}
+        for node, future in futures.items():
+            if future.done() and future.exception() is None:
+                results[node] = future.result()
+            else:
+                future.cancel()
+                results[node] = None
+        return results
+
+    def get_lengths(self, nodes):
+        '''
+        :return: Dict of node -> length of its chain, for every node that answered
+        '''
+
+        def length_of(node):
+            data = self.get_json(node, '/chain_length')
+            length = data.get('length') if isinstance(data, dict) else None
+            return length if is_count(length) else None
+
+        lengths = self.map(length_of, nodes)
+        return {node: length for node, length in lengths.items() if length is not None}
+
+    def fetch_chain(self, node, cancelled=None):
+        '''
+        Downloads a peer's whole chain in the streamed binary format,
+        decoding blocks as they arrive, giving up part way through if
+        cancelled is set
+
+        :param cancelled: optional threading Event
+        :return: List of Block objects, or None if it failed or was cancelled
+        '''
+
+        response = self.get(node, '/get_chain', {'format': 'bin_stream'}, stream=True)
+        if response is None:
+            return None
+
+        blocks = []
+        try:
+            for block in codec.decode_chain_stream(response.iter_content(self.CHUNK_SIZE)):
+                if cancelled is not None and cancelled.is_set():
+                    return None
+                blocks.append(block)
+        except (requests.RequestException, ValueError):
+            return None
+        finally:
+            response.close()
+        return blocks
+
+    def get_headers(self, node, locator=None, from_height=0):
+        '''
+        Asks a peer for the block headers after the last block we have in
+        common (from the locator), or from a given height
+
+        :param locator: List of our block hashes, newest first (BlockChain.get_locator())
+        :return: (height of the first header, List of header dicts, peer's chain
+        length), the list is None if the request failed or the reply was malformed
+        '''
+
+        params = {'from_height': from_height}
+        if locator:
+            params['locator'] = ','.join(locator)
+
+        data = self.get_json(node, '/get_headers', params)
+        if not isinstance(data, dict):
+            return from_height, None, 0
+
+        start, headers, length = data.get('start'), data.get('headers'), data.get('length')
+        if not is_count(start) or not is_count(length) or (not locator and start != from_height) or \
+                not isinstance(headers, list) or not all(isinstance(header, dict) for header in headers):
+            return from_height, None, 0
+        return start, headers, length
+
+    def get_block(self, node, block_hash):
+        '''
+        :return: Block object with that hash from a peer, or None
+        '''
+
+        response = self.get(node, '/get_block/%s' % block_hash, {'format': 'bin'})
+        if response is None:
+            return None
+        try:
+            return codec.decode_block(response.content)
+        except ValueError:
+            return None
+
+    def get_blocks(self, node, block_hashes):
+        '''
+        Downloads several blocks from one peer at once
+
+        :return: List of Block objects in the same order as block_hashes,
+        or None if any of them couldn't be downloaded
+        '''
+
+        futures = [self.executor.submit(self.get_block, node, block_hash)
+                   for block_hash in block_hashes]
+        blocks = []
+        try:
+            for future in futures:
+                block = future.result(timeout=self.fetch_timeout)
+                if block is None:
+                    return None
+                blocks.append(block)
+        except (TimeoutError, CancelledError):
+            return None
+        finally:
+            for future in futures:
+                future.cancel()
+        return blocks
+
+    def find_longest_chain(self, nodes, min_length, is_valid):
+        '''
+        Finds the longest valid chain in the network that is longer than
+        min_length. Every peer is asked for its length at once, then the
+        chains of the peers claiming to be longer are downloaded at once.
+        They're checked longest claim first, and as soon as one is valid
+        the other downloads are cancelled.
+
+        :param nodes: iterable of peer netlocs
+        :param min_length: int, length of our own chain
+        :param is_valid: function that takes a List of Block objects
+        :return: (node, List of Block objects), or (None, None) if no peer
+        has a longer valid chain
+        '''
+
+        lengths = self.get_lengths(nodes)
+        candidates = sorted((node for node, length in lengths.items() if length > min_length),
+                            key=lambda node: lengths[node], reverse=True)
+        if not candidates:
+            return None, None
+
+        cancelled = threading.Event()
+        futures = {node: self.executor.submit(self.fetch_chain, node, cancelled)
+                   for node in candidates}
+
+        try:
+            for node in candidates:
+                try:
+                    chain = futures[node].result(timeout=self.fetch_timeout)
+                except (TimeoutError, CancelledError):
+                    continue
+
+                # A peer that claimed more blocks than it sent can't be trusted
+                if chain and len(chain) >= lengths[node] and is_valid(chain):
+                    return node, chain
+        finally:
+            cancelled.set()
+            for future in futures.values():
+                future.cancel()
+
+        return None, None
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
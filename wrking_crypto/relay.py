@@ -0,0 +1,422 @@
+'''
+Primary Purpose: Contains the TXRELAY class, which gossips pending
+transactions to the other nodes so every memlist on the network ends up
+with the same Tx, and the BLOCKRELAY class, which announces new blocks.
+
+Rather than sending every Tx to every peer, new Tx hashes are announced
+in batches (an inventory, POST /inv), each peer answers with the hashes
+it doesn't know yet, and only those Tx are sent (POST /rec_tx). A peer
+that accepts a Tx announces it to its own peers in turn.
+
+A bounded cache of every Tx hash added makes sure the same Tx is never
+validated or announced twice, however many peers announce it to us. Tx
+that are invalid in themselves are remembered by witness_hash() instead,
+which covers their signatures: tx_hash doesn't, so a copy with a bad
+signature must not stop the valid Tx from getting in.
+
+Blocks are sent as compact blocks (POST /cmpct_block): the header, the
+reward Tx, and a short id for every other Tx. A peer that has been
+getting our Tx already has them in its memlist, so it rebuilds the block
+from those and only asks for the ones it's missing (POST /block_txn).
+Most of the time a block costs its header plus 6 bytes a Tx.
+'''
+
+import copy
+import hashlib
+import threading
+import time
+
+from wrking_crypto import codec
+from wrking_crypto.blockchain import Block
+from wrking_crypto.cache import LRUCache
+from wrking_crypto.peers import is_count
+from wrking_crypto.transaction import Tx
+
+SHORT_ID_BYTES = 6
+
+
+def short_id(block_hash, tx_hash):
+    '''
+    :return: STRING, 12 hex char id of a Tx within a block. The hash is
+    keyed by the block hash, so Tx crafted to collide in one block won't
+    collide in any other
+    '''
+    return hashlib.blake2b(bytes.fromhex(tx_hash), digest_size=SHORT_ID_BYTES,
+                           key=bytes.fromhex(block_hash)).hexdigest()
+
+
+def witness_hash(tx):
+    '''
+    :return: STRING, hash of the Tx together with every input's public key
+    and signature, unlike tx_hash which leaves them out
+    '''
+    h = hashlib.sha256(tx.tx_hash.encode())
+    for inp in tx.unlock or []:
+        puk = inp.puk.encode('UTF-8') if isinstance(inp.puk, str) else inp.puk
+        h.update(puk)
+        h.update(bytes(inp.sig))
+    return h.hexdigest()
+
+
+def make_compact(block):
+    '''
+    :return: dict of the block's header, its reward Tx in full (no memlist
+    has those) and the short id of every other Tx, in block order
+    '''
+
+    block_hash = block.hash()
+    prefilled = []
+    short_ids = []
+    for i, tx in enumerate(block.transactions or []):
+        if tx.reward_coin:
+            prefilled.append({'index': i, 'tx': tx.json()})
+        else:
+            short_ids.append(short_id(block_hash, tx.tx_hash))
+
+    return {'header': block.header(), 'prefilled': prefilled, 'short_ids': short_ids}
+
+
+def mined_copy(tx):
+    '''
+    :return: copy of a pending Tx from the memlist with its sent_coins
+    turned into Output objects, like the Tx in a block, leaving the
+    memlist's own Tx as it was
+    '''
+    mined = copy.copy(tx)
+    mined.sent_coins = tx.make_outputs()
+    return mined
+
+
+class TxRelay():
+    '''
+    Announcing runs on its own thread, started by the first announce(), so
+    the request that added a Tx never waits on the peers.
+
+    Attributes
+    ----------
+    chain: BlockChain Object
+        Whose memlist Tx are added to and announced from, and whose nodes
+        are the peers
+
+    peers: PeerClient Object
+        Sends the announcements, the chain's own by default
+
+    seen: LRUCache
+        tx_hash -> True for the last seen_size Tx added or announced
+
+    rejected: LRUCache
+        witness_hash() -> True for the last seen_size Tx found invalid
+
+    requested: LRUCache
+        tx_hash -> time we last asked a peer for it, so several peers
+        announcing the same Tx at once only get it sent once
+
+    queue: List
+        Tx hashes waiting to be announced
+
+    interval: float
+        Most seconds a Tx hash waits in queue before it's announced
+
+    batch_size: int
+        Most Tx hashes in a single announcement, a full batch is sent
+        without waiting for interval
+    '''
+
+    SEEN_SIZE = 100000
+    BATCH_SIZE = 500
+    INTERVAL = 0.5
+    REQUEST_TIMEOUT = 10
+
+    def __init__(self, chain, peers=None, interval=None, batch_size=None, seen_size=None):
+        self.chain = chain
+        self.peers = peers or chain.peers
+        self.interval = interval or self.INTERVAL
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.seen = LRUCache(seen_size or self.SEEN_SIZE)
+        self.rejected = LRUCache(seen_size or self.SEEN_SIZE)
+        self.requested = LRUCache(seen_size or self.SEEN_SIZE)
+        self.queue = []
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def start(self):
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def announce(self, tx_hash):
+        '''
+        Queues a Tx in our memlist to be announced to every peer
+        '''
+
+        self.seen.put(tx_hash, True)
+        self.start()
+        with self.cond:
+            self.queue.append(tx_hash)
+            if len(self.queue) >= self.batch_size:
+                self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                if len(self.queue) < self.batch_size:
+                    self.cond.wait(self.interval)
+                batch = self.queue[:self.batch_size]
+                del self.queue[:self.batch_size]
+
+            if batch and self.chain.nodes:
+                self.flush(batch)
+
+    def flush(self, batch):
+        '''
+        Announces batch to every peer at once
+
+        :return: Dict of node -> number of Tx sent to it, None if it failed
+        '''
+        return self.peers.map(lambda node: self.send_inv(node, batch), list(self.chain.nodes))
+
+    def send_inv(self, node, tx_hashes):
+        '''
+        Announces tx_hashes to one peer, then sends it the Tx it asked for
+
+        :return: number of Tx sent, None if the peer didn't answer
+        '''
+
+        data = self.peers.post_json(node, '/inv', {'txs': tx_hashes})
+        if not data or not isinstance(data.get('wanted'), list):
+            return None
+
+        txs = [self.chain.memlist.get_tx(tx_hash) for tx_hash in data['wanted']]
+        txs = [tx.json() for tx in txs if tx is not None]
+        if txs:
+            self.peers.post_json(node, '/rec_tx', {'txs': txs})
+        return len(txs)
+
+    def wanted(self, tx_hashes):
+        '''
+        Answers an announcement from a peer
+
+        :param tx_hashes: List of Tx hashes it has
+        :return: List of the ones we haven't seen and haven't asked another
+        peer for within REQUEST_TIMEOUT seconds
+        '''
+
+        now = time.monotonic()
+        wanted = []
+        for tx_hash in tx_hashes:
+            if tx_hash in self.seen or tx_hash in self.chain.memlist:
+                continue
+            asked = self.requested.get(tx_hash)
+            if asked is not None and now - asked < self.REQUEST_TIMEOUT:
+                continue
+            self.requested.put(tx_hash, now)
+            wanted.append(tx_hash)
+        return wanted
+
+    def receive(self, tx_dicts):
+        '''
+        Adds Tx sent by a peer or a wallet to our memlist, announcing the
+        ones that were added. Tx already added are skipped without being
+        checked again, and so are ones found invalid before with the very
+        same signatures. A Tx only rejected because of our state, i.e. it
+        spends a coin we don't know of yet or one a pending Tx spends, may
+        be added when it comes again.
+
+        :param tx_dicts: List of dicts made by Tx.json()
+        :return: (List of the hashes added, List of the hashes rejected)
+        '''
+
+        added = []
+        rejected = []
+        for data in tx_dicts:
+            if not isinstance(data, dict) or data.get('tx_hash') in self.seen:
+                continue
+
+            try:
+                tx = Tx.from_json(data, mined=False)
+            except (KeyError, TypeError, ValueError):
+                rejected.append(data.get('tx_hash'))
+                continue
+
+            witness = witness_hash(tx)
+            if witness in self.rejected:
+                continue
+
+            self.requested.pop(tx.tx_hash)
+            if tx.reward_coin or not tx.check_is_valid():
+                # Invalid whatever our chain and memlist hold
+                self.rejected.put(witness, True)
+                rejected.append(tx.tx_hash)
+            elif self.chain.add_transation(tx):
+                self.announce(tx.tx_hash)
+                added.append(tx.tx_hash)
+            else:
+                rejected.append(tx.tx_hash)
+        return added, rejected
+
+
+class BlockRelay():
+    '''
+    Announces new blocks to every peer as compact blocks, and rebuilds the
+    compact blocks peers send us.
+
+    A block whose parent we don't have is left for the next sync(), we
+    don't know where the peer that sent it is listening.
+
+    Attributes
+    ----------
+    chain: BlockChain Object
+        Whose blocks are announced and whose memlist blocks are rebuilt from
+
+    peers: PeerClient Object
+        Sends the announcements, the chain's own by default
+
+    partial: LRUCache
+        block hash -> (header, List of Tx objects with None for the ones
+        missing) for compact blocks waiting on a /block_txn
+    '''
+
+    PARTIAL_SIZE = 100
+
+    def __init__(self, chain, peers=None):
+        self.chain = chain
+        self.peers = peers or chain.peers
+        self.partial = LRUCache(self.PARTIAL_SIZE)
+
+    def announce(self, block):
+        '''
+        Sends block to every peer on its own thread, so mining the next one
+        doesn't wait on them
+        '''
+        if self.chain.nodes:
+            threading.Thread(target=self.flush, args=(block,), daemon=True).start()
+
+    def flush(self, block):
+        '''
+        :return: Dict of node -> status it answered with, None if it failed
+        '''
+        compact = make_compact(block)
+        return self.peers.map(lambda node: self.send_compact(node, block, compact), list(self.chain.nodes))
+
+    def send_compact(self, node, block, compact):
+        '''
+        Sends one peer the compact block, then whatever Tx it says it's
+        missing, or the whole block if it couldn't rebuild it
+
+        :return: STRING status the peer answered with, None if it didn't
+        '''
+
+        data = self.peers.post_json(node, '/cmpct_block', compact)
+        if data and data.get('status') == 'missing':
+            transactions = block.transactions or []
+            missing = [i for i in data.get('missing', []) if isinstance(i, int) and 0 <= i < len(transactions)]
+            data = self.peers.post_json(node, '/block_txn',
+                                        {'hash': block.hash(), 'txs': [transactions[i].json() for i in missing]})
+
+        if data and data.get('status') == 'need_block':
+            data = self.peers.post_bytes(node, '/add_block', codec.encode_block(block))
+        return data.get('status') if data else None
+
+    def mempool_index(self, block_hash):
+        '''
+        :return: Dict of short id -> Tx object for every Tx in our memlist,
+        None for short ids more than one Tx has
+        '''
+
+        index = {}
+        for tx in self.chain.memlist.txs():
+            sid = short_id(block_hash, tx.tx_hash)
+            index[sid] = None if sid in index else tx
+        return index
+
+    def receive_compact(self, data):
+        '''
+        Rebuilds a compact block from our memlist
+
+        :param data: dict made by make_compact()
+        :return: dict with a 'status' of added/known/orphan/rejected, or
+        missing with the 'missing' Tx indexes to send to /block_txn
+        :raise ValueError: if data is malformed or its header doesn't have
+        the proof of work it claims
+        '''
+
+        header = data['header']
+        block_hash = header['hash']
+        if Block.hash_header(header) != block_hash or int(block_hash, 16) > int(header['target'], 16):
+            raise ValueError('Header does not hash to %s under its target' % block_hash)
+        if self.chain.has_block(block_hash):
+            return {'status': 'known'}
+
+        short_ids = data['short_ids']
+        txs = [None] * (len(data['prefilled']) + len(short_ids))
+        for entry in data['prefilled']:
+            index = entry['index']
+            if not is_count(index) or index >= len(txs):
+                raise ValueError('Prefilled Tx index %s is not in the block' % (index,))
+            if txs[index] is not None:
+                raise ValueError('Tx %s is prefilled twice' % index)
+            txs[index] = Tx.from_json(entry['tx'])
+
+        index = self.mempool_index(block_hash)
+        empty = [i for i, tx in enumerate(txs) if tx is None]
+        for i, sid in zip(empty, short_ids):
+            tx = index.get(sid)
+            txs[i] = mined_copy(tx) if tx is not None else None
+
+        missing = [i for i, tx in enumerate(txs) if tx is None]
+        if missing:
+            self.partial.put(block_hash, (header, txs))
+            return {'status': 'missing', 'missing': missing}
+        return self.finish(header, txs)
+
+    def receive_block_txn(self, data):
+        '''
+        Fills in the Tx a compact block was missing
+
+        :param data: dict of the block 'hash' and the missing 'txs' (Tx.json()
+        dicts) in the order receive_compact() asked for them
+        :return: dict with a 'status' like receive_compact(), need_block if
+        we don't have that compact block anymore
+        '''
+
+        entry = self.partial.pop(data['hash'])
+        if entry is None:
+            return {'status': 'need_block'}
+
+        header, txs = entry
+        missing = [i for i, tx in enumerate(txs) if tx is None]
+        if len(data['txs']) != len(missing):
+            return {'status': 'need_block'}
+        for i, tx in zip(missing, data['txs']):
+            txs[i] = Tx.from_json(tx)
+        return self.finish(header, txs)
+
+    def finish(self, header, txs):
+        '''
+        Puts the rebuilt block together, if it doesn't hash to its header
+        (i.e. two Tx shared a short id) the sender has to send all of it
+        '''
+
+        block = Block(header['index'], header['previous_hash'], txs, int(header['target'], 16))
+        block.time_stamp = header['time_stamp']
+        block.nonce = header['nonce']
+        if block.hash() != header['hash']:
+            return {'status': 'need_block'}
+        return self.receive_block(block)
+
+    def receive_block(self, block):
+        '''
+        Adds a block from a peer, announcing it onwards if it was new
+
+        :return: dict with a 'status' of added/known/orphan/rejected
+        '''
+
+        if self.chain.add_block(block):
+            self.announce(block)
+            return {'status': 'added'}
+        if self.chain.has_block(block.hash()):
+            return {'status': 'known'}
+        if not self.chain.has_block(block.previous_hash):
+            return {'status': 'orphan'}
+        return {'status': 'rejected'}
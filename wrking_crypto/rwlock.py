@@ -0,0 +1,111 @@
+'''
+Primary Purpose: Contains the RWLOCK class, a readers-writer lock so the
+request threads of a node can read the chain at the same time, and only
+changing the chain needs them all out of the way.
+'''
+
+import contextlib
+import threading
+
+
+class RWLock():
+    '''
+    Any number of threads can hold the lock for reading at once, or a single
+    thread can hold it for writing. Once a writer is waiting, new readers
+    wait behind it so a steady stream of reads can't starve writes.
+
+    Both are reentrant, and the thread holding it for writing can also take
+    it for reading (i.e. a method that changes the chain calling one that
+    reads it). A reader can NOT upgrade to writing, that raises RuntimeError
+    rather than deadlocking.
+
+    Attributes
+    ----------
+    readers: int
+        Number of threads holding the lock for reading
+
+    writer: int
+        Thread ident of the writer, None if there isn't one
+
+    write_depth: int
+        How many times the writer has taken the lock
+
+    waiting_writers: int
+        Number of threads waiting to write
+    '''
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = None
+        self.write_depth = 0
+        self.waiting_writers = 0
+        self.local = threading.local()
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        depth = getattr(self.local, 'read_depth', 0)
+        if depth or self.writer == me:
+            # Already covered by a read or write this thread holds
+            if not depth:
+                self.local.registered = False
+            self.local.read_depth = depth + 1
+            return
+
+        with self.cond:
+            while self.writer is not None or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+        self.local.read_depth = 1
+        self.local.registered = True
+
+    def release_read(self):
+        self.local.read_depth -= 1
+        if self.local.read_depth or not self.local.registered:
+            return
+
+        with self.cond:
+            self.readers -= 1
+            if self.readers == 0:
+                self.cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        if self.writer == me:
+            self.write_depth += 1
+            return
+        if getattr(self.local, 'read_depth', 0):
+            raise RuntimeError('Can not take a write lock while holding a read lock')
+
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writer is not None or self.readers:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writer = me
+            self.write_depth = 1
+
+    def release_write(self):
+        self.write_depth -= 1
+        if self.write_depth:
+            return
+
+        with self.cond:
+            self.writer = None
+            self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
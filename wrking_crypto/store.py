@@ -0,0 +1,268 @@
+'''
+Primary Purpose: Contains the BLOCKSTORE and STOREDCHAIN classes for
+keeping the block chain on disk between restarts.
+
+Blocks are appended to segment files (blk00000.dat, blk00001.dat, ...) as
+a 4 byte length followed by the serialized block. index.dat holds one
+fixed size record per block, in height order:
+
+    block hash (32 bytes) | segment number (4) | offset (8) | length (4)
+
+so opening the store only reads the index, and any block can be read back
+with a single seek.
+'''
+
+import json
+import os
+import struct
+
+from wrking_crypto.cache import LRUCache
+
+INDEX_RECORD = struct.Struct('>32sIQI')
+LENGTH_PREFIX = struct.Struct('>I')
+
+
+class BlockStore():
+    '''
+    Append only store of serialized blocks, indexed by height and by hash.
+
+    Attributes
+    ----------
+    directory: STRING
+        Folder holding the segment files, index.dat and any saved state
+
+    segment_size: int
+        Once a segment file reaches this many bytes, new blocks go in the next one
+
+    positions: List
+        (segment, offset, length) of every block, the list index is its height
+
+    heights: Dict
+        block hash STRING -> height
+    '''
+
+    SEGMENT_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, directory, segment_size=None):
+        self.directory = directory
+        self.segment_size = segment_size or self.SEGMENT_SIZE
+        self.positions = []
+        self.heights = {}
+        self.hashes = []
+
+        os.makedirs(directory, exist_ok=True)
+        self.load_index()
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, 'blk%05d.dat' % segment)
+
+    def index_path(self):
+        return os.path.join(self.directory, 'index.dat')
+
+    def load_index(self):
+        '''
+        Reads index.dat, dropping a partly written last record and any
+        record pointing past the end of its segment (i.e. after a crash
+        in the middle of append())
+        '''
+
+        path = self.index_path()
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        segment_sizes = {}
+        valid = 0
+        for start in range(0, len(data) - INDEX_RECORD.size + 1, INDEX_RECORD.size):
+            raw_hash, segment, offset, length = INDEX_RECORD.unpack_from(data, start)
+            if segment not in segment_sizes:
+                seg_path = self.segment_path(segment)
+                segment_sizes[segment] = os.path.getsize(seg_path) if os.path.exists(seg_path) else 0
+            if offset + LENGTH_PREFIX.size + length > segment_sizes[segment]:
+                break
+
+            block_hash = raw_hash.hex()
+            self.heights[block_hash] = len(self.positions)
+            self.hashes.append(block_hash)
+            self.positions.append((segment, offset, length))
+            valid = start + INDEX_RECORD.size
+
+        if valid != len(data):
+            with open(path, 'r+b') as f:
+                f.truncate(valid)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def append(self, block_hash, data):
+        '''
+        Writes a serialized block to the end of the current segment and
+        records it in the index
+
+        :param block_hash: STRING hex of the block's hash
+        :param data: BYTE ARRAY of the serialized block
+        :return: height the block was stored at
+        '''
+
+        segment, offset = 0, 0
+        if self.positions:
+            segment, last_offset, last_length = self.positions[-1]
+            offset = last_offset + LENGTH_PREFIX.size + last_length
+            if offset >= self.segment_size:
+                segment, offset = segment + 1, 0
+
+        with open(self.segment_path(segment), 'ab') as f:
+            f.seek(offset)
+            f.truncate(offset)
+            f.write(LENGTH_PREFIX.pack(len(data)))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with open(self.index_path(), 'ab') as f:
+            f.write(INDEX_RECORD.pack(bytes.fromhex(block_hash), segment, offset, len(data)))
+
+        self.heights[block_hash] = len(self.positions)
+        self.hashes.append(block_hash)
+        self.positions.append((segment, offset, len(data)))
+        return len(self.positions) - 1
+
+    def read(self, height):
+        '''
+        :return: BYTE ARRAY of the serialized block at that height
+        '''
+
+        segment, offset, length = self.positions[height]
+        with open(self.segment_path(segment), 'rb') as f:
+            f.seek(offset + LENGTH_PREFIX.size)
+            return f.read(length)
+
+    def get_hash(self, height):
+        return self.hashes[height]
+
+    def height_of(self, block_hash):
+        '''
+        :return: height of the block with that hash, or None if it isn't stored
+        '''
+        return self.heights.get(block_hash)
+
+    def truncate(self, height):
+        '''
+        Drops every block at or above height, i.e. to replace the end of
+        the chain with another node's blocks
+        '''
+
+        if height >= len(self.positions):
+            return
+
+        for block_hash in self.hashes[height:]:
+            del self.heights[block_hash]
+        del self.hashes[height:]
+        del self.positions[height:]
+
+        with open(self.index_path(), 'r+b') as f:
+            f.truncate(height * INDEX_RECORD.size)
+
+    def state_path(self, name):
+        return os.path.join(self.directory, '%s.json' % name)
+
+    def save_state(self, name, state):
+        '''
+        Atomically writes a JSON-able dict next to the blocks, i.e. a
+        snapshot of the UTXO index so it doesn't have to be rebuilt at startup
+        '''
+
+        path = self.state_path(name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    def load_state(self, name):
+        '''
+        :return: dict saved by save_state(), or None if there isn't one
+        '''
+
+        path = self.state_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+
+class StoredChain():
+    '''
+    List-like view of a BlockStore, so BlockChain.chain can be backed by
+    disk. Blocks are decoded when they're asked for, and only the most
+    recently used ones are kept in memory.
+
+    Attributes
+    ----------
+    store: BlockStore
+        Where the blocks actually live
+
+    encode: function
+        Block object -> BYTE ARRAY
+
+    decode: function
+        BYTE ARRAY -> Block object
+
+    blocks: LRUCache
+        height -> decoded Block object
+    '''
+
+    def __init__(self, store, encode, decode, cache_size=256):
+        self.store = store
+        self.encode = encode
+        self.decode = decode
+        self.blocks = LRUCache(cache_size)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self[i] for i in range(*height.indices(len(self)))]
+
+        if height < 0:
+            height += len(self)
+        if not 0 <= height < len(self):
+            raise IndexError('chain index out of range')
+
+        block = self.blocks.get(height)
+        if block is None:
+            block = self.decode(self.store.read(height))
+            self.blocks.put(height, block)
+        return block
+
+    def __setitem__(self, key, blocks):
+        '''
+        Only supports replacing the end of the chain, i.e. chain[n:] = blocks
+        (or chain[:] = blocks), which is all replace_chain needs
+        '''
+
+        if not isinstance(key, slice) or key.step not in (None, 1) or key.stop is not None:
+            raise TypeError('StoredChain only supports chain[n:] = blocks')
+
+        start = key.indices(len(self))[0]
+        blocks = list(blocks)
+        self.truncate(start)
+        for block in blocks:
+            self.append(block)
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
+
+    def append(self, block):
+        height = self.store.append(block.hash(), self.encode(block))
+        self.blocks.put(height, block)
+
+    def truncate(self, height):
+        for i in range(height, len(self)):
+            self.blocks.pop(i)
+        self.store.truncate(height)
+
+    def height_of(self, block_hash):
+        return self.store.height_of(block_hash)
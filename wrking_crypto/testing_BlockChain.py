@@ -1,6 +1,6 @@
 from wrking_crypto.blockchain import BlockChain
 from wrking_crypto.user import User
-from wrking_crypto.coin import Input,Output
+from wrking_crypto.coin import Input
 from wrking_crypto.transaction import Tx
 from pprint import pprint
 
@@ -13,17 +13,14 @@ if __name__ == '__main__':
     lily = User()
 
     isaac_wal_b = me.wal
-    target_coin = chain.chain[0].transactions[0].sent_coins[0]
-    utxos = [Output(target_coin.lock, target_coin.amount)]
-    unlocks = []
+    utxos = chain.utxos.get_wallet_coins(me.wal)
+    to = [(lily.wal, 30), (me.wal, 2)]
+    tx = Tx([], utxos, to)
 
     for utx in utxos:
-        sig = me.sign(utx.coin_hash)
+        sig = me.sign(tx.signature_message(utx.coin_hash))
         unlock = Input(utx.coin_hash, me.puk.export_key('PEM'), sig)
-        unlocks.append(unlock)
-
-    to = [(lily.wal, 30), (me.wal, 2)]
-    tx = Tx(unlocks, utxos, to)
+        tx.unlock.append(unlock)
 
     chain.add_transation(tx)
     chain.create_block()
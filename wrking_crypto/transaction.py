@@ -7,10 +7,11 @@ class for handling Verified and Unverified transactions.
 
 from wrking_crypto.user import User
 from wrking_crypto.coin import Input, Output
-from Crypto.Hash import RIPEMD160
+from Crypto.Hash import RIPEMD160, SHA256
 from Crypto.PublicKey import RSA
 from pprint import pprint
 import base64
+import json
 
 
     # HOW VERIFICATION WORKS
@@ -47,13 +48,22 @@ class Tx():
         if a coin is a reward coin, it doesn't need to be checked for the stuff
         that normal transactions have to be
 
+    height: int
+        For a reward coin, the index of the block paying it out. Keeps two
+        rewards of the same amount to the same wallet from sharing a tx_hash
+
+    tx_hash: STRING
+        RIPEMD160 Hash of the SHA256 Hash of serialize(), the coins spent and
+        the (Address, Amount) pairs created, so any node can recompute it
+
     NOTE: once a coin is added to the block chain, its 'Sent Coins' data field become
     Output objects rather than just tupples saying who we're sending the coin to
     '''
 
-    def __init__(self, unlocking_scripts, owned_coins, sent_coins, reward_coin = False):
+    def __init__(self, unlocking_scripts, owned_coins, sent_coins, reward_coin = False, height = None):
 
         self.reward_coin = reward_coin
+        self.height = height
         self.unlock = unlocking_scripts
         self.owned_coins = owned_coins
         self.sent_coins = sent_coins
@@ -69,7 +79,6 @@ class Tx():
 
             self.fee = input_amt - output_amt
 
-        #TODO Change this hashing scheme
         self.tx_hash = self.hash()
 
 
@@ -105,21 +114,39 @@ class Tx():
             if not isinstance(send, tuple) or (len(send) != 2):
                 return False
 
-        # Check that all Unlocking Scripts can unlock each of the 'owned coins'
+        return self.check_unlocks()
+
+    def check_unlocks(self):
+        '''
+        Checks that all Unlocking Scripts can unlock each of the 'owned coins',
+        the part of check_is_valid() that still applies once the Tx is mined
+        and its sent_coins have become Output objects
+
+        :return: True if every owned coin is unlocked
+        '''
+
+        if len(self.unlock) != len(self.owned_coins):
+            return False
+
         all_unlockable = True
         for i in range(0, len(self.unlock)):
-            all_unlockable = all_unlockable and Tx.check_Owner(self.unlock[i], self.owned_coins[i])
+            message = None
+            if isinstance(self.unlock[i], Input):
+                message = self.signature_message(self.unlock[i].coin_hash)
+            all_unlockable = all_unlockable and Tx.check_Owner(self.unlock[i], self.owned_coins[i], message)
             if not all_unlockable:
                 return False
 
         return True
 
-    def check_Owner(input, output):
+    def check_Owner(input, output, message):
         '''
         A helper method to ensure that a specific input does unlock a specific output
 
         :param input: Input Object being checked
         :param output:  Output Object being checked
+        :param message: STRING the input's signature has to be of, the
+        spending Tx's signature_message() for the coin
         :return: False if it fails any of the tests, else return True
         '''
 
@@ -136,12 +163,24 @@ class Tx():
             print("Incorrect PubKey for that Wallet")
             return False
 
-        if not User.verify_signature(input.puk, input.coin_hash, input.sig):
+        if not User.verify_signature(input.puk, message, input.sig):
             print("Identity cannot be verified")
             return False
 
         return True
 
+    def signature_message(self, coin_hash):
+        '''
+        What the owner of a coin signs to spend it in this Tx: the tx_hash,
+        which covers every coin spent and every (Address, Amount) created,
+        then the coin's hash. The signature can't be put on a Tx that sends
+        the coin anywhere else.
+
+        :param coin_hash: STRING hash of one of the owned_coins
+        :return: STRING message to sign
+        '''
+        return self.tx_hash + coin_hash
+
     def create_new_coins(self):
         '''
         Primary function of the Tx Class, calling this method will generate
@@ -157,18 +196,49 @@ class Tx():
             if not self.check_is_valid():
                 return False
 
+        self.sent_coins = self.make_outputs()
+        return self.sent_coins
+
+    def make_outputs(self):
+        '''
+        :return: list of Output objects for self.sent_coins, each with the
+        outpoint (self.tx_hash, position in sent_coins)
+        '''
         output_coin_list = []
 
-        for new_coin in self.sent_coins:
-            coin = Output(new_coin[0], new_coin[1])
+        for i, new_coin in enumerate(self.sent_coins):
+            lock, amount = Tx.coin_values(new_coin)
+            coin = Output(lock, amount, (self.tx_hash, i))
             output_coin_list.append(coin)
 
-        self.sent_coins = output_coin_list
         return output_coin_list
 
+    def coin_values(coin):
+        '''
+        Class method, (Address, Amount) of a sent coin, whether it is still
+        a tuple or has already become an Output object
+        '''
+        if isinstance(coin, Output):
+            return coin.lock, coin.amount
+        return coin[0], coin[1]
+
+    def serialize(self):
+        '''
+        :return: BYTE ARRAY, canonical encoding of the coin hashes this Tx
+        spends and the (Address, Amount) pairs it creates. Signatures are
+        left out, they prove the spend is allowed but aren't what it does.
+        '''
+        spent = []
+        if self.owned_coins:
+            spent = [coin.coin_hash for coin in self.owned_coins]
+
+        sent = [list(Tx.coin_values(coin)) for coin in self.sent_coins]
+
+        return json.dumps([bool(self.reward_coin), self.height, spent, sent],
+                          separators=(',', ':')).encode()
+
     def hash(self):
-        temp_hash = hash(self)
-        return RIPEMD160.new(temp_hash.to_bytes(((temp_hash.bit_length() + 7) // 8), byteorder='big')).hexdigest()
+        return RIPEMD160.new(SHA256.new(self.serialize()).digest()).hexdigest()
 
     def dict(self):
 
@@ -208,7 +278,12 @@ class Tx():
                 loc_dict = loc.json()
                 locks.append(loc_dict)
 
-        for new in self.sent_coins:
+        # A pending Tx still has (Address, Amount) tuples, show the coins it would make
+        sent_coins = self.sent_coins
+        if any(not isinstance(new, Output) for new in sent_coins):
+            sent_coins = self.make_outputs()
+
+        for new in sent_coins:
             new_dict = new.dict()
             new_coin.append(new_dict)
 
@@ -216,9 +291,48 @@ class Tx():
             'unlock': unlocks,
             'owned_coins': locks,
             'sent_coins': new_coin,
-            'reward_coin': self.reward_coin
+            'reward_coin': self.reward_coin,
+            'height': self.height,
+            'tx_hash': self.tx_hash
         }
 
+    @staticmethod
+    def from_json(data, mined=True):
+        '''
+        Rebuilds a Tx object from the dict made by json(), i.e. one
+        received from another node's /get_chain or relayed to /rec_tx. The
+        tx_hash and every coin_hash are recomputed from the contents rather
+        than trusted.
+
+        :param data: dict with the unlock, owned_coins, sent_coins and reward_coin keys
+        :param mined: if False the Tx is pending, its sent_coins stay
+        (Address, Amount) tuples so it can go through MemList.add_tx()
+        :return: Tx object whose sent_coins are already Output objects if mined
+        :raise ValueError: if a hash in data doesn't match what it hashes to
+        '''
+
+        reward_coin = data.get('reward_coin', False)
+        unlocks = [Input.from_json(unl) for unl in data['unlock']]
+        owned = [Output.from_json(loc) for loc in data['owned_coins']]
+        sent = [(new['lock'], new['amount']) for new in data['sent_coins']]
+
+        if reward_coin:
+            tx = Tx(None, None, sent, True, data.get('height'))
+        else:
+            tx = Tx(unlocks, owned, sent)
+
+        if data.get('tx_hash') is not None and data['tx_hash'] != tx.tx_hash:
+            raise ValueError('tx_hash %s does not match the transaction' % data['tx_hash'])
+
+        outputs = tx.make_outputs()
+        for new, coin in zip(data['sent_coins'], outputs):
+            if new.get('coin_hash') is not None and new['coin_hash'] != coin.coin_hash:
+                raise ValueError('coin_hash %s does not match the coin' % new['coin_hash'])
+
+        if mined:
+            tx.sent_coins = outputs
+        return tx
+
 
 
 if __name__ == '__main__':
@@ -227,15 +341,13 @@ if __name__ == '__main__':
     lily = User()
 
     utxos = [Output(isaac.wal, 10), Output(isaac.wal, 20), Output(isaac.wal, 5)]
-    unlocks = []
+    to = [(lily.wal, 30), (isaac.wal, 2)]
+    tx = Tx([], utxos, to)
 
     for utx in utxos:
-        sig = isaac.sign(utx.coin_hash)
+        sig = isaac.sign(tx.signature_message(utx.coin_hash))
         unlock = Input(utx.coin_hash, isaac.puk.export_key('PEM').decode('UTF-8'), sig)
-        unlocks.append(unlock)
-
-    to = [(lily.wal, 30), (isaac.wal, 2)]
-    tx = Tx(unlocks, utxos, to)
+        tx.unlock.append(unlock)
 
     pprint(tx.dict())
     print(tx.create_new_coins())
@@ -2,6 +2,7 @@
 from Crypto.Hash import SHA256, RIPEMD160
 from Crypto.PublicKey import RSA
 from Crypto.Signature import pss
+from wrking_crypto.cache import LRUCache
 
 class User():
 
@@ -22,8 +23,21 @@ class User():
         wal: STRING Object
             Represents this user's wallet...
             Got by RIPEMD160 Hashing the SHA256 hash of their public key
+
+        Shared by every User (class attributes):
+
+        key_cache: LRUCache
+            PEM bytes -> parsed RSA Public Key object, so a key that signs
+            many coins is only imported once
+
+        verified_cache: LRUCache
+            (coin hash, PEM bytes, signature bytes) -> result of
+            verify_signature(), so each signature is only checked once
     '''
 
+    key_cache = LRUCache(1024)
+    verified_cache = LRUCache(100000)
+
     def __init__(self, prk):
         self.prk = prk
         self.puk = prk.publickey()
@@ -51,6 +65,18 @@ class User():
         signature = pss.new(self.prk).sign(hash_msg)
         return signature
 
+    def sign_batch(self, messages):
+        '''
+        Signs every message in one go, the same as calling sign() on each
+        but setting up the pss signer only once
+
+        :param messages: List of STRING messages, i.e. Tx.signature_message()
+        :return: List of BYTE ARRAY signatures, in the same order
+        '''
+
+        signer = pss.new(self.prk)
+        return [signer.sign(SHA256.new(message.encode())) for message in messages]
+
     def get_wallet_from_puk(input_RSA_puk):
         '''
         Class method, returns the Wallet object from the corresponding
@@ -69,18 +95,51 @@ class User():
         :param puk: STRING representing a Public Key object
         :param h: STRING of the ORIGINAL HASH that was SHA256
         hashed to create the signature
-        :param signature:
-        :return:
+        :param signature: BYTE ARRAY of the signature being checked
+        :return: True if the signature is valid, results are cached in
+        User.verified_cache so repeat checks are a dict lookup
+        '''
+        if isinstance(puk, str):
+            puk = puk.encode('UTF-8')
+
+        cache_key = (h, puk, bytes(signature))
+        result = User.verified_cache.get(cache_key)
+        if result is not None:
+            return result
+
+        result = User.check_signature(User.import_puk(puk), h, signature)
+        User.verified_cache.put(cache_key, result)
+        return result
+
+    def check_signature(puk_obj, h, signature):
+        '''
+        Class method, the uncached RSA-PSS check behind verify_signature()
+
+        :param puk_obj: RSA Public Key object (already imported)
+        :return: True if the signature is valid
         '''
         h = SHA256.new(h.encode())
-        puk = RSA.import_key(puk)
-        verifier = pss.new(puk)
+        verifier = pss.new(puk_obj)
         try:
             verifier.verify(h, signature)
             return True
         except (ValueError, TypeError):
             return False
 
+    def import_puk(puk):
+        '''
+        Class method, parses a PEM public key, reusing the object from
+        User.key_cache if this key was already seen
+
+        :param puk: BYTE ARRAY of the PEM encoded public key
+        :return: RSA Public Key object
+        '''
+        puk_obj = User.key_cache.get(puk)
+        if puk_obj is None:
+            puk_obj = RSA.import_key(puk)
+            User.key_cache.put(puk, puk_obj)
+        return puk_obj
+
     def __str__(self):
         return '%s\n%s\n%s' % ( self.prk.export_key('PEM').decode('UTF-8') , self.puk.export_key('PEM').decode('UTF-8') , self.wal.hexdigest())
 
@@ -0,0 +1,410 @@
+'''
+Primary Purpose: Contains the UTXOSET class, a persistent index of every
+coin the block chain has created or spent, keyed by coin_hash.
+
+Keeping this index up to date as blocks are added means a double spend
+check or a balance lookup only has to touch the coins involved, rather
+than walking every block/transaction/input in the chain.
+
+It also indexes every wallet's unspent coins and transaction history, so
+listing them costs the number of results rather than the size of the chain.
+
+The UTXOVIEW class checks the transactions of a branch's blocks against
+the coins unspent on that branch, on top of a UTXOSet it leaves as it is.
+'''
+
+import itertools
+
+
+from wrking_crypto.coin import Output
+
+
+class UTXOSet():
+    '''
+    Represents the set of Unspent Transaction Outputs (and the coins that
+    have already been spent) for a chain of blocks.
+
+    Attributes
+    ----------
+    unspent: Dict
+        coin_hash -> Output object for every coin that is currently spendable
+
+    spent: Set
+        coin_hash of every coin that has been used as an input in the chain
+
+    balances: Dict
+        Wallet STRING -> total amount of that wallet's unspent coins
+
+    wallet_coins: Dict
+        Wallet STRING -> Dict of coin_hash -> Output object for each of that
+        wallet's unspent coins, in the order they became unspent (a coin a
+        reorg un-spends goes to the end)
+
+    history: Dict
+        Wallet STRING -> List of (height, tx_hash, received, sent) for every
+        mined Tx that paid or spent from that wallet, oldest first
+    '''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.unspent = {}
+        self.spent = set()
+        self.balances = {}
+        self.wallet_coins = {}
+        self.history = {}
+
+    def apply_block(self, block):
+        '''
+        Updates the index with every transaction in a newly added block.
+
+        :param block: Block object that was just appended to the chain
+        :return: UndoRecord that undo_block() takes to reverse this
+        '''
+
+        undo = UndoRecord()
+        if block.transactions:
+            for tx in block.transactions:
+                self.apply_tx(tx, undo)
+                self.add_history(tx, block.index, undo)
+        return undo
+
+    def apply_tx(self, tx, undo=None):
+        '''
+        Marks every coin the Tx unlocks as spent, and adds every coin it
+        creates to the unspent set.
+
+        :param tx: Tx object that has already had create_new_coins() called
+        :param undo: optional UndoRecord to note the changes in
+        '''
+
+        if tx.owned_coins:
+            for coin in tx.owned_coins:
+                self.spend(coin.coin_hash, undo)
+
+        for coin in tx.sent_coins:
+            if isinstance(coin, Output):
+                self.add(coin, undo)
+
+    def add_history(self, tx, height, undo=None):
+        '''
+        Adds the Tx to the history of every wallet it paid or spent from
+
+        :param tx: Tx object that was just applied
+        :param height: index of the block the Tx is in
+        '''
+
+        changes = {}
+        for coin in tx.owned_coins or []:
+            changes.setdefault(coin.lock, [0, 0])[1] += coin.amount
+        for coin in tx.sent_coins:
+            if isinstance(coin, Output):
+                changes.setdefault(coin.lock, [0, 0])[0] += coin.amount
+
+        for wallet, (received, sent) in changes.items():
+            self.history.setdefault(wallet, []).append((height, tx.tx_hash, received, sent))
+            if undo is not None:
+                undo.history.append(wallet)
+
+    def undo_block(self, undo):
+        '''
+        Reverses apply_block(), i.e. when the block is taken off the end
+        of the chain in a reorg. Only touches the coins in that block.
+
+        :param undo: UndoRecord returned by apply_block() for the block
+        '''
+
+        for wallet in reversed(undo.history):
+            entries = self.history[wallet]
+            entries.pop()
+            if not entries:
+                del self.history[wallet]
+
+        for coin_hash in reversed(undo.added):
+            coin = self.unspent.pop(coin_hash, None)
+            if coin is not None:
+                self.untrack(coin)
+
+        for coin_hash, coin in reversed(undo.spent):
+            self.spent.discard(coin_hash)
+            if coin is not None:
+                self.unspent[coin_hash] = coin
+                self.track(coin)
+
+    def add(self, coin, undo=None):
+        '''
+        Adds a single Output object to the unspent set
+        '''
+
+        if coin.coin_hash in self.unspent or coin.coin_hash in self.spent:
+            return
+
+        self.unspent[coin.coin_hash] = coin
+        self.track(coin)
+        if undo is not None:
+            undo.added.append(coin.coin_hash)
+
+    def spend(self, coin_hash, undo=None):
+        '''
+        Moves a coin out of the unspent set and into the spent set
+        '''
+
+        if coin_hash in self.spent:
+            return
+
+        self.spent.add(coin_hash)
+        coin = self.unspent.pop(coin_hash, None)
+        if coin is not None:
+            self.untrack(coin)
+        if undo is not None:
+            undo.spent.append((coin_hash, coin))
+
+    def track(self, coin):
+        '''
+        Adds an unspent coin to its wallet's balance and coin index
+        '''
+        self.change_balance(coin.lock, coin.amount)
+        self.wallet_coins.setdefault(coin.lock, {})[coin.coin_hash] = coin
+
+    def untrack(self, coin):
+        '''
+        Takes a coin that's no longer unspent out of its wallet's balance and coin index
+        '''
+        self.change_balance(coin.lock, -coin.amount)
+        coins = self.wallet_coins.get(coin.lock)
+        if coins is not None:
+            coins.pop(coin.coin_hash, None)
+            if not coins:
+                del self.wallet_coins[coin.lock]
+
+    def change_balance(self, wallet, amount):
+        balance = self.balances.get(wallet, 0) + amount
+        if balance == 0:
+            self.balances.pop(wallet, None)
+        else:
+            self.balances[wallet] = balance
+
+    def rebuild(self, chain):
+        '''
+        Throws away the current index and recreates it from scratch, used
+        when the whole chain is replaced by one from another node.
+
+        :param chain: List of Block objects
+        '''
+
+        self.clear()
+        for block in chain:
+            self.apply_block(block)
+
+    def is_spent(self, coin_hash):
+        return coin_hash in self.spent
+
+    def is_unspent(self, coin_hash):
+        return coin_hash in self.unspent
+
+    def get_coin(self, coin_hash):
+        return self.unspent.get(coin_hash)
+
+    def has_coin(self, coin):
+        '''
+        :param coin: Output object a Tx claims to spend
+        :return: True if that coin is unspent, and the chain has it locked
+        to the same wallet with the same amount
+        '''
+        chain_coin = self.unspent.get(coin.coin_hash)
+        return chain_coin is not None and chain_coin.lock == coin.lock and chain_coin.amount == coin.amount
+
+    def get_wallet_coins(self, wallet, offset=0, limit=None):
+        '''
+        :param wallet: STRING representing the target wallet
+        :return: List of up to limit of the wallet's unspent Output objects,
+        in wallet_coins order, skipping the first offset
+        '''
+        coins = self.wallet_coins.get(wallet, {}).values()
+        stop = None if limit is None else offset + limit
+        return list(itertools.islice(coins, offset, stop))
+
+    def count_wallet_coins(self, wallet):
+        return len(self.wallet_coins.get(wallet, {}))
+
+    def get_history(self, wallet, offset=0, limit=None):
+        '''
+        :param wallet: STRING representing the target wallet
+        :return: List of up to limit (height, tx_hash, received, sent) tuples,
+        newest first, skipping the first offset
+        '''
+        entries = self.history.get(wallet, [])
+        end = len(entries) - offset
+        start = 0 if limit is None else max(end - limit, 0)
+        return entries[start:max(end, 0)][::-1]
+
+    def count_history(self, wallet):
+        return len(self.history.get(wallet, []))
+
+    def json(self):
+        return {
+            'unspent': [coin.json() for coin in self.unspent.values()],
+            'spent': sorted(self.spent),
+            'history': self.history
+        }
+
+    def load_json(self, data):
+        '''
+        Replaces the index with the one in the dict made by json(), i.e. a
+        snapshot saved next to the block store
+        '''
+        self.clear()
+        for coin in data['unspent']:
+            self.add(Output.from_json(coin))
+        self.spent = set(data['spent'])
+        self.history = {wallet: [tuple(entry) for entry in entries]
+                        for wallet, entries in data['history'].items()}
+
+    def get_balance(self, wallet):
+        '''
+        :param wallet: STRING representing the target wallet
+        :return: int, the total amount of unspent coins locked to the wallet
+        '''
+        return self.balances.get(wallet, 0)
+
+
+class UTXOView():
+    '''
+    The unspent coins of a branch that isn't (yet) the active chain, i.e.
+    a UTXOSet with its newest blocks taken off and the branch's blocks put
+    on instead, without changing the UTXOSet. Used to check a branch's
+    blocks before switching to it.
+
+    Attributes
+    ----------
+    utxos: UTXOSet Object
+        Index of the active chain the branch forks off of
+
+    removed: Set
+        coin_hash of every coin unspent in utxos but not on the branch
+
+    added: Dict
+        coin_hash -> Output object for every coin unspent on the branch
+        but not in utxos
+    '''
+
+    def __init__(self, utxos, undos=()):
+        '''
+        :param undos: UndoRecords of the blocks of utxos the branch doesn't
+        have, i.e. every block after the fork point
+        '''
+
+        self.utxos = utxos
+        self.removed = set()
+        self.added = {}
+        for undo in undos:
+            self.removed.update(undo.added)
+            for coin_hash, coin in undo.spent:
+                if coin is not None:
+                    self.added[coin_hash] = coin
+
+        # A coin made and then spent after the fork point didn't exist at it
+        for coin_hash in self.removed:
+            self.added.pop(coin_hash, None)
+
+    def get_coin(self, coin_hash):
+        coin = self.added.get(coin_hash)
+        if coin is None and coin_hash not in self.removed:
+            coin = self.utxos.get_coin(coin_hash)
+        return coin
+
+    def valid_outputs(tx):
+        '''
+        Class method
+
+        :return: True if every coin the mined Tx makes is an Output object
+        of a positive int amount
+        '''
+        return all(isinstance(coin, Output) and type(coin.amount) is int and coin.amount > 0
+                   for coin in tx.sent_coins)
+
+    def check_block(self, block, reward):
+        '''
+        Checks the next block of the branch, and if it is valid applies it
+        to the view so the block after it can be checked. A block is valid
+        if:
+
+            1) Its first Tx, and only that one, is a reward Tx for its height
+            2) Every other Tx spends at least one coin, each unspent on the
+               branch (or made by an earlier Tx in the block) with the lock
+               and amount the Tx claims, and none spent twice
+            3) No Tx pays out more than it spends, and every coin made is a
+               positive int amount
+            4) The reward Tx pays exactly reward plus the fees of the others
+
+        Signatures aren't checked here, see verify.py
+
+        :param block: Block object
+        :param reward: int, what a reward Tx can pay on top of the fees
+        :return: True if the block is valid
+        '''
+
+        txs = block.transactions or []
+        if not txs or not txs[0].reward_coin or txs[0].height != block.index or \
+                any(tx.reward_coin for tx in txs[1:]):
+            return False
+
+        spent = set()
+        made = {}
+        fees = 0
+        for tx in txs[1:]:
+            if not tx.owned_coins or not UTXOView.valid_outputs(tx):
+                return False
+
+            amount_in = 0
+            for coin in tx.owned_coins:
+                branch_coin = made.get(coin.coin_hash) or self.get_coin(coin.coin_hash)
+                if branch_coin is None or coin.coin_hash in spent or \
+                        branch_coin.lock != coin.lock or branch_coin.amount != coin.amount:
+                    return False
+                spent.add(coin.coin_hash)
+                amount_in += branch_coin.amount
+
+            amount_out = sum(coin.amount for coin in tx.sent_coins)
+            if amount_out > amount_in:
+                return False
+            fees += amount_in - amount_out
+            for coin in tx.sent_coins:
+                made[coin.coin_hash] = coin
+
+        if not UTXOView.valid_outputs(txs[0]) or sum(coin.amount for coin in txs[0].sent_coins) != reward + fees:
+            return False
+
+        for coin_hash in spent:
+            self.added.pop(coin_hash, None)
+            self.removed.add(coin_hash)
+        for coin in txs[0].sent_coins + list(made.values()):
+            if coin.coin_hash not in spent:
+                self.removed.discard(coin.coin_hash)
+                self.added[coin.coin_hash] = coin
+        return True
+
+
+class UndoRecord():
+    '''
+    What applying one block changed in a UTXOSet, so it can be reversed
+    without replaying the chain.
+
+    Attributes
+    ----------
+    added: List
+        coin_hash of every coin the block added to the unspent set
+
+    spent: List
+        (coin_hash, Output object or None) of every coin the block newly
+        marked as spent, with the Output it took out of the unspent set
+
+    history: List
+        Wallet STRING of every history entry the block added
+    '''
+
+    def __init__(self):
+        self.added = []
+        self.spent = []
+        self.history = []
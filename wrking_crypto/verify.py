@@ -0,0 +1,130 @@
+'''
+Primary Purpose: Batch signature verification for whole blocks or chains,
+i.e. one received from another node in BlockChain.replace_chain().
+
+Every (puk, message, sig) triple, the message being the Tx's
+signature_message() for the coin, that isn't already in
+User.verified_cache is checked across a pool of processes, the results
+go back into the cache, and then each Tx is checked the normal way with
+Tx.check_Owner(), which now only hits the cache.
+
+The pool's processes are started fresh rather than forked (see
+START_METHOD), so like any multiprocessing code, a script that ends up
+using it needs its top level code under if __name__ == '__main__'.
+'''
+
+import multiprocessing
+import os
+
+from Crypto.PublicKey import RSA
+
+from wrking_crypto.user import User
+
+'''
+MIN_PARALLEL: int
+    Below this many uncached signatures, starting a process pool costs
+    more than it saves, so they are checked on this process.
+
+START_METHOD: STRING
+    How the pool's processes are started. Not fork: the node serves
+    requests from many threads, and a forked child inherits any lock
+    another thread held at that moment, locked forever.
+'''
+MIN_PARALLEL = 32
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def collect_signatures(blocks):
+    '''
+    :param blocks: List of Block objects
+    :return: List of (puk, message, sig) tuples for every Input of every
+    non reward Tx in the blocks, skipping any already in User.verified_cache
+    '''
+
+    triples = []
+    seen = set()
+    for block in blocks:
+        if not block.transactions:
+            continue
+        for tx in block.transactions:
+            if tx.reward_coin or not tx.unlock:
+                continue
+            for inp in tx.unlock:
+                puk = inp.puk.encode('UTF-8') if isinstance(inp.puk, str) else inp.puk
+                sig = bytes(inp.sig)
+                message = tx.signature_message(inp.coin_hash)
+                triple = (puk, message, sig)
+                if triple in seen or (message, puk, sig) in User.verified_cache:
+                    continue
+                seen.add(triple)
+                triples.append(triple)
+    return triples
+
+
+def check_triple(triple):
+    '''
+    Worker function, checks one signature without touching the caches
+    (or their locks) of the parent process
+
+    :return: True if the signature is valid
+    '''
+    puk, message, sig = triple
+    try:
+        puk_obj = RSA.import_key(puk)
+    except (ValueError, IndexError, TypeError):
+        return False
+    return User.check_signature(puk_obj, message, sig)
+
+
+def verify_signatures(triples, processes=None):
+    '''
+    Checks every triple, in parallel if there are enough of them, and
+    stores the results in User.verified_cache
+
+    :param triples: List of (puk, message, sig) tuples
+    :param processes: Number of worker processes, defaults to every core
+    :return: List of booleans, one per triple
+    '''
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(triples) < MIN_PARALLEL:
+        results = [check_triple(triple) for triple in triples]
+    else:
+        chunksize = max(1, len(triples) // (processes * 4))
+        with multiprocessing.get_context(START_METHOD).Pool(processes) as pool:
+            results = pool.map(check_triple, triples, chunksize)
+
+    for (puk, message, sig), result in zip(triples, results):
+        User.verified_cache.put((message, puk, sig), result)
+
+    return results
+
+
+def verify_blocks(blocks, processes=None):
+    '''
+    Batch checks that every Input of every Tx in the blocks unlocks its coin
+
+    :param blocks: List of Block objects
+    :param processes: Number of worker processes, defaults to every core
+    :return: Dict of tx_hash -> True/False for every non reward Tx
+    '''
+
+    verify_signatures(collect_signatures(blocks), processes)
+
+    results = {}
+    for block in blocks:
+        if not block.transactions:
+            continue
+        for tx in block.transactions:
+            if tx.reward_coin:
+                continue
+            results[tx.tx_hash] = tx.check_unlocks()
+    return results
+
+
+def verify_block(block, processes=None):
+    return verify_blocks([block], processes)
+
+
+def verify_chain(chain, processes=None):
+    return verify_blocks(chain, processes)